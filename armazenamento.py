@@ -0,0 +1,438 @@
+"""
+Motores de armazenamento do Gerenciador de Chamadas.
+
+O backend trabalha sempre com os DataFrames das seis abas da planilha; o motor
+decide de onde eles são lidos e como as alterações são persistidas.
+
+- MotorExcel: a planilha 'chamadaBelaVista.xlsx' é o banco de dados vivo.
+- MotorSQLite: um arquivo SQLite com tabelas indexadas é o banco de dados vivo
+  e a planilha passa a ser apenas formato de importação/exportação.
+"""
+import os
+import re
+import sqlite3
+import tempfile
+import zipfile
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional
+
+import pandas as pd
+
+from instantaneo import InstantaneoPlanilha
+from planilha_xml import EscritaParcialIndisponivel, reescrever_abas
+
+# Ordem em que as abas são gravadas na planilha
+ABAS = ['Alunos', 'Turmas', 'Categorias', 'Registros', 'Justificativas', 'Exclusões']
+
+# Identificador inteiro e estável de cada aluno (Alunos, Exclusões e Registros); não muda ao renomear
+COLUNA_ID = 'ID'
+
+# Colunas de data da aba Registros (uma coluna por dia de aula)
+PADRAO_COLUNA_DATA = re.compile(r'^\d{2}/\d{2}/\d{4}$')
+
+
+def eh_coluna_data(coluna) -> bool:
+    """Indica se a coluna da aba Registros representa um dia de aula (dd/mm/yyyy)."""
+    return isinstance(coluna, str) and bool(PADRAO_COLUNA_DATA.match(coluna))
+
+
+def eh_data_valida(valor) -> bool:
+    """Indica se o valor é uma data dd/mm/yyyy que existe no calendário (ex.: recusa '31/02/2026')."""
+    if not eh_coluna_data(valor):
+        return False
+    try:
+        datetime.strptime(valor, '%d/%m/%Y')
+    except ValueError:
+        return False
+    return True
+
+
+class Alteracoes:
+    """
+    Conjunto das linhas gravadas ou removidas por aba em uma mutação.
+
+    As linhas são identificadas pelo rótulo do índice do DataFrame, que os
+    endpoints mantêm estável (novas linhas recebem o maior rótulo + 1).
+    """
+
+    def __init__(self):
+        self.gravadas: Dict[str, set] = {}
+        self.removidas: Dict[str, set] = {}
+        self.substituidas: set = set()
+
+    def gravar(self, aba: str, rotulos: Iterable) -> "Alteracoes":
+        self.gravadas.setdefault(aba, set()).update(rotulos)
+        return self
+
+    def remover(self, aba: str, rotulos: Iterable) -> "Alteracoes":
+        self.removidas.setdefault(aba, set()).update(rotulos)
+        return self
+
+    def substituir(self, aba: str) -> "Alteracoes":
+        """Marca a aba inteira para ser regravada (ex.: importação)."""
+        self.substituidas.add(aba)
+        return self
+
+    def mesclar(self, outra: "Alteracoes") -> "Alteracoes":
+        """Acumula as alterações de outra mutação (usado para agrupar gravações)."""
+        for aba, rotulos in outra.gravadas.items():
+            self.gravar(aba, rotulos)
+        for aba, rotulos in outra.removidas.items():
+            self.remover(aba, rotulos)
+        self.substituidas |= outra.substituidas
+        return self
+
+    @property
+    def abas(self) -> set:
+        """Abas tocadas pela mutação."""
+        return set(self.gravadas) | set(self.removidas) | self.substituidas
+
+
+def escrever_xlsx(dados: Dict[str, pd.DataFrame], destino) -> None:
+    """Grava todas as abas em um arquivo (ou buffer) .xlsx."""
+    with pd.ExcelWriter(destino, engine='openpyxl') as writer:  # type: ignore
+        for aba in ABAS:
+            if aba in dados:
+                dados[aba].to_excel(writer, sheet_name=aba, index=False)
+
+
+def escrever_xlsx_atomico(dados: Dict[str, pd.DataFrame], caminho: str) -> None:
+    """
+    Grava a planilha em um arquivo temporário no mesmo diretório e só então o
+    instala no lugar do original com os.replace(). Uma queda no meio da escrita
+    deixa a planilha anterior intacta, e quem lê vê o arquivo antigo ou o novo,
+    nunca um arquivo pela metade.
+    """
+    diretorio = os.path.dirname(os.path.abspath(caminho))
+    descritor, temporario = tempfile.mkstemp(suffix='.xlsx.tmp', dir=diretorio)
+    try:
+        with os.fdopen(descritor, 'wb') as saida:
+            escrever_xlsx(dados, saida)
+            saida.flush()
+            os.fsync(saida.fileno())
+        os.replace(temporario, caminho)
+    except BaseException:
+        if os.path.exists(temporario):
+            os.remove(temporario)
+        raise
+
+
+def ler_xlsx(origem, abas: Optional[Iterable[str]] = None) -> Dict[str, pd.DataFrame]:
+    """
+    Lê as abas pedidas (todas as conhecidas se 'abas' for None) de um arquivo .xlsx.
+    Abas ausentes na planilha são omitidas; as não pedidas nem são interpretadas.
+    """
+    pedidas = ABAS if abas is None else [aba for aba in ABAS if aba in set(abas)]
+    # Fecha o arquivo ao terminar: no Windows um arquivo aberto impede o os.replace() do gravador
+    with pd.ExcelFile(origem, engine='openpyxl') as xls:
+        return {aba: pd.read_excel(xls, sheet_name=aba) for aba in pedidas if aba in xls.sheet_names}
+
+
+class MotorArmazenamento:
+    """Interface comum aos motores de armazenamento."""
+
+    nome = ""
+    # Verdadeiro se salvar() grava só as linhas listadas em Alteracoes.gravadas (e não a aba inteira)
+    grava_linhas = False
+
+    def versao(self) -> float:
+        """Marca de modificação da origem dos dados (usada para detectar alterações externas)."""
+        raise NotImplementedError
+
+    def carregar(self, abas: Optional[Iterable[str]] = None) -> Dict[str, pd.DataFrame]:
+        """Retorna os DataFrames brutos das abas pedidas (todas se None) que existirem."""
+        raise NotImplementedError
+
+    def salvar(self, dados: Dict[str, pd.DataFrame], alteracoes: Alteracoes) -> None:
+        """Persiste as alterações descritas em 'alteracoes' a partir do estado em 'dados'."""
+        raise NotImplementedError
+
+
+class MotorExcel(MotorArmazenamento):
+    """Usa a própria planilha como banco de dados (comportamento original)."""
+
+    nome = "excel"
+
+    def __init__(self, caminho: str, instantaneo: Optional[str] = None):
+        self.caminho = caminho
+        # Cópia binária das abas interpretadas, reaproveitada enquanto a planilha não mudar
+        self.instantaneo = InstantaneoPlanilha(caminho, instantaneo) if instantaneo else None
+
+    def versao(self) -> float:
+        return os.path.getmtime(self.caminho) if os.path.exists(self.caminho) else 0
+
+    def carregar(self, abas: Optional[Iterable[str]] = None) -> Dict[str, pd.DataFrame]:
+        abas = ABAS if abas is None else list(abas)
+        if self.instantaneo is None:
+            return ler_xlsx(self.caminho, abas)
+        return self.instantaneo.carregar(lambda faltando: ler_xlsx(self.caminho, faltando), abas)
+
+    def salvar(self, dados: Dict[str, pd.DataFrame], alteracoes: Alteracoes) -> None:
+        # O xlsx não permite gravar linhas isoladas, mas permite regravar só as abas alteradas
+        abas = {aba: dados[aba] for aba in ABAS if aba in alteracoes.abas and aba in dados}
+        existia = os.path.exists(self.caminho)
+        anterior = self.instantaneo.identificacao() if self.instantaneo is not None and existia else {}
+        if abas and existia:
+            try:
+                reescrever_abas(self.caminho, abas)
+                self._atualizar_instantaneo(anterior, abas)
+                return
+            except (EscritaParcialIndisponivel, zipfile.BadZipFile, KeyError):
+                pass  # Pasta de trabalho incompatível ou corrompida: reescreve tudo
+        # As abas que o backend ainda não carregou são copiadas da planilha atual
+        faltando = [aba for aba in ABAS if aba not in dados]
+        if faltando and existia:
+            dados = {**ler_xlsx(self.caminho, faltando), **dados}
+        escrever_xlsx_atomico(dados, self.caminho)
+        self._atualizar_instantaneo(anterior, {aba: dados[aba] for aba in ABAS if aba in dados})
+
+    def _atualizar_instantaneo(self, anterior: Dict[str, object], gravadas: Dict[str, pd.DataFrame]) -> None:
+        """A planilha foi gravada por nós: o instantâneo recebe as abas gravadas em vez de ficar inválido."""
+        if self.instantaneo is not None:
+            self.instantaneo.atualizar(anterior, gravadas)
+
+
+def _valor_sql(valor):
+    """Converte um valor de célula do pandas para um tipo aceito pelo sqlite3."""
+    if valor is None:
+        return None
+    if isinstance(valor, (pd.Timestamp, datetime)):
+        return None if pd.isna(valor) else valor.isoformat(sep=' ')
+    if hasattr(valor, 'item'):  # escalares numpy
+        valor = valor.item()
+    if isinstance(valor, float) and valor != valor:
+        return None
+    try:
+        if pd.isna(valor):
+            return None
+    except (TypeError, ValueError):
+        pass
+    if isinstance(valor, (str, int, float, bytes)):
+        return valor
+    return str(valor)
+
+
+PADRAO_DATA_GRAVADA = r'\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}(\.\d+)?'
+
+
+def _restaurar_datas(serie: pd.Series) -> pd.Series:
+    """
+    Converte de volta para Timestamp os valores gravados por _valor_sql, mantendo
+    como texto o que já era texto (igual ao que o openpyxl devolve da planilha).
+    """
+    serie = serie.astype(object)
+    gravadas = serie.astype(str).str.fullmatch(PADRAO_DATA_GRAVADA)
+    if gravadas.any():
+        serie[gravadas] = list(pd.to_datetime(serie[gravadas]))
+    return serie
+
+
+def _data_iso(data_str: str) -> str:
+    """dd/mm/yyyy -> yyyy-mm-dd (ordenável no índice do SQLite)."""
+    dia, mes, ano = data_str.split('/')
+    return f"{ano}-{mes}-{dia}"
+
+
+def _data_br(data_iso: str) -> str:
+    """yyyy-mm-dd -> dd/mm/yyyy."""
+    ano, mes, dia = data_iso.split('-')
+    return f"{dia}/{mes}/{ano}"
+
+
+def _q(identificador: str) -> str:
+    """Cita um identificador SQL (nomes de coluna vêm da planilha)."""
+    return '"' + str(identificador).replace('"', '""') + '"'
+
+
+class MotorSQLite(MotorArmazenamento):
+    """
+    Mantém as abas em tabelas SQLite indexadas e grava apenas as linhas afetadas.
+
+    A aba Registros é guardada em formato longo: 'registros_linhas' contém as
+    colunas de identificação (Nome, ...) e 'registros' uma linha por
+    (linha, data, status), de modo que salvar uma chamada toca apenas as
+    células do aluno alterado.
+    """
+
+    nome = "sqlite"
+    grava_linhas = True
+
+    TABELAS = {
+        'Alunos': 'alunos',
+        'Turmas': 'turmas',
+        'Categorias': 'categorias',
+        'Registros': 'registros_linhas',
+        'Justificativas': 'justificativas',
+        'Exclusões': 'exclusoes',
+    }
+    INDICES = {
+        'alunos': [('Nome',), ('Turma', 'Horário', 'Professor'), (COLUNA_ID,)],
+        'turmas': [('Turma', 'Horário', 'Professor')],
+        'registros_linhas': [('Nome',), (COLUNA_ID,)],
+        'justificativas': [('Nome',), ('Data',)],
+        'exclusoes': [('Nome',), (COLUNA_ID,)],
+    }
+
+    def __init__(self, caminho: str, planilha_inicial: Optional[str] = None):
+        self.caminho = caminho
+        novo = not os.path.exists(caminho)
+        with self._conectar() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS _colunas (tabela TEXT, coluna TEXT, tipo TEXT, PRIMARY KEY (tabela, coluna))")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS registros ("
+                "linha INTEGER NOT NULL, data TEXT NOT NULL, status TEXT, "
+                "PRIMARY KEY (linha, data)) WITHOUT ROWID"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_registros_data ON registros (data)")
+        # Na primeira execução o banco é populado a partir da planilha existente
+        if novo and planilha_inicial and os.path.exists(planilha_inicial):
+            self.importar_xlsx(planilha_inicial)
+
+    @contextmanager
+    def _conectar(self) -> Iterator[sqlite3.Connection]:
+        """Abre uma conexão com uma transação: confirma ao sair ou desfaz em caso de erro."""
+        conn = sqlite3.connect(self.caminho, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def versao(self) -> float:
+        return os.path.getmtime(self.caminho) if os.path.exists(self.caminho) else 0
+
+    # --- Esquema ---
+    def _colunas(self, conn, tabela: str) -> List[str]:
+        return [linha[1] for linha in conn.execute(f"PRAGMA table_info({_q(tabela)})") if linha[1] != '_id']
+
+    def _tipos_data(self, conn, tabela: str) -> set:
+        return {c for (c,) in conn.execute("SELECT coluna FROM _colunas WHERE tabela = ? AND tipo = 'data'", (tabela,))}
+
+    def _garantir_tabela(self, conn, tabela: str, df: pd.DataFrame) -> List[str]:
+        """Cria a tabela/colunas que faltam para acomodar as colunas do DataFrame."""
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {_q(tabela)} (_id INTEGER PRIMARY KEY)")
+        existentes = self._colunas(conn, tabela)
+        for coluna in df.columns:
+            if tabela == 'registros_linhas' and eh_coluna_data(coluna):
+                continue
+            if str(coluna) not in existentes:
+                conn.execute(f"ALTER TABLE {_q(tabela)} ADD COLUMN {_q(coluna)}")
+                existentes.append(str(coluna))
+            serie = df[coluna]
+            eh_data = pd.api.types.is_datetime64_any_dtype(serie) or any(
+                isinstance(v, (pd.Timestamp, datetime)) for v in serie.head(20)
+            )
+            if eh_data:
+                conn.execute("INSERT OR REPLACE INTO _colunas VALUES (?, ?, 'data')", (tabela, str(coluna)))
+        for num, cols in enumerate(self.INDICES.get(tabela, [])):
+            if all(c in existentes for c in cols):
+                conn.execute(
+                    f"CREATE INDEX IF NOT EXISTS {_q(f'idx_{tabela}_{num}')} ON {_q(tabela)} ({', '.join(_q(c) for c in cols)})"
+                )
+        return existentes
+
+    # --- Leitura ---
+    def carregar(self, abas: Optional[Iterable[str]] = None) -> Dict[str, pd.DataFrame]:
+        pedidas = set(self.TABELAS if abas is None else abas)
+        dados: Dict[str, pd.DataFrame] = {}
+        with self._conectar() as conn:
+            tabelas = {t for (t,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+            for aba, tabela in self.TABELAS.items():
+                if aba not in pedidas or tabela not in tabelas:
+                    continue
+                df = pd.read_sql_query(f"SELECT * FROM {_q(tabela)} ORDER BY _id", conn, index_col='_id')
+                df.index.name = None
+                for coluna in self._tipos_data(conn, tabela):
+                    if coluna in df.columns:
+                        df[coluna] = _restaurar_datas(df[coluna])
+                if aba == 'Registros':
+                    df = self._montar_registros(conn, df)
+                dados[aba] = df
+        return dados
+
+    def _montar_registros(self, conn, df_linhas: pd.DataFrame) -> pd.DataFrame:
+        """Reconstrói a aba Registros no formato largo (uma coluna por data)."""
+        celulas = pd.read_sql_query("SELECT linha, data, status FROM registros ORDER BY data", conn)
+        # Datas de chamada sem nenhuma célula preenchida também são colunas da aba
+        datas = {d for (d,) in conn.execute("SELECT coluna FROM _colunas WHERE tabela = 'registros'")}
+        datas |= set(celulas['data'])
+        if not datas:
+            return df_linhas
+        largo = celulas.pivot(index='linha', columns='data', values='status').reindex(columns=sorted(datas))
+        largo.columns = [_data_br(c) for c in largo.columns]
+        return df_linhas.join(largo, how='left').astype({c: object for c in largo.columns})
+
+    # --- Escrita ---
+    def salvar(self, dados: Dict[str, pd.DataFrame], alteracoes: Alteracoes) -> None:
+        with self._conectar() as conn:  # uma transação por mutação
+            for aba in alteracoes.abas:
+                if aba not in self.TABELAS or aba not in dados:
+                    continue
+                df = dados[aba]
+                tabela = self.TABELAS[aba]
+                colunas = self._garantir_tabela(conn, tabela, df)
+                if aba in alteracoes.substituidas:
+                    conn.execute(f"DELETE FROM {_q(tabela)}")
+                    if aba == 'Registros':
+                        conn.execute("DELETE FROM registros")
+                    rotulos = list(df.index)
+                else:
+                    removidos = [int(r) for r in alteracoes.removidas.get(aba, ())]
+                    if removidos:
+                        marcadores = ','.join('?' * len(removidos))
+                        conn.execute(f"DELETE FROM {_q(tabela)} WHERE _id IN ({marcadores})", removidos)
+                        if aba == 'Registros':
+                            conn.execute(f"DELETE FROM registros WHERE linha IN ({marcadores})", removidos)
+                    rotulos = [r for r in alteracoes.gravadas.get(aba, ()) if r in df.index]
+                self._gravar_linhas(conn, tabela, df, colunas, rotulos, registros=(aba == 'Registros'))
+
+    def _gravar_linhas(self, conn, tabela: str, df: pd.DataFrame, colunas: List[str], rotulos: list, registros: bool) -> None:
+        if not rotulos:
+            return
+        colunas_df = [c for c in colunas if c in df.columns]
+        sql = (
+            f"INSERT OR REPLACE INTO {_q(tabela)} (_id{''.join(', ' + _q(c) for c in colunas_df)}) "
+            f"VALUES (?{', ?' * len(colunas_df)})"
+        )
+        parte = df.loc[rotulos]
+        conn.executemany(
+            sql,
+            [[int(r)] + [_valor_sql(v) for v in linha] for r, linha in zip(rotulos, parte[colunas_df].itertuples(index=False))],
+        )
+        if not registros:
+            return
+        # Células de presença: regrava apenas as datas das linhas afetadas
+        datas = [c for c in df.columns if eh_coluna_data(c)]
+        conn.executemany(
+            "INSERT OR IGNORE INTO _colunas VALUES ('registros', ?, 'data')", [(_data_iso(d),) for d in datas]
+        )
+        marcadores = ','.join('?' * len(rotulos))
+        conn.execute(f"DELETE FROM registros WHERE linha IN ({marcadores})", [int(r) for r in rotulos])
+        celulas = []
+        for rotulo, linha in zip(rotulos, parte[datas].itertuples(index=False)):
+            for data, status in zip(datas, linha):
+                status = _valor_sql(status)
+                if status not in (None, ''):
+                    celulas.append((int(rotulo), _data_iso(data), status))
+        conn.executemany("INSERT INTO registros (linha, data, status) VALUES (?, ?, ?)", celulas)
+
+    # --- Importação/Exportação ---
+    def importar_xlsx(self, origem) -> Dict[str, pd.DataFrame]:
+        """Substitui o conteúdo do banco pelas abas de uma planilha."""
+        dados = ler_xlsx(origem)
+        alteracoes = Alteracoes()
+        for aba, df in dados.items():
+            dados[aba] = df.reset_index(drop=True)
+            alteracoes.substituir(aba)
+        self.salvar(dados, alteracoes)
+        return dados
+
+
+def criar_motor(nome: str, planilha: str, banco: str, instantaneo: Optional[str] = None) -> MotorArmazenamento:
+    """Instancia o motor configurado ('excel' ou 'sqlite')."""
+    if nome == MotorSQLite.nome:
+        return MotorSQLite(banco, planilha_inicial=planilha)
+    if nome == MotorExcel.nome:
+        return MotorExcel(planilha, instantaneo=instantaneo)
+    raise ValueError(f"Motor de armazenamento desconhecido: '{nome}'")
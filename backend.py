@@ -1,14 +1,27 @@
+import numpy as np
 import pandas as pd
 from fastapi import FastAPI, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
-from datetime import datetime, timedelta
-import calendar
+from fastapi.responses import Response, StreamingResponse
+from datetime import date, datetime, timedelta
 from pydantic import BaseModel
-from typing import List, Dict, Tuple, Optional
+from typing import Callable, List, Dict, Iterable, Iterator, Tuple, Optional
 import time, os
+import contextlib
+import functools
 import io
+import threading
 from urllib.parse import unquote
+from armazenamento import ABAS, COLUNA_ID, Alteracoes, criar_motor, escrever_xlsx, eh_coluna_data, eh_data_valida
+from calendario import datas_de_aula
+from diario import CompactadorDiario, DiarioChamada
+from fila_escrita import FalhaPersistencia, FilaEscrita
+from fila_relatorios import ERRO, FilaRelatorios, TarefaRelatorio
+from frequencia import TabelaFrequencia
+from indices import IndiceAlunos, IndiceJustificativas, IndiceTurmas, ids_da_aba, proximo_id
+from monitor_cache import CargaUnica, MonitorArquivo, Revalidador
+from relatorios import (OPENPYXL_DISPONIVEL, CacheRelatorios, ModeloRelatorio, modelo_relatorio, relatorio_consolidado,
+                        relatorio_turma)
 
 # --- INICIALIZAÇÃO DO APP FASTAPI ---
 app = FastAPI(
@@ -29,99 +42,690 @@ app.add_middleware(
 # --- CONSTANTES E FUNÇÕES AUXILIARES ---
 NOME_ARQUIVO = 'chamadaBelaVista.xlsx'
 TEMPLATE_RELATORIO = 'relatorioChamada.xlsx'
-CACHE_EXPIRATION_SECONDS = 60  # Recarrega os dados do Excel a cada 60 segundos
-_cache: Dict[str, any] = {"data": None, "timestamp": 0}
+NOME_BANCO = 'chamadaBelaVista.db'
+# Instantâneo binário das abas interpretadas (motor Excel): evita reinterpretar a planilha inalterada
+NOME_INSTANTANEO = 'chamadaBelaVista.cache.pkl'
+# Motor de armazenamento: 'excel' (a planilha é o banco) ou 'sqlite' (a planilha vira importação/exportação)
+MOTOR_ARMAZENAMENTO = os.environ.get('CHAMADA_MOTOR', 'excel')
+# Abas com mais de CHAMADA_CACHE_TTL segundos são recarregadas em segundo plano (padrão: 60)
+CACHE_EXPIRATION_SECONDS = float(os.environ.get('CHAMADA_CACHE_TTL', 60))
+# Como perceber modificações externas do arquivo: 'consulta' (data do arquivo a cada requisição)
+# ou 'observador' (notificações do watchdog, se instalado; senão consulta periódica em segundo plano)
+CACHE_MONITOR = os.environ.get('CHAMADA_CACHE_MONITOR', 'consulta')
+CACHE_MONITOR_INTERVALO = 1.0  # Segundos entre consultas do observador sem watchdog
+# Diário das chamadas: confirmado em disco a cada POST e incorporado à aba Registros em segundo plano
+NOME_DIARIO = 'chamadaBelaVista.diario.jsonl'
+DIARIO_INTERVALO_COMPACTACAO = 30  # Segundos entre compactações
+DIARIO_LIMITE_ENTRADAS = 500  # Compacta antes do intervalo se o diário atingir este tamanho
+# Segundos que uma alteração pode aguardar na fila antes de ser gravada (padrão: 0.5)
+ESCRITA_LATENCIA_MAXIMA = float(os.environ.get('CHAMADA_ESCRITA_LATENCIA', 0.5))
+# Segundos que /api/sincronizar aguarda a gravação (padrão: 60)
+ESCRITA_TIMEOUT_SINCRONIZAR = float(os.environ.get('CHAMADA_ESCRITA_TIMEOUT', 60))
+# Segundos que /api/importar aguarda a gravação pendente; ela segura a trava de escrita (padrão: 30)
+ESCRITA_TIMEOUT_IMPORTAR = float(os.environ.get('CHAMADA_IMPORTAR_TIMEOUT', 30))
+# Relatórios consolidados em segundo plano (/api/relatorio/tarefas): processos que geram as abas
+# (0 gera na própria thread da fila) e quanto dos relatórios prontos fica guardado para download
+RELATORIOS_PROCESSOS = int(os.environ.get('CHAMADA_RELATORIOS_PROCESSOS', min(4, os.cpu_count() or 1)))
+RELATORIOS_LIMITE_BYTES = int(float(os.environ.get('CHAMADA_RELATORIOS_LIMITE_MB', 64)) * 1024 * 1024)
+RELATORIOS_RETENCAO = 3600  # Segundos que um relatório pronto fica disponível para download
+# Relatórios já gerados servidos de novo enquanto as abas lidas não mudarem (limite em MB)
+RELATORIOS_CACHE_BYTES = int(float(os.environ.get('CHAMADA_RELATORIOS_CACHE_MB', 32)) * 1024 * 1024)
+# Ordem das abas na tupla retornada por get_dados_cached
+ABAS_CACHE = ['Alunos', 'Turmas', 'Registros', 'Categorias', 'Justificativas', 'Exclusões']
+# Colunas das abas opcionais quando elas não existem na planilha
+COLUNAS_ABAS_OPCIONAIS = {
+    'Categorias': ['Categoria', 'Idade Mínima', 'Idade Máxima'],
+    'Registros': ['Nome'],
+    'Justificativas': ['Nome', 'Data', 'Motivo'],
+    'Exclusões': ['Nome', 'Turma', 'Horário', 'Professor', 'Data Exclusão'],
+}
+# Abas carregadas junto com cada aba: as categorias derivam a categoria do aluno, as exclusões
+# reservam os IDs já usados e os alunos ligam as linhas de Registros (e o diário) aos IDs
+DEPENDENCIAS_ABAS = {'Alunos': ['Categorias', 'Exclusões'], 'Registros': ['Alunos']}
+# Abas cujas células vazias são servidas como "" (e não NaN)
+ABAS_SEM_VAZIOS = ('Alunos', 'Turmas', 'Justificativas', 'Exclusões')
+# Abas que recebem a coluna 'Horario_Formatado' ao serem instaladas no cache (os endpoints só a leem)
+ABAS_COM_HORARIO = ('Alunos', 'Turmas')
+# Status contados nos resumos de frequência e o nome de cada coluna na resposta
+COLUNAS_FREQUENCIA = {'c': 'Presenças (C)', 'f': 'Faltas (F)', 'j': 'Faltas Justificadas (J)'}
+# Abas lidas pelos relatórios em Excel: relê-las do arquivo invalida todos os relatórios guardados
+ABAS_RELATORIO = ('Alunos', 'Turmas', 'Registros', 'Justificativas')
+# Colunas de Alunos que identificam a turma de um aluno (a chave de IndiceTurmas)
+COLUNAS_TURMA = ['Turma', 'Horario_Formatado', 'Professor']
+# Cada aba é carregada sob demanda e tem sua própria validade:
+# "abas" guarda os DataFrames e "validade" a versão do motor e o instante em que cada uma foi carregada.
+# Cada instalação de abas (leitura ou escrita) cria uma nova "geracao"; "versoes" guarda,
+# por aba, a geração em que ela mudou pela última vez. "indices" guarda, por nome, o índice
+# montado para o DataFrame atual de uma aba (ver _indice). Para o cache de relatórios,
+# "turmas_alteradas" guarda a geração da última mudança de cada turma, por chave de turma
+# (todos os meses) ou por (chave, ano, mes), e "versao_relatorios" a da última mudança
+# que pode afetar qualquer relatório (ex.: releitura da planilha, virada do dia).
+_cache: Dict[str, any] = {"abas": {}, "validade": {}, "diario_seq": 0, "geracao": 0, "versoes": {}, "indices": {},
+          "idades_em": None, "turmas_alteradas": {}, "versao_relatorios": 0}
+_trava_cache = threading.Lock()
+# Serializa os escritores (ler -> modificar -> instalar no cache). Leitores nunca a aguardam:
+# enquanto um escritor trabalha eles continuam servindo o retrato anterior do cache.
+_trava_escrita = threading.RLock()
+_trava_compactacao = threading.Lock()
+motor = criar_motor(MOTOR_ARMAZENAMENTO, NOME_ARQUIVO, NOME_BANCO, NOME_INSTANTANEO)
+diario = DiarioChamada(NOME_DIARIO)
+
+def calcular_idades(datas_nascimento: pd.Series, hoje: date) -> pd.Series:
+    """Calcula as idades (NaN sem data de nascimento válida) na data 'hoje'."""
+    nascimentos = pd.to_datetime(datas_nascimento, errors='coerce')
+    # Subtrai o ano de nascimento do ano atual e, em seguida, 1 se o aniversário deste ano ainda não ocorreu
+    antes_do_aniversario = (nascimentos.dt.month > hoje.month) | (
+        (nascimentos.dt.month == hoje.month) & (nascimentos.dt.day > hoje.day))
+    return hoje.year - nascimentos.dt.year - antes_do_aniversario.astype(int)
+
+def _limites_categoria(df_categorias: pd.DataFrame, coluna: str, padrao: float) -> np.ndarray:
+    """Coluna de limites das regras de categoria como float ('padrao' se a coluna não existir)."""
+    if coluna not in df_categorias.columns:
+        return np.full(len(df_categorias), padrao)
+    return pd.to_numeric(df_categorias[coluna], errors='coerce').to_numpy(float)
+
+def definir_categorias_por_idade(idades: pd.Series, df_categorias: pd.DataFrame) -> pd.Series:
+    """
+    Define a categoria de cada idade pela primeira regra da tabela de categorias
+    em que Idade Mínima <= idade <= Idade Máxima ("Não definida" se nenhuma servir).
+
+    Os limites das regras dividem a reta em intervalos elementares (cada limite
+    e o trecho entre dois limites consecutivos) nos quais a regra escolhida não
+    muda: a categoria é decidida uma vez por intervalo e cada idade localiza o
+    seu com searchsorted.
+    """
+    if df_categorias.empty:
+        return pd.Series("Não definida", index=idades.index, dtype=object)
+    minimos = _limites_categoria(df_categorias, 'Idade Mínima', 0)
+    maximos = _limites_categoria(df_categorias, 'Idade Máxima', np.inf)
+    if 'Categoria' in df_categorias.columns:
+        nomes = df_categorias['Categoria'].tolist()
+    else:
+        nomes = ["Não definida"] * len(df_categorias)
+
+    limites = np.unique(np.concatenate([minimos, maximos]))
+    limites = limites[np.isfinite(limites)]
+    if not len(limites):
+        limites = np.array([0.0])  # Um limite a mais não altera o resultado
+    # Representante de cada intervalo: posição 2i = trecho antes de limites[i]; 2i+1 = o próprio limites[i]
+    representantes = np.empty(2 * len(limites) + 1)
+    representantes[0::2] = np.concatenate([[limites[0] - 1], (limites[:-1] + limites[1:]) / 2, [limites[-1] + 1]])
+    representantes[1::2] = limites
+    # Primeira regra que contém cada representante (limites vazios/NaN nunca satisfazem a regra)
+    servem = (minimos <= representantes[:, None]) & (representantes[:, None] <= maximos)
+    primeira = np.where(servem.any(axis=1), servem.argmax(axis=1), -1)
+    categoria_do_intervalo = np.array([nomes[r] if r >= 0 else "Não definida" for r in primeira], dtype=object)
+
+    valores = idades.to_numpy(float)
+    posicao = np.searchsorted(limites, valores)
+    exata = limites[np.minimum(posicao, len(limites) - 1)] == valores
+    categorias = categoria_do_intervalo[2 * posicao + exata]
+    categorias[np.isnan(valores)] = "Não definida"
+    return pd.Series(categorias, index=idades.index, dtype=object)
+
+def _derivar_alunos(df_alunos: pd.DataFrame, df_categorias: pd.DataFrame, rotulos=None) -> pd.DataFrame:
+    """
+    Calcula as colunas derivadas de Alunos (idade e categoria) a partir da data de nascimento.
+    Com 'rotulos', recalcula apenas essas linhas (as demais já estão derivadas).
+    Chamada com _trava_cache: registra em _cache["idades_em"] o dia das idades calculadas.
+    """
+    # --- CÁLCULO DE IDADE E CATEGORIA ---
+    hoje = date.today()
+    if rotulos is None or 'Idade' not in df_alunos.columns or 'Categoria' not in df_alunos.columns:
+        rotulos = df_alunos.index
+        _cache["idades_em"] = hoje
+    if 'Data de Nascimento' in df_alunos.columns:
+        df_alunos['Data de Nascimento'] = pd.to_datetime(df_alunos['Data de Nascimento'], errors='coerce')
+        idades = calcular_idades(df_alunos.loc[rotulos, 'Data de Nascimento'], hoje)
+        df_alunos.loc[rotulos, 'Categoria'] = definir_categorias_por_idade(idades, df_categorias)
+        df_alunos.loc[rotulos, 'Idade'] = idades
+        df_alunos['Idade'] = pd.to_numeric(df_alunos['Idade'], errors='coerce').fillna(0).astype(int)
+    return df_alunos
+
+def _instalar_abas(abas: Dict[str, pd.DataFrame]) -> None:
+    """Instala as abas como uma nova geração do cache (chamada com _trava_cache)."""
+    _cache["geracao"] += 1
+    _cache["abas"] = {**_cache["abas"], **abas}
+    _cache["versoes"] = {**_cache["versoes"], **{aba: _cache["geracao"] for aba in abas}}
+
+
+def _marcar_relatorios(chaves: Optional[Iterable]) -> None:
+    """
+    Registra a geração atual como a da última mudança das turmas (ou turmas e
+    meses) em 'chaves'; None afeta todos os relatórios. Chamada com _trava_cache.
+    """
+    if chaves is None:
+        _cache["versao_relatorios"] = _cache["geracao"]
+    else:
+        _cache["turmas_alteradas"] = {**_cache["turmas_alteradas"], **{chave: _cache["geracao"] for chave in chaves}}
+
+
+def _turmas_dos_alunos(df_alunos: pd.DataFrame, rotulos: Iterable) -> set:
+    """Chaves das turmas das linhas 'rotulos' de Alunos (as ausentes de df_alunos são ignoradas)."""
+    linhas = df_alunos.loc[df_alunos.index.intersection(list(rotulos)), COLUNAS_TURMA]
+    return set(linhas.itertuples(index=False, name=None))
+
+
+def _meses_das_turmas(df_alunos: pd.DataFrame, celulas: Iterable[Tuple[str, str]]) -> set:
+    """
+    (chave da turma, ano, mes) de cada célula (nome, data dd/mm/aaaa) de um aluno
+    de Alunos; sem data válida, a chave da turma (todos os meses).
+    """
+    indice = _indice_alunos(df_alunos)
+    chaves = set()
+    for nome, data in celulas:
+        if nome not in indice:
+            continue
+        turma = tuple(df_alunos.loc[indice.por_nome[nome], COLUNAS_TURMA])
+        if isinstance(data, str) and eh_data_valida(data):
+            _, mes, ano = data.split('/')
+            chaves.add((turma, int(ano), int(mes)))
+        else:
+            chaves.add(turma)
+    return chaves
+
+
+def _aba_expirada(aba: str, versao: float, agora: float) -> bool:
+    """Verdadeiro se a aba passou do tempo de cache ou se o arquivo foi modificado por outro programa."""
+    versao_aba, carregada_em = _cache["validade"][aba]
+    return versao_aba != versao or agora - carregada_em > CACHE_EXPIRATION_SECONDS
+
+
+try:
+    pd.get_option('future.no_silent_downcasting')
+    _SEM_CONVERSAO_IMPLICITA = True
+except KeyError:
+    _SEM_CONVERSAO_IMPLICITA = False  # pandas anterior à 2.2: a opção não existe (e o fillna não avisa)
+
+
+def _vazios_como_texto(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Células nulas viram "". A conversão de tipos que o fillna fazia implicitamente
+    (obsoleta desde o pandas 2.2) é feita de forma explícita com infer_objects.
+    """
+    contexto = (pd.option_context('future.no_silent_downcasting', True) if _SEM_CONVERSAO_IMPLICITA
+                else contextlib.nullcontext())
+    with contexto:
+        return df.fillna("").infer_objects(copy=False)
+
+
+def _ler_abas(abas: List[str]) -> Dict[str, pd.DataFrame]:
+    """Lê as abas informadas pelo motor e as normaliza (sem tocar no cache)."""
+    try:
+        lidas = motor.carregar(abas)
+    except FileNotFoundError:
+        raise HTTPException(status_code=500, detail=f"Arquivo '{NOME_ARQUIVO}' não encontrado no servidor.")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Ocorreu um erro crítico ao ler a planilha: {e}")
+
+    if any(aba in abas and aba not in lidas for aba in ('Alunos', 'Turmas')):
+        raise HTTPException(status_code=500, detail="Ocorreu um erro crítico ao ler a planilha: as abas 'Alunos' e 'Turmas' são obrigatórias.")
+
+    # Abas opcionais ausentes viram DataFrames vazios
+    for aba in abas:
+        if aba not in lidas:
+            lidas[aba] = pd.DataFrame(columns=COLUNAS_ABAS_OPCIONAIS[aba])
+    for aba in ABAS_SEM_VAZIOS:
+        if aba in lidas:
+            lidas[aba] = _vazios_como_texto(lidas[aba])
+    return lidas
+
+
+def _atribuir_ids(lidas: Dict[str, pd.DataFrame]) -> Alteracoes:
+    """
+    Dá um ID aos alunos (e excluídos) lidos que ainda não têm e liga as linhas
+    de Registros sem ID ao aluno de mesmo nome. Retorna as linhas alteradas,
+    que precisam ser gravadas. Só lê o cache (chamada por _preparar_lidas, fora das travas).
+    """
+    alteracoes = Alteracoes()
+    abas = {**_cache["abas"], **lidas}
+    proximo = proximo_id(abas.get('Alunos'), abas.get('Exclusões'))
+    for aba in ('Alunos', 'Exclusões'):
+        if aba not in lidas:
+            continue
+        df = lidas[aba]
+        ids = ids_da_aba(df)
+        faltando = ids.isna()
+        if faltando.any():
+            ids[faltando] = pd.array(range(proximo, proximo + int(faltando.sum())), dtype='Int64')
+            proximo += int(faltando.sum())
+            alteracoes.gravar(aba, df.index[faltando])
+        df[COLUNA_ID] = ids.astype('int64')
+
+    if 'Registros' in lidas:
+        df = lidas['Registros']
+        ids = ids_da_aba(df)
+        faltando = ids.isna()
+        if faltando.any() and 'Nome' in df.columns:
+            # Alunos ativos têm prioridade sobre excluídos de mesmo nome
+            id_do_nome = {**_indice_alunos(abas['Exclusões'], 'Exclusões').id_do_nome,
+                          **_indice_alunos(abas['Alunos']).id_do_nome}
+            ids[faltando] = df.loc[faltando, 'Nome'].map(id_do_nome).astype('Int64')
+            alteracoes.gravar('Registros', df.index[faltando & ids.notna()])
+        if COLUNA_ID in df.columns:
+            df[COLUNA_ID] = ids
+        else:
+            # Junto das colunas de identificação, antes da primeira data
+            datas = [i for i, coluna in enumerate(df.columns) if eh_coluna_data(coluna)]
+            df.insert(datas[0] if datas else len(df.columns), COLUNA_ID, ids)
+    return alteracoes
+
+
+def _preparar_lidas(lidas: Dict[str, pd.DataFrame]) -> Tuple[Alteracoes, int]:
+    """
+    Prepara as abas lidas fora das travas: IDs, horários e a aba Registros no
+    formato longo com as chamadas do diário sobrepostas. Retorna as linhas que
+    receberam ID e a sequência do diário incorporada a Registros.
+    """
+    sem_id = _atribuir_ids(lidas)
+    for aba in ABAS_COM_HORARIO:
+        if aba in lidas:
+            lidas[aba] = _normalizar_horarios(lidas[aba])
+    seq_diario = 0
+    if 'Registros' in lidas:
+        # A aba larga é mantida em memória no formato longo (ver frequencia.py)
+        lidas['Registros'] = TabelaFrequencia.de_largo(lidas['Registros'])
+        # Sobrepõe as chamadas do diário que ainda não foram compactadas
+        seq_diario = diario.sequencia
+        pendentes = diario.pendentes()
+        if pendentes:
+            alunos = lidas['Alunos'] if 'Alunos' in lidas else _cache["abas"]['Alunos']
+            lidas['Registros'] = lidas['Registros'].com_entradas(pendentes, _indice_alunos(alunos).id_do_nome)
+            seq_diario = pendentes[-1][0]
+    return sem_id, seq_diario
+
+
+def _instalar_lidas(lidas: Dict[str, pd.DataFrame], sem_id: Alteracoes, seq_diario: int,
+                    versao: float, agora: float) -> None:
+    """Deriva as colunas calculadas e instala as abas preparadas por _preparar_lidas no cache."""
+    with _trava_cache:
+        if 'Alunos' in lidas:
+            categorias = lidas['Categorias'] if 'Categorias' in lidas else _cache["abas"]['Categorias']
+            lidas['Alunos'] = _derivar_alunos(lidas['Alunos'], categorias)
+        if 'Registros' in lidas:
+            _cache["diario_seq"] = seq_diario
+        _instalar_abas(lidas)
+        if any(aba in lidas for aba in ABAS_RELATORIO):
+            _marcar_relatorios(None)
+        _cache["validade"] = {**_cache["validade"], **{aba: (versao, agora) for aba in lidas}}
+    if sem_id.abas:
+        # Os IDs recém-atribuídos são gravados para continuarem os mesmos na próxima leitura
+        fila_escrita.enfileirar(sem_id)
+
+
+def _indice(nome: str, construir, *dfs: pd.DataFrame):
+    """Índice 'nome' dos DataFrames dfs, montado uma única vez enquanto eles forem os do cache."""
+    atual = _cache["indices"].get(nome)
+    if atual is not None and len(atual[0]) == len(dfs) and all(a is b for a, b in zip(atual[0], dfs)):
+        return atual[1]
+    indice = construir(*dfs)
+    _cache["indices"] = {**_cache["indices"], nome: (dfs, indice)}
+    return indice
+
+
+def _indice_alunos(df: pd.DataFrame, aba: str = 'Alunos') -> IndiceAlunos:
+    """Alunos (ou excluídos, com aba='Exclusões') por ID e por nome."""
+    return _indice(aba, IndiceAlunos, df)
+
+
+def _indice_turmas(df_turmas: pd.DataFrame, df_alunos: pd.DataFrame) -> IndiceTurmas:
+    """Linhas de cada turma e de seus alunos pela chave (Turma, horário 'HHhMM', Professor)."""
+    return _indice('Turmas', IndiceTurmas, df_turmas, df_alunos)
+
+
+def _indice_justificativas(df_justificativas: pd.DataFrame) -> IndiceJustificativas:
+    """Texto das justificativas de cada aluno por (ano, mês)."""
+    return _indice('Justificativas', IndiceJustificativas, df_justificativas)
+
+
+def _indice_derivado(nome: str, anterior: pd.DataFrame, atual: pd.DataFrame, derivar) -> None:
+    """
+    Se o índice 'nome' da aba 'anterior' já foi montado, registra para 'atual'
+    o índice 'derivar(indice_anterior)' em vez de remontá-lo do zero.
+    """
+    existente = _cache["indices"].get(nome)
+    if existente is not None and len(existente[0]) == 1 and existente[0][0] is anterior:
+        _cache["indices"] = {**_cache["indices"], nome: ((atual,), derivar(existente[1]))}
+
+
+def _carregar_abas(abas: List[str]) -> None:
+    """
+    Lê e instala abas ainda ausentes do cache. Não precisa da trava de escrita:
+    nenhum escritor altera uma aba que ainda não foi carregada (ele aguardaria esta leitura).
+    """
+    versao = motor.versao()
+    lidas = _ler_abas(abas)
+    _instalar_lidas(lidas, *_preparar_lidas(lidas), versao, time.time())
+
+
+# Uma única leitura por aba ausente, compartilhada pelas requisições concorrentes
+_carga_unica = CargaUnica()
+
+
+def _revalidar_abas(abas: List[str]) -> None:
+    """
+    Executado pelo revalidador: relê e prepara as abas expiradas sem segurar nenhuma
+    trava e só então instala o resultado, se nenhuma alteração foi enfileirada nesse meio tempo.
+    """
+    emitidos = fila_escrita.emitidos
+    if not fila_escrita.ocioso():
+        return  # Há alterações a gravar: o estado em memória é o mais recente
+    agora = time.time()
+    versao = motor.versao()
+    expiradas = [aba for aba in abas if aba in _cache["validade"] and _aba_expirada(aba, versao, agora)]
+    if not expiradas:
+        return
+    lidas = _ler_abas(expiradas)
+    preparadas = _preparar_lidas(lidas)
+    with _trava_escrita:
+        if fila_escrita.emitidos != emitidos or not fila_escrita.ocioso():
+            return  # Um escritor alterou o cache durante a leitura; a próxima requisição pedirá de novo
+        _instalar_lidas(lidas, *preparadas, versao, agora)
+
+
+_revalidador = Revalidador(_revalidar_abas)
+_monitor: Optional[MonitorArquivo] = None
+
+
+def _versao_motor() -> float:
+    """Versão do arquivo do motor: a última vista pelo observador ou, sem ele, a consultada agora."""
+    return _monitor.versao if _monitor is not None else motor.versao()
+
+
+def _com_dependencias(abas) -> List[str]:
+    """As abas pedidas precedidas das abas de que dependem (DEPENDENCIAS_ABAS)."""
+    necessarias: List[str] = []
+    for aba in abas:
+        necessarias += _com_dependencias(DEPENDENCIAS_ABAS.get(aba, [])) + [aba]
+    return list(dict.fromkeys(necessarias))
+
+
+def _sobrepor_diario(ate: int) -> None:
+    """
+    Aplica à aba Registros do cache as chamadas do diário registradas depois
+    dela, até pelo menos a sequência 'ate': quem registrou uma chamada sempre a vê
+    na leitura seguinte. O retrato (tabela, alunos e entradas novas) é obtido sob
+    _trava_cache, as entradas são aplicadas fora dela e o resultado só é instalado
+    se Registros e Alunos continuam na mesma geração (senão, tenta de novo).
+    """
+    while _cache["diario_seq"] < ate:
+        with _trava_cache:
+            seq, versoes, abas = _cache["diario_seq"], _cache["versoes"], _cache["abas"]
+            novas = diario.pendentes(seq)
+        if not novas:
+            return
+        tabela = abas['Registros'].com_entradas(novas, _indice_alunos(abas['Alunos']).id_do_nome)
+        meses = _meses_das_turmas(abas['Alunos'], ((nome, data) for _, nome, data, _ in novas))
+        with _trava_cache:
+            if (_cache["diario_seq"] == seq and
+                    all(_cache["versoes"].get(aba) == versoes.get(aba) for aba in ('Registros', 'Alunos'))):
+                _instalar_abas({'Registros': tabela})
+                _marcar_relatorios(meses)
+                _cache["diario_seq"] = novas[-1][0]
+
+
+def get_abas_cached(*abas: str) -> Tuple:
+    """
+    Retorna as abas pedidas, na ordem pedida, usando um cache em memória para
+    evitar leituras repetidas do arquivo. Só as abas pedidas (e as de que elas
+    dependem) são lidas: um endpoint de catálogo não paga pela aba Registros.
+    A aba Registros é retornada como TabelaFrequencia (formato longo).
+    """
+    agora = time.time()
+    versao = _versao_motor()
+    necessarias = _com_dependencias(abas)
+
+    ausentes = [aba for aba in necessarias if aba not in _cache["abas"]]
+    # Sem retrato para servir: a requisição espera a leitura, feita uma única vez por aba
+    pendentes = ausentes
+    while pendentes:
+        _carga_unica.executar(pendentes, _carregar_abas)
+        pendentes = [aba for aba in necessarias if aba not in _cache["abas"]]
+
+    # Abas expiradas continuam servindo o retrato atual e são recarregadas em segundo plano.
+    # Com alterações ainda na fila de escrita o estado em memória é o mais recente e não é descartado.
+    expiradas = [aba for aba in necessarias if aba not in ausentes and _aba_expirada(aba, versao, agora)]
+    if expiradas and fila_escrita.ocioso():
+        _revalidador.solicitar(expiradas)
+
+    if 'Alunos' in necessarias and _cache["idades_em"] != date.today() and _trava_escrita.acquire(blocking=False):
+        # Idades (e categorias) dependem da data: só são recalculadas quando o dia muda.
+        # Se um escritor estiver ativo, ele mesmo as recalculará ao instalar Alunos.
+        try:
+            with _trava_cache:
+                if _cache["idades_em"] != date.today():
+                    alunos = _derivar_alunos(_cache["abas"]['Alunos'].copy(), _cache["abas"]['Categorias'])
+                    _instalar_abas({'Alunos': alunos})
+                    _marcar_relatorios(None)  # Idades e categorias aparecem em todos os relatórios
+        finally:
+            _trava_escrita.release()
+
+    if 'Registros' in abas:
+        _sobrepor_diario(diario.sequencia)
+
+    abas_cache = _cache["abas"]
+    return tuple(abas_cache[aba] for aba in abas)
 
-def calcular_idade(data_nascimento):
-    """Calcula a idade a partir da data de nascimento."""
-    if pd.isna(data_nascimento) or not isinstance(data_nascimento, (datetime, pd.Timestamp)):
-        return None
-    hoje = datetime.now()
-    # Calcula a idade subtraindo o ano de nascimento do ano atual.
-    # Em seguida, subtrai 1 se o aniversário deste ano ainda não ocorreu.
-    idade = hoje.year - data_nascimento.year - ((hoje.month, hoje.day) < (data_nascimento.month, data_nascimento.day))
-    return idade
-
-def definir_categoria_por_idade(idade, df_categorias):
-    """Define a categoria com base na idade, usando a tabela de categorias fornecida."""
-    if pd.isna(idade) or idade is None:
-        return "Não definida"
-    
-    # Itera sobre as regras de categoria carregadas da planilha
-    for _, linha in df_categorias.iterrows():
-        idade_min = linha.get('Idade Mínima', 0)
-        idade_max = linha.get('Idade Máxima', float('inf'))
-        if idade_min <= idade <= idade_max:
-            return linha.get('Categoria', 'Não definida')
-            
-    return "Não definida"
 
 def get_dados_cached() -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame]:
     """
-    Carrega os dados da planilha Excel, usando um cache em memória para evitar
-    leituras repetidas do arquivo a cada requisição.
+    Retorna todas as abas (Alunos, Turmas, Registros, Categorias, Justificativas, Exclusões)
+    como DataFrames, com Registros no formato largo da planilha.
     """
-    now = time.time()
-    # Verifica se o cache expirou ou se o arquivo foi modificado
-    file_mod_time = os.path.getmtime(NOME_ARQUIVO) if os.path.exists(NOME_ARQUIVO) else 0
-    if now - _cache.get("timestamp", 0) > CACHE_EXPIRATION_SECONDS or file_mod_time > _cache.get("timestamp", 0):
+    abas = dict(zip(ABAS_CACHE, get_abas_cached(*ABAS_CACHE)))
+    abas['Registros'] = abas['Registros'].para_largo()
+    return tuple(abas[aba] for aba in ABAS_CACHE)
+
+
+def _invalidar_cache() -> None:
+    """Descarta todas as abas carregadas; a próxima leitura as obtém do motor."""
+    with _trava_cache:
+        _cache["abas"] = {}
+        _cache["validade"] = {}
+        _cache["indices"] = {}
+
+
+def compactar_diario() -> int:
+    """Incorpora as entradas pendentes do diário à aba Registros e as remove do diário."""
+    with _trava_compactacao:
+        entradas = diario.pendentes()
+        if not entradas:
+            return 0
+        with _trava_escrita:
+            # O cache já contém as entradas sobrepostas (até pelo menos a última pendente)
+            df_alunos, tabela = get_abas_cached('Alunos', 'Registros')
+            nomes = {nome for _, nome, _, _ in entradas}
+            id_do_nome = _indice_alunos(df_alunos).id_do_nome
+            rotulos = tabela.rotulos_de(nomes, [id_do_nome[n] for n in nomes if n in id_do_nome])
+            # A tabela do cache já está em memória: só a gravação é enfileirada. Reinstalá-la
+            # descartaria entradas sobrepostas por uma leitura concorrente depois de obtê-la.
+            ticket = fila_escrita.enfileirar(Alteracoes().gravar('Registros', rotulos))
+        # Só descarta do diário depois que a planilha estiver gravada
+        fila_escrita.aguardar(ticket)
+        diario.descartar_ate(entradas[-1][0])
+        return len(entradas)
+
+
+_compactador = CompactadorDiario(diario, compactar_diario, DIARIO_INTERVALO_COMPACTACAO, DIARIO_LIMITE_ENTRADAS)
+
+@app.on_event("startup")
+def iniciar_compactador():
+    """Inicia a compactação periódica do diário (também recupera entradas de uma execução anterior)."""
+    if not _compactador.is_alive():
+        _compactador.start()
+
+@app.on_event("startup")
+def iniciar_monitor():
+    """No modo 'observador', passa a acompanhar as modificações externas do arquivo do motor."""
+    global _monitor
+    if CACHE_MONITOR == 'observador' and _monitor is None:
+        _monitor = MonitorArquivo(motor.caminho, lambda _: _revalidador.solicitar(list(_cache["abas"])),
+                                  CACHE_MONITOR_INTERVALO)
+        _monitor.iniciar()
+
+@app.on_event("startup")
+def compilar_template_relatorio():
+    """Compila o template dos relatórios antes da primeira requisição que precisar dele."""
+    if OPENPYXL_DISPONIVEL and os.path.exists(TEMPLATE_RELATORIO):
         try:
-            xls = pd.ExcelFile(NOME_ARQUIVO, engine='openpyxl')
-            df_alunos = pd.read_excel(xls, sheet_name='Alunos').fillna("")
-            df_turmas = pd.read_excel(xls, sheet_name='Turmas').fillna("")
-
-            # Carrega categorias ou cria um DF vazio se a aba não existir
-            if 'Categorias' in xls.sheet_names:
-                df_categorias = pd.read_excel(xls, sheet_name='Categorias')
-            else:
-                df_categorias = pd.DataFrame(columns=['Categoria', 'Idade Mínima', 'Idade Máxima'])
-
-            # --- CÁLCULO DE IDADE E CATEGORIA ---
-            if 'Data de Nascimento' in df_alunos.columns:
-                df_alunos['Data de Nascimento'] = pd.to_datetime(df_alunos['Data de Nascimento'], errors='coerce')
-                df_alunos['Idade'] = df_alunos['Data de Nascimento'].apply(calcular_idade)
-                df_alunos['Categoria'] = df_alunos['Idade'].apply(definir_categoria_por_idade, args=(df_categorias,))
-                df_alunos['Idade'] = df_alunos['Idade'].fillna(0).astype(int)
-            
-            # Carrega registros ou cria um DF vazio se a aba não existir
-            if 'Registros' in xls.sheet_names:
-                df_registros = pd.read_excel(xls, sheet_name='Registros')
-            else:
-                df_registros = pd.DataFrame(columns=['Nome'])
-
-            # Carrega justificativas ou cria um DF vazio se a aba não existir
-            if 'Justificativas' in xls.sheet_names:
-                df_justificativas = pd.read_excel(xls, sheet_name='Justificativas').fillna("")
-            else:
-                df_justificativas = pd.DataFrame(columns=['Nome', 'Data', 'Motivo'])
-
-            # Carrega exclusões ou cria um DF vazio se a aba não existir
-            if 'Exclusões' in xls.sheet_names:
-                df_exclusoes = pd.read_excel(xls, sheet_name='Exclusões').fillna("")
-            else:
-                df_exclusoes = pd.DataFrame(columns=['Nome', 'Turma', 'Horário', 'Professor', 'Data Exclusão'])
-
-            _cache["data"] = (df_alunos, df_turmas, df_registros, df_categorias, df_justificativas, df_exclusoes)
-            _cache["timestamp"] = now # Usa 'now' para o timestamp do cache
-        except FileNotFoundError:
-            raise HTTPException(status_code=500, detail=f"Arquivo '{NOME_ARQUIVO}' não encontrado no servidor.")
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Ocorreu um erro crítico ao ler a planilha: {e}")
-
-    return _cache["data"]
+            modelo_relatorio(TEMPLATE_RELATORIO)
+        except Exception:
+            pass  # O erro é informado pelo endpoint de relatório que tentar usá-lo
+
+@app.on_event("shutdown")
+def encerrar_compactador():
+    """Compacta o que restou no diário e grava a fila de escrita antes de encerrar o servidor."""
+    if _compactador.is_alive():
+        _compactador.parar()
+    try:
+        compactar_diario()
+    except Exception:
+        pass  # As entradas continuam no diário e serão recuperadas na próxima inicialização
+    fila_escrita.parar()
+    fila_relatorios.parar()
+    _revalidador.parar()
+    if _monitor is not None:
+        _monitor.parar()
+
+
+def _serializar_escrita(endpoint):
+    """Executa o endpoint com a trava de escrita: mutações concorrentes não se sobrescrevem."""
+    @functools.wraps(endpoint)
+    def executar(*args, **kwargs):
+        with _trava_escrita:
+            return endpoint(*args, **kwargs)
+    return executar
+
+
+def _persistir(alteracoes: Alteracoes, abas: Dict[str, pd.DataFrame],
+               junto: Optional[Callable[[], None]] = None) -> int:
+    """
+    Instala as abas alteradas (presentes em 'abas') como o novo estado em memória
+    e enfileira sua gravação. Retorna o tíquete da fila de escrita (para quem
+    precisar aguardar a durabilidade). Deve ser chamada com a trava de escrita
+    (ver _serializar_escrita). 'junto' é executada com a instalação, sob _trava_cache:
+    nenhum leitor vê uma das mudanças sem a outra.
+    """
+    with _trava_cache:
+        # Só as abas alteradas são substituídas; as demais continuam as do cache
+        # (que podem ter recebido entradas do diário)
+        # Mesma normalização da leitura: o estado instalado é igual ao que uma releitura produziria
+        novas = {aba: _vazios_como_texto(abas[aba]) if aba in ABAS_SEM_VAZIOS else abas[aba] for aba in alteracoes.abas}
+        for aba in ABAS_COM_HORARIO:
+            if aba in novas:
+                novas[aba] = _normalizar_horarios(novas[aba])
+        todos_os_alunos = False
+        if 'Categorias' in novas and 'Alunos' in _cache["abas"]:
+            # Regras de categoria mudaram: todos os alunos são reclassificados
+            novas['Alunos'] = _derivar_alunos(_vazios_como_texto(novas.get('Alunos', _cache["abas"]['Alunos'])), novas['Categorias'])
+            todos_os_alunos = True
+        elif 'Alunos' in novas and _cache["idades_em"] != date.today():
+            # Virou o dia desde o último cálculo: todas as idades são recalculadas
+            novas['Alunos'] = _derivar_alunos(novas['Alunos'], _cache["abas"]['Categorias'])
+            todos_os_alunos = True
+        elif 'Alunos' in novas:
+            # Só as linhas gravadas precisam de idade e categoria recalculadas
+            novas['Alunos'] = _derivar_alunos(novas['Alunos'], _cache["abas"]['Categorias'],
+                                              rotulos=list(alteracoes.gravadas.get('Alunos', ())))
+        anteriores = _cache["abas"]
+        _instalar_abas(novas)
+        _marcar_relatorios(None if todos_os_alunos else _turmas_alteradas(alteracoes, anteriores, novas))
+        if junto is not None:
+            junto()
+    return fila_escrita.enfileirar(alteracoes)
+
+
+def _turmas_alteradas(alteracoes: Alteracoes, anteriores: Dict[str, pd.DataFrame],
+                      novas: Dict[str, pd.DataFrame]) -> Optional[set]:
+    """
+    Turmas (e meses) cujos relatórios mudam com as abas 'novas' instaladas sobre
+    'anteriores' (ver _marcar_relatorios); None se a mudança pode afetar qualquer um.
+    """
+    if alteracoes.substituidas & set(ABAS_RELATORIO) or 'Registros' in novas:
+        return None
+    chaves = set()
+    if 'Alunos' in novas:
+        # O aluno sai da turma anterior e entra na nova (ou continua nela, alterado)
+        rotulos = alteracoes.gravadas.get('Alunos', set()) | alteracoes.removidas.get('Alunos', set())
+        chaves |= _turmas_dos_alunos(novas['Alunos'], rotulos)
+        if 'Alunos' in anteriores:
+            chaves |= _turmas_dos_alunos(anteriores['Alunos'], rotulos)
+    df_alunos = novas.get('Alunos', anteriores.get('Alunos'))
+    if 'Justificativas' in novas and df_alunos is not None:
+        # (sem Alunos carregada ainda não há relatório guardado: a leitura dela invalidará todos)
+        rotulos = list(alteracoes.gravadas.get('Justificativas', set()) | alteracoes.removidas.get('Justificativas', set()))
+        for df in (novas['Justificativas'], anteriores.get('Justificativas')):
+            if df is not None:
+                linhas = df.loc[df.index.intersection(rotulos)]
+                chaves |= _meses_das_turmas(df_alunos, zip(linhas['Nome'], linhas['Data']))
+    return chaves
+
+
+def _gravar_alteracoes(alteracoes: Alteracoes) -> None:
+    """Executado pela thread da fila: grava o estado atual em memória para as abas alteradas."""
+    dados = dict(_cache["abas"])
+    tabela = dados.pop('Registros', None)
+    if tabela is not None and 'Registros' in alteracoes.abas:
+        # A visão larga só é montada para gravar; um motor que grava linhas isoladas recebe só as afetadas
+        if motor.grava_linhas and 'Registros' not in alteracoes.substituidas:
+            rotulos = [r for r in alteracoes.gravadas.get('Registros', ()) if r in tabela.linhas.index]
+            dados['Registros'] = tabela.para_largo(rotulos=sorted(rotulos))
+        else:
+            dados['Registros'] = tabela.para_largo()
+    motor.salvar(dados, alteracoes)
+    # A modificação do arquivo foi feita por nós: não deve provocar a releitura das abas carregadas
+    versao = motor.versao()
+    with _trava_cache:
+        _cache["validade"] = {aba: (versao, carregada_em) for aba, (_, carregada_em) in _cache["validade"].items()}
+
+
+fila_escrita = FilaEscrita(_gravar_alteracoes, ESCRITA_LATENCIA_MAXIMA)
+
+
+def aguardar_persistencia(timeout: Optional[float] = None) -> None:
+    """Bloqueia até que todas as alterações já enfileiradas estejam gravadas."""
+    fila_escrita.aguardar(timeout=timeout)
+
+
+def _anexar_linha(df: pd.DataFrame, linha: dict) -> Tuple[pd.DataFrame, int]:
+    """Acrescenta uma linha mantendo os rótulos existentes estáveis (novo rótulo = maior + 1)."""
+    rotulo = int(df.index.max()) + 1 if len(df.index) else 0
+    # Cópia com as colunas novas da linha; a inclusão por .loc mantém o dtype de cada coluna
+    # (pd.concat com uma aba vazia ou uma coluna só de nulos emite FutureWarning)
+    novas = pd.Index(list(linha)).difference(df.columns, sort=False)
+    resultado = df.reindex(columns=df.columns.append(novas)) if len(novas) else df.copy()
+    resultado.loc[rotulo] = pd.Series(linha, dtype=object)
+    return resultado, rotulo
+
+
+def formatar_horarios(horarios: pd.Series) -> pd.Series:
+    """
+    Formata de uma vez uma coluna de horários (objetos de tempo, strings ou
+    números como 845 ou "0845") para o formato 00h00. Valores que não
+    representam um horário HHMM válido são mantidos como texto.
+    """
+    horarios = horarios.astype(object)
+    textos = horarios.astype(str).str.split('.').str[0]
+    partes = textos.str.zfill(4).str.extract(r'^([01]\d|2[0-3])([0-5]\d)$')
+    formatados = textos.where(partes[0].isna(), partes[0] + 'h' + partes[1])
+    # pd.NaT também é instância de datetime (e não tem strftime): fica vazio como os demais nulos
+    datas = horarios.notna().to_numpy() & np.fromiter((isinstance(h, datetime) for h in horarios), dtype=bool,
+                                                       count=len(horarios))
+    if datas.any():
+        formatados[datas] = [h.strftime('%Hh%M') for h in horarios[datas]]
+    return formatados.where(horarios.notna(), "")
 
 
 def formatar_horario(horario):
     """Formata um objeto de tempo, string ou número para o formato 00h00."""
-    if pd.isna(horario):
-        return ""
-    if isinstance(horario, (datetime, pd.Timestamp, pd.Timedelta)):
-        return horario.strftime('%Hh%M')
-    horario_str = str(horario).split('.')[0]
-    try:
-        return datetime.strptime(horario_str.zfill(4), '%H%M').strftime('%Hh%M')
-    except ValueError:
-        return horario_str
+    return formatar_horarios(pd.Series([horario], dtype=object)).iloc[0]
+
+
+def _normalizar_horarios(df: pd.DataFrame) -> pd.DataFrame:
+    """Acrescenta a coluna 'Horario_Formatado' (00h00), calculada uma vez por geração do cache."""
+    if 'Horário' in df.columns:
+        df['Horario_Formatado'] = formatar_horarios(df['Horário'])
+    return df
 
 # --- MODELOS DE DADOS (PYDANTIC) ---
 class ChamadaPayload(BaseModel):
@@ -141,6 +745,14 @@ class RelatorioRequest(BaseModel):
     mes: int
     ano: int
 
+class TurmaMesPayload(BaseModel):
+    """Identifica a grade de chamada de uma turma em um mês (sem ano, o ano atual)."""
+    turma: str
+    horario: str
+    professor: str
+    mes: int
+    ano: Optional[int] = None
+
 class AlunoPayload(BaseModel):
     """Define a estrutura dos dados de um novo aluno que o frontend enviará."""
     Nome: str
@@ -187,12 +799,11 @@ def root():
 @app.get("/api/filtros")
 def obter_opcoes_de_filtro():
     """Retorna listas de opções únicas para os filtros do frontend."""
-    df_alunos, df_turmas, df_registros, df_categorias, _, _ = get_dados_cached()
+    df_alunos, df_turmas, tabela = get_abas_cached('Alunos', 'Turmas', 'Registros')
     
     turmas = df_turmas['Turma'].unique().tolist()
     
-    # Formata os horários para exibição
-    df_turmas['Horario_Formatado'] = df_turmas['Horário'].apply(formatar_horario)
+    # Horários já formatados para exibição na instalação do cache
     horarios = df_turmas['Horario_Formatado'].unique().tolist()
     
     professores = df_turmas['Professor'].unique().tolist()
@@ -200,15 +811,7 @@ def obter_opcoes_de_filtro():
     niveis = df_alunos['Nível'].unique().tolist() if 'Nível' in df_alunos.columns else []
     
     # Identifica os anos presentes nas colunas de data do Excel (aba Registros)
-    anos_disponiveis = {datetime.now().year}
-    for col in df_registros.columns:
-        # Verifica se a coluna tem formato de data dd/mm/yyyy
-        if isinstance(col, str) and len(col) == 10 and col[2] == '/' and col[5] == '/':
-            try:
-                ano_col = int(col.split('/')[2])
-                anos_disponiveis.add(ano_col)
-            except ValueError:
-                pass
+    anos_disponiveis = {datetime.now().year} | tabela.anos()
     
     meses_pt = [
         {"valor": 1, "nome": "Janeiro"},
@@ -238,36 +841,22 @@ def obter_opcoes_de_filtro():
 @app.get("/api/all-alunos")
 def get_all_alunos():
     """Retorna a lista completa de alunos."""
-    df_alunos, _, _, _, _, _ = get_dados_cached()
-    # Formata o horário para exibição consistente
-    df_alunos['Horário'] = df_alunos['Horário'].apply(formatar_horario)
-    return df_alunos.to_dict(orient='records')
+    df_alunos, = get_abas_cached('Alunos')
+    # Horário formatado para exibição consistente (sem alterar o DataFrame do cache)
+    return df_alunos.assign(**{'Horário': df_alunos['Horario_Formatado']}).to_dict(orient='records')
 
 @app.get("/api/all-turmas")
 def get_all_turmas():
     """Retorna a lista completa de turmas."""
-    df_alunos, df_turmas, _, _, _, _ = get_dados_cached()
-
-    # Formata os horários em ambos os dataframes para garantir a correspondência
-    df_alunos['Horario_Formatado'] = df_alunos['Horário'].apply(formatar_horario)
-    df_turmas['Horario_Formatado'] = df_turmas['Horário'].apply(formatar_horario)
-
-    # Calcula a contagem de alunos por turma/horário/professor
-    student_counts = df_alunos.groupby(['Turma', 'Horario_Formatado', 'Professor']).size().reset_index(name='qtd.')
-
-    # Junta a contagem de volta ao dataframe de turmas
-    df_turmas_com_qtd = pd.merge(
-        df_turmas,
-        student_counts,
-        on=['Turma', 'Horario_Formatado', 'Professor'],
-        how='left'
-    )
-    
-    # Preenche com 0 turmas que não têm alunos cadastrados e converte para inteiro
-    df_turmas_com_qtd['qtd.'] = df_turmas_com_qtd['qtd.'].fillna(0).astype(int)
-
-    # Usa o horário formatado para a resposta e remove colunas auxiliares
-    df_turmas_com_qtd = df_turmas_com_qtd.rename(columns={"Horario_Formatado": "Horário"}).drop(columns=['Horário_x', 'Horário_y'], errors='ignore')
+    df_alunos, df_turmas = get_abas_cached('Alunos', 'Turmas')
+    indice = _indice_turmas(df_turmas, df_alunos)
+
+    # Usa o horário formatado para a resposta e conta os alunos de cada turma/horário/professor
+    # pelo índice de turmas (sem alterar o DataFrame do cache)
+    df_turmas_com_qtd = df_turmas.assign(**{
+        'Horário': indice.horarios_turmas,
+        'qtd.': [indice.quantidade_alunos(chave) for chave in indice.chaves_turmas],
+    }).drop(columns=['Horario_Formatado'])
     
     # Reordena as colunas: move 'qtd.', 'Atalho' e 'Data de Início' para o final
     cols = df_turmas_com_qtd.columns.tolist()
@@ -282,10 +871,82 @@ def get_all_turmas():
 @app.get("/api/categorias")
 def get_all_categorias():
     """Retorna a lista completa de categorias com suas regras de idade."""
-    _, _, _, df_categorias, _, _ = get_dados_cached()
+    df_categorias, = get_abas_cached('Categorias')
     return df_categorias.to_dict(orient='records')
 
 
+# Colunas de Alunos na grade de chamada, antes das datas (Horario_Formatado e Data de Nascimento são renomeadas)
+COLUNAS_GRADE = ['Turma', 'Horario_Formatado', 'Professor', 'Nível', 'Nome', 'Idade', 'Categoria', 'Whatsapp', 'ParQ',
+                 'Data de Nascimento']
+
+def _grades_turmas(consultas) -> Iterator[dict]:
+    """
+    Grade de chamada ({"datas", "alunos"}, como em /api/alunos) de cada consulta
+    (turma, horario, professor, mes, ano), na ordem pedida e a partir de um único
+    retrato do cache. O trabalho comum a um mês (grade de registros e textos das
+    justificativas) é feito uma única vez para todas as turmas pedidas nesse mês,
+    quando a primeira delas é gerada. Os meses são validados antes (400).
+    """
+    df_alunos, df_turmas, tabela, df_justificativas = get_abas_cached('Alunos', 'Turmas', 'Registros', 'Justificativas')
+    indice_turmas = _indice_turmas(df_turmas, df_alunos)
+    ano_atual = datetime.now().year
+
+    # (turma, chave da turma, ano, mês, datas de aula) de cada consulta
+    pedidas = []
+    for consulta in consultas:
+        ano = consulta.ano if consulta.ano else ano_atual
+        # Datas de aula do mês pelos dias da semana da turma (calendário memorizado)
+        try:
+            datas = list(datas_de_aula(consulta.turma, ano, consulta.mes))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Mês inválido.")
+        # O horário já vem formatado como 'HHhMM'
+        pedidas.append(((consulta.turma, consulta.horario, consulta.professor), ano, consulta.mes, datas))
+
+    def montar_mes(ano: int, mes: int) -> pd.DataFrame:
+        # Alunos de todas as turmas pedidas no mês e todas as datas de aula delas
+        chaves = dict.fromkeys(chave for chave, a, m, _ in pedidas if (a, m) == (ano, mes))
+        rotulos = [r for chave in chaves for r in indice_turmas.alunos.get(chave, [])]
+        usadas = {d for _, a, m, datas in pedidas if (a, m) == (ano, mes) for d in datas}
+        datas_mes = [d for d in datas_de_aula("", ano, mes) if d in usadas]
+        alunos_filtrados = df_alunos.loc[rotulos]
+
+        # Monta a grade larga só para esses alunos e datas (as ausentes surgem vazias).
+        # Preenche valores nulos com string vazia para evitar problemas com JSON
+        df_registros = _vazios_como_texto(tabela.para_largo(datas=datas_mes, ids=alunos_filtrados[COLUNA_ID],
+                                                            identificacao=[COLUNA_ID]).astype(object))
+
+        # Junta os alunos com seus registros de presença (pelo ID, que não muda com o nome)
+        alunos_com_registros = _vazios_como_texto(pd.merge(
+            alunos_filtrados[[COLUNA_ID] + COLUNAS_GRADE],
+            df_registros.astype({COLUNA_ID: 'int64'}),
+            on=COLUNA_ID,
+            how='left'
+        ).drop(columns=COLUNA_ID))
+        alunos_com_registros.index = alunos_filtrados.index
+
+        # Renomeia as colunas de horário e de nascimento para o frontend/relatório
+        alunos_com_registros = alunos_com_registros.rename(
+            columns={"Horario_Formatado": "Horário", 'Data de Nascimento': 'Aniversario'})
+
+        # --- PROCESSAMENTO DE JUSTIFICATIVAS ---
+        # Anexa ao aluno as justificativas do mês, já agrupadas e formatadas pelo índice
+        textos_mes = _indice_justificativas(df_justificativas).textos.get((ano, mes), {})
+        alunos_com_registros['Justificativas'] = alunos_com_registros['Nome'].map(textos_mes).fillna("")
+        return alunos_com_registros
+
+    def gerar() -> Iterator[dict]:
+        meses: Dict[Tuple[int, int], pd.DataFrame] = {}
+        for chave, ano, mes, datas in pedidas:
+            if (ano, mes) not in meses:
+                meses[(ano, mes)] = montar_mes(ano, mes)
+            colunas = ['Horário' if c == 'Horario_Formatado' else 'Aniversario' if c == 'Data de Nascimento' else c
+                       for c in COLUNAS_GRADE] + datas + ['Justificativas']
+            alunos = meses[(ano, mes)].loc[indice_turmas.alunos.get(chave, []), colunas]
+            yield {"datas": datas, "alunos": alunos.to_dict(orient='records')}
+
+    return gerar()
+
 @app.get("/api/alunos")
 def obter_alunos_filtrados(
     turma: str = Query(...),
@@ -297,140 +958,67 @@ def obter_alunos_filtrados(
     """
     Retorna a lista de alunos e os registros de presença para um determinado mês e ano.
     """
-    df_alunos, _, df_registros, _, df_justificativas, _ = get_dados_cached()
-    ano_vigente = ano if ano else datetime.now().year
+    consulta = TurmaMesPayload(turma=turma, horario=horario, professor=professor, mes=mes, ano=ano)
+    return next(_grades_turmas([consulta]))
 
-    # --- Lógica para gerar as datas de aula (adaptada do Streamlit) ---
-    dias_da_semana_validos = set()
-    nome_turma_lower = turma.lower()
-    
-    dias_map = {
-        "segunda": 0, "terça": 1, "terca": 1, 
-        "quarta": 2, "quinta": 3, "sexta": 4, 
-        "sábado": 5, "sabado": 5, "domingo": 6
-    }
-    
-    for dia_nome, dia_idx in dias_map.items():
-        if dia_nome in nome_turma_lower:
-            dias_da_semana_validos.add(dia_idx)
-            
-    if not dias_da_semana_validos:
-        dias_da_semana_validos = list(range(7)) # Fallback: todos os dias se não identificar
-    else:
-        dias_da_semana_validos = sorted(list(dias_da_semana_validos))
-
-    try:
-        dias_no_mes = calendar.monthrange(ano_vigente, mes)[1]
-        datas_mes_todas = [datetime(ano_vigente, mes, dia) for dia in range(1, dias_no_mes + 1)]
-        datas_mes_filtradas = [data for data in datas_mes_todas if data.weekday() in dias_da_semana_validos]
-        datas_mes_str = [data.strftime('%d/%m/%Y') for data in datas_mes_filtradas]
-    except ValueError:
-        raise HTTPException(status_code=400, detail="Mês inválido.")
-
-    # Garante que as colunas de data existam no df_registros
-    for data_str in datas_mes_str:
-        if data_str not in df_registros.columns:
-            df_registros[data_str] = ""
-
-    # Preenche valores nulos com string vazia para evitar problemas com JSON
-    df_registros = df_registros.fillna("")
-
-    # Para garantir a correspondência, criamos uma coluna de horário formatado
-    df_alunos['Horario_Formatado'] = df_alunos['Horário'].apply(formatar_horario)
-
-    # Aplica os filtros
-    alunos_filtrados = df_alunos[
-        (df_alunos['Turma'] == turma) &
-        (df_alunos['Horario_Formatado'] == horario) &
-        (df_alunos['Professor'] == professor)
-    ]
-
-    # Junta os alunos filtrados com seus registros de presença
-    alunos_com_registros = pd.merge(
-        alunos_filtrados[['Turma', 'Horario_Formatado', 'Professor', 'Nível', 'Nome', 'Idade', 'Categoria', 'Whatsapp', 'ParQ', 'Data de Nascimento']],
-        df_registros[['Nome'] + datas_mes_str],
-        on='Nome',
-        how='left'
-    ).fillna("")
-
-    # Renomeia a coluna de horário para o frontend
-    alunos_com_registros = alunos_com_registros.rename(columns={"Horario_Formatado": "Horário"})
-    
-    # Renomeia Data de Nascimento para Aniversario para manter consistência com o frontend/relatório
-    if 'Data de Nascimento' in alunos_com_registros.columns:
-        alunos_com_registros = alunos_com_registros.rename(columns={'Data de Nascimento': 'Aniversario'})
-
-    # --- PROCESSAMENTO DE JUSTIFICATIVAS ---
-    # Filtra as justificativas para o mês e ano solicitados e anexa ao aluno
-    if not df_justificativas.empty:
-        df_just = df_justificativas.copy()
-        # Garante que a coluna Data seja datetime
-        df_just['Data_dt'] = pd.to_datetime(df_just['Data'], dayfirst=True, errors='coerce')
-        
-        # Filtra pelo mês/ano
-        mask = (df_just['Data_dt'].dt.month == mes) & (df_just['Data_dt'].dt.year == ano_vigente)
-        df_just_mes = df_just[mask].copy()
-        
-        if not df_just_mes.empty:
-            # Ordena por data para garantir cronologia no histórico
-            df_just_mes = df_just_mes.sort_values('Data_dt')
-
-            # Cria string formatada "DD - Motivo"
-            df_just_mes['Dia'] = df_just_mes['Data_dt'].dt.day.apply(lambda x: f"{x:02d}")
-            df_just_mes['Texto'] = df_just_mes['Dia'] + " - " + df_just_mes['Motivo'].astype(str)
-            
-            # Agrupa por nome e junta as justificativas com quebra de linha
-            justificativas_agg = df_just_mes.groupby('Nome')['Texto'].apply(lambda x: '\n'.join(x)).reset_index()
-            justificativas_agg.rename(columns={'Texto': 'Justificativas'}, inplace=True)
-            
-            # Merge com o resultado final
-            alunos_com_registros = pd.merge(alunos_com_registros, justificativas_agg, on='Nome', how='left')
-            alunos_com_registros['Justificativas'] = alunos_com_registros['Justificativas'].fillna("")
-        else:
-            alunos_com_registros['Justificativas'] = ""
-    else:
-        alunos_com_registros['Justificativas'] = ""
-
-    return {
-        "datas": datas_mes_str,
-        "alunos": alunos_com_registros.to_dict(orient='records')
-    }
+@app.post("/api/alunos/lote")
+def obter_alunos_em_lote(consultas: List[TurmaMesPayload]):
+    """
+    Grades de várias turmas/meses de uma vez (cada item como em /api/alunos), na ordem
+    pedida e todas a partir do mesmo retrato dos dados.
+    """
+    return list(_grades_turmas(consultas))
 
 @app.get("/api/relatorio/frequencia")
-def obter_relatorio_frequencia(dias: int = 30):
-    """Calcula e retorna as métricas de frequência para um período em dias."""
+def obter_relatorio_frequencia(
+    dias: int = 30,
+    inicio: Optional[date] = Query(None),
+    fim: Optional[date] = Query(None),
+    turma: Optional[str] = Query(None)
+):
+    """
+    Calcula e retorna as métricas de frequência de um período: de 'inicio' a
+    'fim' (AAAA-MM-DD; por padrão os últimos 'dias' dias até hoje), opcionalmente
+    só para os alunos de uma turma.
+    """
     try:
-        _, _, df_registros, _, _, _ = get_dados_cached()
+        df_alunos, tabela = get_abas_cached('Alunos', 'Registros')
     except Exception:
         return {"error": "Nenhum registro encontrado."}
 
-    if df_registros.empty:
+    if tabela.vazia:
         return {"error": "Nenhum registro encontrado."}
 
-    hoje = datetime.now()
-    data_inicio = hoje - timedelta(days=dias) # Corrigido de datetime para timedelta
-    colunas_identificacao = ['Nome', 'Turma', 'Horário', 'Professor', 'Nível']
-    colunas_datas = [col for col in df_registros.columns if col not in colunas_identificacao]
-
-    datas_relevantes = []
-    for data_str in colunas_datas:
-        try:
-            data_col = datetime.strptime(data_str, '%d/%m/%Y')
-            if data_inicio.date() <= data_col.date() <= hoje.date():
-                datas_relevantes.append(data_str)
-        except (ValueError, TypeError):
-            continue
+    data_fim = fim or date.today()
+    data_inicio = inicio or data_fim - timedelta(days=dias)
+    if data_inicio > data_fim:
+        raise HTTPException(status_code=400, detail="A data inicial deve ser anterior à data final.")
+    datas_relevantes = tabela.datas_no_intervalo(data_inicio, data_fim)
 
     if not datas_relevantes:
+        if inicio or fim:
+            return {"error": "Nenhum registro de chamada no período informado."}
         return {"error": f"Nenhum registro de chamada nos últimos {dias} dias."}
 
-    df_relatorio = df_registros[['Nome'] + datas_relevantes].copy().fillna('')
-    df_relatorio.set_index('Nome', inplace=True)
+    posicoes = None
+    if turma is not None:
+        # Linhas dos alunos que estão hoje na turma (pelo ID)
+        ids = df_alunos.loc[df_alunos['Turma'] == turma, COLUNA_ID]
+        if ids.empty:
+            return {"error": f"Nenhum aluno encontrado na turma '{turma}'."}
+        posicoes = tabela.matriz.posicoes_ids(ids)
+
+    # Conta os status só na fatia do período (e da turma), sem montar a grade larga
+    contagem = tabela.contar(datas_relevantes, posicoes).reindex(columns=['c', 'f', 'j'], fill_value=0)
+    # O nome exibido é o atual do aluno (pelo ID); linhas sem aluno ativo mantêm o nome da aba
+    linhas = tabela.linhas.loc[contagem.index]
+    nomes = linhas[COLUNA_ID].map(_indice_alunos(df_alunos).nome_do_id)
+    contagem.index = pd.Index(nomes.fillna(linhas['Nome']), name='Nome')
 
     total_aulas = len(datas_relevantes)
-    presencas = (df_relatorio == 'c').sum(axis=1)
-    faltas = (df_relatorio == 'f').sum(axis=1)
-    justificadas = (df_relatorio == 'j').sum(axis=1)
+    presencas = contagem['c']
+    faltas = contagem['f']
+    justificadas = contagem['j']
     aulas_consideradas = presencas + faltas
     frequencia_percentual = (presencas / aulas_consideradas.replace(0, 1)) * 100
 
@@ -441,6 +1029,94 @@ def obter_relatorio_frequencia(dias: int = 30):
     })
     return df_resultado.reset_index().to_dict(orient='records')
 
+def _montar_resumo_alunos(tabela: TabelaFrequencia, df_alunos: pd.DataFrame) -> pd.DataFrame:
+    """Totais mensais de cada linha de Registros com o nome e a turma atuais do aluno (pelo ID)."""
+    resumo = tabela.resumo_mensal.reindex(columns=list(COLUNAS_FREQUENCIA), fill_value=0).reset_index()
+    linhas = tabela.linhas.loc[resumo['rotulo']].reset_index(drop=True)
+    ids = linhas[COLUNA_ID].astype('Int64')
+    turmas = (df_alunos.drop_duplicates(COLUNA_ID).set_index(COLUNA_ID)
+              .reindex(ids)[['Turma', 'Horario_Formatado', 'Professor']].reset_index(drop=True))
+    return pd.DataFrame({
+        'Nome': ids.map(_indice_alunos(df_alunos).nome_do_id).fillna(linhas['Nome']),
+        'Turma': turmas['Turma'], 'Horário': turmas['Horario_Formatado'], 'Professor': turmas['Professor'],
+        'Ano': resumo['ano'], 'Mês': resumo['mes'],
+        **{coluna: resumo[status] for status, coluna in COLUNAS_FREQUENCIA.items()},
+    })
+
+
+def _montar_resumo_turmas(resumo_alunos: pd.DataFrame) -> pd.DataFrame:
+    """Totais mensais de cada turma (alunos sem turma atual ficam de fora)."""
+    chave = ['Turma', 'Horário', 'Professor', 'Ano', 'Mês']
+    return resumo_alunos.dropna(subset=['Turma']).groupby(chave, as_index=False)[list(COLUNAS_FREQUENCIA.values())].sum()
+
+
+def _com_frequencia(resumo: pd.DataFrame) -> pd.DataFrame:
+    """Acrescenta a frequência percentual (presenças / (presenças + faltas)), como no relatório de frequência."""
+    presencas, faltas = resumo[COLUNAS_FREQUENCIA['c']], resumo[COLUNAS_FREQUENCIA['f']]
+    return resumo.assign(**{'Frequência (%)': (presencas / (presencas + faltas).replace(0, 1) * 100).round(2)})
+
+
+@app.get("/api/relatorio/resumo")
+def obter_resumo_frequencia(
+    ano: Optional[int] = Query(None),
+    mes: Optional[int] = Query(None),
+    turma: Optional[str] = Query(None),
+    horario: Optional[str] = Query(None),
+    professor: Optional[str] = Query(None)
+):
+    """
+    Presenças, faltas e faltas justificadas por aluno e mês e por turma e mês,
+    servidas dos totais mantidos em memória (sem percorrer as chamadas).
+    """
+    df_alunos, tabela = get_abas_cached('Alunos', 'Registros')
+    # Montados uma vez por geração da aba Registros (cujos totais mensais são atualizados a cada chamada)
+    resumo_alunos = _indice('Resumo dos alunos', _montar_resumo_alunos, tabela, df_alunos)
+    resumo_turmas = _indice('Resumo das turmas', _montar_resumo_turmas, resumo_alunos)
+
+    def filtrar(resumo: pd.DataFrame) -> pd.DataFrame:
+        filtros = {'Ano': ano, 'Mês': mes, 'Turma': turma, 'Horário': horario, 'Professor': professor}
+        mascara = pd.Series(True, index=resumo.index)
+        for coluna, valor in filtros.items():
+            if valor is not None:
+                mascara &= resumo[coluna] == valor
+        return _com_frequencia(resumo[mascara]).fillna("")
+
+    return {
+        "alunos": filtrar(resumo_alunos).to_dict(orient='records'),
+        "turmas": filtrar(resumo_turmas).to_dict(orient='records'),
+    }
+
+def _modelo_relatorio() -> ModeloRelatorio:
+    """Template dos relatórios já compilado (recompilado se o arquivo mudou)."""
+    if not OPENPYXL_DISPONIVEL:
+        raise HTTPException(status_code=500, detail="A biblioteca 'openpyxl' é necessária no backend.")
+    if not os.path.exists(TEMPLATE_RELATORIO):
+        raise HTTPException(status_code=404, detail=f"Template '{TEMPLATE_RELATORIO}' não encontrado no servidor.")
+    try:
+        return modelo_relatorio(TEMPLATE_RELATORIO)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro ao ler o template: {e}")
+
+cache_relatorios = CacheRelatorios(RELATORIOS_CACHE_BYTES)
+
+def _chave_relatorio(tipo: str, pedidos: List[tuple]) -> tuple:
+    """
+    Chave de um relatório no cache de relatórios: o pedido, a versão do template e,
+    para cada turma e mês pedidos, a geração em que eles mudaram pela última vez.
+    Uma chamada ou a edição de um aluno só mudam a chave dos relatórios da turma
+    (e do mês) afetados; uma releitura da planilha muda a de todos.
+    """
+    # As gerações só valem depois que as abas estiverem carregadas e em dia
+    get_abas_cached(*ABAS_RELATORIO)
+    alteradas = _cache["turmas_alteradas"]
+    versoes = tuple(max(alteradas.get((turma, horario, professor), 0),
+                        alteradas.get(((turma, horario, professor), ano, mes), 0))
+                    for turma, horario, professor, mes, ano in pedidos)
+    return tipo, tuple(pedidos), os.path.getmtime(TEMPLATE_RELATORIO), _cache["versao_relatorios"], versoes
+
+def _pedidos_consolidado(requests_list: List[RelatorioRequest]) -> List[tuple]:
+    return [(req.turma, req.horario, req.professor, req.mes, req.ano) for req in requests_list]
+
 @app.get("/api/relatorio/excel")
 def gerar_relatorio_excel_endpoint(
     turma: str = Query(...),
@@ -452,86 +1128,17 @@ def gerar_relatorio_excel_endpoint(
     """
     Gera um arquivo Excel baseado no template 'relatorioChamada.xlsx' preenchido com os dados da turma.
     """
-    try:
-        from openpyxl import load_workbook
-        from openpyxl.styles import Alignment
-    except ImportError:
-        raise HTTPException(status_code=500, detail="A biblioteca 'openpyxl' é necessária no backend.")
-
-    if not os.path.exists(TEMPLATE_RELATORIO):
-        raise HTTPException(status_code=404, detail=f"Template '{TEMPLATE_RELATORIO}' não encontrado no servidor.")
-
-    # 1. Obter dados
-    dados_api = obter_alunos_filtrados(turma, horario, professor, mes, ano)
-    alunos = dados_api.get('alunos', [])
-    datas_str = dados_api.get('datas', [])
-    
-    # 2. Carregar Template
-    try:
-        wb = load_workbook(TEMPLATE_RELATORIO)
-        ws = wb.active
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erro ao ler o template: {e}")
-
-    # 3. Preencher Cabeçalho (Aba Turmas / Interface)
-    # B3: Professor, B4: Turma, B5: Horário
-    ws['B3'] = professor
-    ws['B4'] = turma
-    ws['B5'] = horario
-    
-    # E5: Mês selecionado (Ex: 10/2025)
-    ws['E5'] = f"{mes:02d}/{ano}"
-
-    # E6: Datas do mês (Cabeçalho das colunas de presença)
-    # Começa na coluna 5 (E)
-    col_inicio_datas = 5
-    for i, data in enumerate(datas_str):
-        # data vem como "dd/mm/yyyy", pegamos apenas o dia "dd" ou a data curta
-        dia = data.split('/')[0]
-        cell = ws.cell(row=6, column=col_inicio_datas + i)
-        cell.value = dia
-        cell.alignment = Alignment(horizontal='center')
-
-    # 4. Preencher Linhas de Alunos (A partir da linha 7)
-    linha_inicial = 7
-    for idx, aluno in enumerate(alunos):
-        linha_atual = linha_inicial + idx
-        
-        # A7: Nome
-        ws.cell(row=linha_atual, column=1, value=aluno.get('Nome', ''))
-        
-        # B7: Whatsapp
-        ws.cell(row=linha_atual, column=2, value=aluno.get('Whatsapp', ''))
-        
-        # C7: ParQ
-        ws.cell(row=linha_atual, column=3, value=aluno.get('ParQ', ''))
-        
-        # D7: Aniversário (Formatado)
-        aniversario = aluno.get('Aniversario', '')
-        if isinstance(aniversario, (datetime, pd.Timestamp)):
-            aniversario = aniversario.strftime('%d/%m/%Y')
-        elif aniversario and isinstance(aniversario, str):
-             aniversario = aniversario.split('T')[0].split(' ')[0]
-             try:
-                 dt_aniv = datetime.strptime(aniversario, '%Y-%m-%d')
-                 aniversario = dt_aniv.strftime('%d/%m/%Y')
-             except ValueError:
-                 pass
-        ws.cell(row=linha_atual, column=4, value=aniversario)
-
-        # E7 em diante: Registros de Presença
-        for i, data in enumerate(datas_str):
-            status = aluno.get(data, "")
-            # Mapeia códigos para visualização se necessário, ou mantém c/f/j
-            ws.cell(row=linha_atual, column=col_inicio_datas + i, value=status).alignment = Alignment(horizontal='center')
-
-        # M7: Nível (Coluna 13)
-        ws.cell(row=linha_atual, column=13, value=aluno.get('Nível', ''))
-
-    # 5. Salvar em memória e retornar stream
-    output = io.BytesIO()
-    wb.save(output)
-    output.seek(0)
+    modelo = _modelo_relatorio()
+    chave = _chave_relatorio('turma', [(turma, horario, professor, mes, ano)])
+    conteudo = cache_relatorios.obter(chave)
+    if conteudo is not None:
+        output = iter([conteudo])
+    else:
+        # Obter dados e gerar a aba a partir do template compilado
+        dados_api = obter_alunos_filtrados(turma, horario, professor, mes, ano)
+        cabecalho = dict(professor=professor, turma=turma, horario=horario, mes=mes, ano=ano)
+        output = cache_relatorios.guardando(
+            chave, relatorio_turma(modelo, cabecalho, dados_api.get('datas', []), dados_api.get('alunos', [])))
     
     filename = f"Relatorio_{turma}_{mes}_{ano}.xlsx".replace(" ", "_").replace("/", "-")
     
@@ -541,149 +1148,101 @@ def gerar_relatorio_excel_endpoint(
         headers={"Content-Disposition": f"attachment; filename={filename}"}
     )
 
+def _dados_relatorio(requests_list: List[RelatorioRequest]) -> Iterator[Tuple[dict, List[str], List[dict]]]:
+    """Cabeçalho, datas e alunos da aba de cada turma do relatório consolidado, de um único retrato dos dados."""
+    for req, grade in zip(requests_list, _grades_turmas(requests_list)):
+        cabecalho = dict(professor=req.professor, turma=req.turma, horario=req.horario, mes=req.mes, ano=req.ano)
+        yield cabecalho, grade['datas'], grade['alunos']
+
+def _validar_consolidado(requests_list: List[RelatorioRequest]) -> None:
+    """Erros previsíveis do relatório consolidado, verificados antes de começar a gerá-lo."""
+    if not requests_list:
+        raise HTTPException(status_code=400, detail="Nenhuma turma informada.")
+    if any(not 1 <= req.mes <= 12 for req in requests_list):
+        raise HTTPException(status_code=400, detail="Mês inválido.")
+
+def _nome_consolidado() -> str:
+    return f"Relatorio_Consolidado_{datetime.now().strftime('%Y%m%d_%H%M')}.xlsx"
+
 @app.post("/api/relatorio/excel_consolidado")
 def gerar_relatorio_excel_consolidado(requests_list: List[RelatorioRequest]):
     """
     Gera um único arquivo Excel com múltiplas abas (uma para cada turma solicitada),
     baseado no template 'relatorioChamada.xlsx'.
     """
-    try:
-        from openpyxl import load_workbook
-        from openpyxl.styles import Alignment
-        from openpyxl.utils import get_column_letter
-    except ImportError:
-        raise HTTPException(status_code=500, detail="A biblioteca 'openpyxl' é necessária no backend.")
-
-    if not os.path.exists(TEMPLATE_RELATORIO):
-        raise HTTPException(status_code=404, detail=f"Template '{TEMPLATE_RELATORIO}' não encontrado no servidor.")
-
-    # 1. Carregar Template
-    try:
-        wb = load_workbook(TEMPLATE_RELATORIO)
-        template_sheet = wb.active
-        template_sheet.title = "Template"
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erro ao ler o template: {e}")
-
-    # 2. Processar cada solicitação
-    for req in requests_list:
-        # Obter dados
-        dados_api = obter_alunos_filtrados(req.turma, req.horario, req.professor, req.mes, req.ano)
-        alunos = dados_api.get('alunos', [])
-        datas_str = dados_api.get('datas', [])
-
-        # Criar nova aba copiando o template
-        # Limpa caracteres inválidos para nome de aba Excel
-        safe_turma = "".join([c for c in req.turma if c.isalnum() or c in (' ', '-', '_')])[:20]
-        safe_horario = req.horario.replace(':', 'h')
-        sheet_title = f"{safe_turma} {safe_horario}"[:30]
-        
-        # Se a aba já existir, adiciona sufixo para evitar erro
-        count = 1
-        original_title = sheet_title
-        while sheet_title in wb.sheetnames:
-            sheet_title = f"{original_title}_{count}"
-            count += 1
-        
-        ws = wb.copy_worksheet(template_sheet)
-        ws.title = sheet_title
-
-        # Preencher Cabeçalho
-        ws['B3'] = req.professor
-        ws['B4'] = req.turma
-        ws['B5'] = req.horario
-        ws['E5'] = f"{req.mes:02d}/{req.ano}"
-
-        # Limpa cabeçalhos antigos da linha 6 (das datas até o fim provável) para evitar duplicação
-        for c in range(5, 35): 
-            ws.cell(row=6, column=c, value="")
-
-        # Preencher Datas (Cabeçalho das colunas de presença)
-        col_inicio_datas = 5 # Coluna E
-        for i, data in enumerate(datas_str):
-            dia = data.split('/')[0]
-            cell = ws.cell(row=6, column=col_inicio_datas + i)
-            cell.value = dia
-            cell.alignment = Alignment(horizontal='center')
-
-        # Definir posição da coluna Nível (Dinâmica: logo após a última data)
-        col_nivel = col_inicio_datas + len(datas_str)
-        ws.cell(row=6, column=col_nivel, value="Nível").alignment = Alignment(horizontal='center', vertical='center')
-        
-        # Remover colunas excedentes do template (após a coluna Nível)
-        max_col_template = ws.max_column
-        if max_col_template > col_nivel:
-            ws.delete_cols(col_nivel + 1, max_col_template - col_nivel)
-        
-        # Rastreia largura máxima para auto-ajuste (inicia com tamanho do cabeçalho)
-        max_width_nivel = len("Nível")
-
-        # Preencher Linhas de Alunos
-        linha_inicial = 7
-        for idx, aluno in enumerate(alunos):
-            linha_atual = linha_inicial + idx
-            
-            ws.cell(row=linha_atual, column=1, value=aluno.get('Nome', ''))
-            ws.cell(row=linha_atual, column=2, value=aluno.get('Whatsapp', ''))
-            ws.cell(row=linha_atual, column=3, value=aluno.get('ParQ', ''))
-            
-            # Formata Aniversário
-            aniversario = aluno.get('Aniversario', '')
-            if isinstance(aniversario, (datetime, pd.Timestamp)):
-                aniversario = aniversario.strftime('%d/%m/%Y')
-            elif aniversario and isinstance(aniversario, str):
-                 aniversario = aniversario.split('T')[0].split(' ')[0]
-                 try:
-                     dt_aniv = datetime.strptime(aniversario, '%Y-%m-%d')
-                     aniversario = dt_aniv.strftime('%d/%m/%Y')
-                 except ValueError:
-                     pass
-            ws.cell(row=linha_atual, column=4, value=aniversario)
-
-            # Registros de Presença
-            for i, data in enumerate(datas_str):
-                status = aluno.get(data, "")
-                ws.cell(row=linha_atual, column=col_inicio_datas + i, value=status).alignment = Alignment(horizontal='center')
-
-            # Nível na coluna dinâmica
-            nivel_val = aluno.get('Nível', '')
-            ws.cell(row=linha_atual, column=col_nivel, value=nivel_val)
-            if nivel_val:
-                max_width_nivel = max(max_width_nivel, len(str(nivel_val)))
-        
-        # Aplica o ajuste de largura na coluna Nível (+ margem visual)
-        ws.column_dimensions[get_column_letter(col_nivel)].width = max_width_nivel + 3
-
-    # 3. Remover a aba de template original antes de salvar
-    if "Template" in wb.sheetnames:
-        wb.remove(wb["Template"])
-
-    # 4. Salvar em memória e retornar stream
-    output = io.BytesIO()
-    wb.save(output)
-    output.seek(0)
-    
-    filename = f"Relatorio_Consolidado_{datetime.now().strftime('%Y%m%d_%H%M')}.xlsx"
+    modelo = _modelo_relatorio()
+    # O arquivo é enviado enquanto as abas são geradas: os erros previsíveis são verificados antes
+    _validar_consolidado(requests_list)
+
+    chave = _chave_relatorio('consolidado', _pedidos_consolidado(requests_list))
+    conteudo = cache_relatorios.obter(chave)
+    if conteudo is not None:
+        output = iter([conteudo])
+    else:
+        # Os dados de cada turma são obtidos só quando sua aba vai ser gerada
+        output = cache_relatorios.guardando(chave, relatorio_consolidado(modelo, _dados_relatorio(requests_list)))
     
     return StreamingResponse(
         output, 
         media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", 
-        headers={"Content-Disposition": f"attachment; filename={filename}"}
+        headers={"Content-Disposition": f"attachment; filename={_nome_consolidado()}"}
+    )
+
+# --- RELATÓRIOS EM SEGUNDO PLANO ---
+fila_relatorios = FilaRelatorios(_dados_relatorio, RELATORIOS_PROCESSOS, RELATORIOS_LIMITE_BYTES, RELATORIOS_RETENCAO)
+
+def _tarefa_relatorio(id_tarefa: str) -> TarefaRelatorio:
+    tarefa = fila_relatorios.obter(id_tarefa)
+    if tarefa is None:
+        raise HTTPException(status_code=404, detail="Relatório não encontrado (o arquivo pode ter sido descartado).")
+    return tarefa
+
+@app.post("/api/relatorio/tarefas", status_code=202)
+def criar_tarefa_relatorio(requests_list: List[RelatorioRequest]):
+    """
+    Enfileira a geração do relatório consolidado e responde na hora com o 'id' da tarefa.
+    O andamento é consultado em /api/relatorio/tarefas/{id} e o arquivo pronto baixado em
+    /api/relatorio/tarefas/{id}/arquivo.
+    """
+    modelo = _modelo_relatorio()
+    _validar_consolidado(requests_list)
+    chave = _chave_relatorio('consolidado', _pedidos_consolidado(requests_list))
+    conteudo = cache_relatorios.obter(chave)
+    if conteudo is not None:
+        return fila_relatorios.concluida(conteudo, len(requests_list), _nome_consolidado()).situacao()
+    tarefa = fila_relatorios.enfileirar(modelo, requests_list, _nome_consolidado(),
+                                        ao_concluir=functools.partial(cache_relatorios.guardar, chave))
+    return tarefa.situacao()
+
+@app.get("/api/relatorio/tarefas/{id_tarefa}")
+def consultar_tarefa_relatorio(id_tarefa: str):
+    """Andamento da geração: estado ('pendente', 'gerando', 'concluido' ou 'erro') e abas já geradas."""
+    return _tarefa_relatorio(id_tarefa).situacao()
+
+@app.get("/api/relatorio/tarefas/{id_tarefa}/arquivo")
+def baixar_tarefa_relatorio(id_tarefa: str):
+    """Arquivo Excel de uma tarefa concluída."""
+    tarefa = _tarefa_relatorio(id_tarefa)
+    conteudo = tarefa.conteudo
+    if tarefa.estado == ERRO:
+        raise HTTPException(status_code=500, detail=f"Erro ao gerar o relatório: {tarefa.erro}")
+    if conteudo is None:
+        raise HTTPException(status_code=409, detail="O relatório ainda está sendo gerado.")
+    return Response(
+        content=conteudo,
+        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        headers={"Content-Disposition": f"attachment; filename={tarefa.nome_arquivo}"}
     )
 
 @app.post("/api/chamada")
 def salvar_chamada(payload: dict):
-    """Recebe e salva os registros de chamada na planilha.
+    """Recebe e salva os registros de chamada no diário (incorporado à planilha em segundo plano).
 
     Aceita dois formatos de payload:
     - Estrutura antiga/ideal: {"registros": {"Nome": {"dd/mm/yyyy": "c"}}}
     - Estrutura em lista: {"registros": [{"Nome": "x", "Data": "dd/mm/yyyy", "Status": "c"}, ...]}
     """
     try:
-        # Carrega todos os dados do cache para uma reescrita segura
-        df_alunos, df_turmas, df_registros_orig, df_categorias, df_justificativas, df_exclusoes = get_dados_cached()
-        df_registros = df_registros_orig.copy()
-
         registros = payload.get("registros")
         if registros is None:
             raise HTTPException(status_code=400, detail="Payload inválido: campo 'registros' ausente.")
@@ -703,33 +1262,25 @@ def salvar_chamada(payload: dict):
         if not isinstance(registros, dict):
             raise HTTPException(status_code=400, detail="Formato de 'registros' inválido.")
 
+        # Validado antes do diário: uma entrada gravada nele precisa poder ser aplicada à planilha
+        invalidos = []
         for nome_aluno, registros_data in registros.items():
-            if nome_aluno not in df_registros['Nome'].values:
-                nova_linha = pd.DataFrame([{'Nome': nome_aluno}])
-                df_registros = pd.concat([df_registros, nova_linha], ignore_index=True)
-
-            # Garante que o índice seja encontrado após uma possível concatenação
-            idx_registro = df_registros[df_registros['Nome'] == nome_aluno].index
-
-            for data, status in registros_data.items():
-                if data not in df_registros.columns:
-                    df_registros[data] = pd.NA
-                df_registros.loc[idx_registro, data] = status if status else pd.NA
-
-        # Reescreve o arquivo Excel inteiro com os dados atualizados.
-        try:
-            with pd.ExcelWriter(NOME_ARQUIVO, engine='openpyxl') as writer: # type: ignore
-                df_alunos.to_excel(writer, sheet_name='Alunos', index=False)
-                df_turmas.to_excel(writer, sheet_name='Turmas', index=False)
-                df_categorias.to_excel(writer, sheet_name='Categorias', index=False)
-                df_registros.to_excel(writer, sheet_name='Registros', index=False)
-                df_justificativas.to_excel(writer, sheet_name='Justificativas', index=False)
-                df_exclusoes.to_excel(writer, sheet_name='Exclusões', index=False)
-        except PermissionError:
-            raise HTTPException(status_code=500, detail=f"Erro de permissão. O arquivo '{NOME_ARQUIVO}' pode estar aberto em outro programa.")
-
-        # Força a limpeza do cache para que a próxima leitura obtenha os dados salvos
-        _cache["timestamp"] = 0
+            if not isinstance(registros_data, dict):
+                invalidos.append(str(nome_aluno))
+                continue
+            invalidos.extend(f"{nome_aluno}: {data}" for data, status in registros_data.items()
+                             if not eh_data_valida(data) or not (status is None or isinstance(status, str)))
+        if invalidos:
+            raise HTTPException(status_code=400,
+                                detail="Registros inválidos (data dd/mm/aaaa e status em texto): " + ", ".join(invalidos))
+
+        # Uma entrada (aluno, data, status) por célula, confirmada em disco antes da resposta
+        diario.registrar(
+            (nome_aluno, data, status)
+            for nome_aluno, registros_data in registros.items()
+            for data, status in registros_data.items()
+        )
+        _compactador.avisar()
 
         return {"status": "Chamada salva com sucesso!"}
     except HTTPException:
@@ -738,24 +1289,20 @@ def salvar_chamada(payload: dict):
         raise HTTPException(status_code=500, detail=f"Erro ao salvar a chamada: {e}")
 
 @app.post("/api/justificativa")
+@_serializar_escrita
 def salvar_justificativa(payload: JustificativaPayload):
     """Salva uma nova justificativa na aba 'Justificativas'."""
     try:
-        df_alunos, df_turmas, df_registros, df_categorias, df_justificativas, df_exclusoes = get_dados_cached()
+        anterior, = get_abas_cached('Justificativas')
         
         # Adiciona a nova justificativa
-        nova_linha = pd.DataFrame([payload.dict()])
-        df_justificativas = pd.concat([df_justificativas, nova_linha], ignore_index=True)
-        
-        with pd.ExcelWriter(NOME_ARQUIVO, engine='openpyxl') as writer:
-            df_alunos.to_excel(writer, sheet_name='Alunos', index=False)
-            df_turmas.to_excel(writer, sheet_name='Turmas', index=False)
-            df_categorias.to_excel(writer, sheet_name='Categorias', index=False)
-            df_registros.to_excel(writer, sheet_name='Registros', index=False)
-            df_justificativas.to_excel(writer, sheet_name='Justificativas', index=False)
-            df_exclusoes.to_excel(writer, sheet_name='Exclusões', index=False)
-            
-        _cache["timestamp"] = 0
+        df_justificativas, rotulo = _anexar_linha(anterior, payload.dict())
+
+        _persistir(Alteracoes().gravar('Justificativas', [rotulo]), {'Justificativas': df_justificativas})
+        # O índice de justificativas recebe só a nova linha (sem reinterpretar a aba inteira)
+        instalada = _cache["abas"]['Justificativas']
+        _indice_derivado('Justificativas', anterior, instalada,
+                         lambda indice: indice.com_linhas(instalada.loc[[rotulo]]))
         return {"status": "Justificativa salva com sucesso"}
         
     except Exception as e:
@@ -764,14 +1311,15 @@ def salvar_justificativa(payload: JustificativaPayload):
 
 # --- NOVO ENDPOINT PARA ADICIONAR ALUNO ---
 @app.post("/api/aluno")
+@_serializar_escrita
 def adicionar_aluno(aluno_data: AlunoPayload):
     """Adiciona um novo aluno à planilha 'Alunos'."""
     try:
         # Carrega os dados atuais para garantir que não estamos sobrescrevendo nada
-        df_alunos, df_turmas, df_registros, df_categorias, df_justificativas, df_exclusoes = get_dados_cached()
+        df_alunos, df_exclusoes = get_abas_cached('Alunos', 'Exclusões')
 
         # Verifica se o aluno já existe (pelo nome)
-        if aluno_data.Nome in df_alunos['Nome'].values:
+        if aluno_data.Nome in _indice_alunos(df_alunos):
             raise HTTPException(
                 status_code=409, # 409 Conflict
                 detail=f"Já existe um aluno com o nome '{aluno_data.Nome}'. Por favor, use um nome diferente."
@@ -785,23 +1333,14 @@ def adicionar_aluno(aluno_data: AlunoPayload):
         # Garante que o nome da coluna de telefone corresponda ao que está no Excel
         if 'Telefone' in novo_aluno_dict:
              novo_aluno_dict['Whatsapp'] = novo_aluno_dict.pop('Telefone')
-
-        novo_aluno_df = pd.DataFrame([novo_aluno_dict])
+        # IDs de alunos excluídos continuam reservados (o histórico deles aponta para esses IDs)
+        novo_aluno_dict[COLUNA_ID] = proximo_id(df_alunos, df_exclusoes)
 
         # Adiciona a nova linha ao DataFrame de alunos
-        df_alunos_atualizado = pd.concat([df_alunos, novo_aluno_df], ignore_index=True)
-
-        # Reescreve o arquivo Excel com a lista de alunos atualizada
-        with pd.ExcelWriter(NOME_ARQUIVO, engine='openpyxl') as writer:
-            df_alunos_atualizado.to_excel(writer, sheet_name='Alunos', index=False)
-            df_turmas.to_excel(writer, sheet_name='Turmas', index=False)
-            df_categorias.to_excel(writer, sheet_name='Categorias', index=False)
-            df_registros.to_excel(writer, sheet_name='Registros', index=False)
-            df_justificativas.to_excel(writer, sheet_name='Justificativas', index=False)
-            df_exclusoes.to_excel(writer, sheet_name='Exclusões', index=False)
+        df_alunos_atualizado, rotulo = _anexar_linha(df_alunos, novo_aluno_dict)
 
-        # Força a limpeza do cache para que a próxima leitura inclua o novo aluno
-        _cache["timestamp"] = 0
+        # Persiste o novo aluno (o cache é invalidado para que a próxima leitura o inclua)
+        _persistir(Alteracoes().gravar('Alunos', [rotulo]), {'Alunos': df_alunos_atualizado})
 
         return {"status": "Aluno adicionado com sucesso!", "aluno": aluno_data.dict()}
 
@@ -812,6 +1351,7 @@ def adicionar_aluno(aluno_data: AlunoPayload):
 
 # --- NOVO ENDPOINT PARA ATUALIZAR ALUNO ---
 @app.put("/api/aluno/{nome_original}")
+@_serializar_escrita
 def atualizar_aluno(nome_original: str, aluno_data: AlunoPayload):
     """Atualiza os dados de um aluno existente."""
     try:
@@ -819,18 +1359,19 @@ def atualizar_aluno(nome_original: str, aluno_data: AlunoPayload):
         nome_real = unquote(nome_original)
 
         # Obtém dados do cache
-        df_alunos_cache, df_turmas, df_registros_cache, df_categorias, df_justificativas, df_exclusoes = get_dados_cached()
+        # Registros também é carregada: linhas ainda sem ID são ligadas ao aluno pelo nome (antes da troca)
+        df_alunos_cache, _ = get_abas_cached('Alunos', 'Registros')
+        indice = _indice_alunos(df_alunos_cache)
         
         # Trabalha com cópias para não afetar o cache antes de salvar com sucesso
         df_alunos = df_alunos_cache.copy()
-        df_registros = df_registros_cache.copy()
 
         # Verifica se o aluno existe
-        if nome_real not in df_alunos['Nome'].values:
+        if nome_real not in indice:
             raise HTTPException(status_code=404, detail=f"Aluno '{nome_real}' não encontrado.")
 
         # Verifica conflito de nome (se o nome foi alterado e o novo já existe)
-        if aluno_data.Nome != nome_real and aluno_data.Nome in df_alunos['Nome'].values:
+        if aluno_data.Nome != nome_real and aluno_data.Nome in indice:
             raise HTTPException(status_code=409, detail=f"O nome '{aluno_data.Nome}' já está em uso por outro aluno.")
 
         # Prepara os dados (mapeia campos do payload para colunas do Excel)
@@ -840,26 +1381,17 @@ def atualizar_aluno(nome_original: str, aluno_data: AlunoPayload):
             dados_atualizados['Whatsapp'] = dados_atualizados.pop('Telefone')
 
         # Atualiza os dados no DataFrame de Alunos
-        idx = df_alunos[df_alunos['Nome'] == nome_real].index[0]
+        idx = indice.por_nome[nome_real]
         for col, valor in dados_atualizados.items():
             df_alunos.loc[idx, col] = valor
 
-        # Se o nome mudou, atualiza também na planilha de Registros para não perder o histórico
+        # Registros está ligada ao ID do aluno: renomear não reescreve o histórico.
+        # Chamadas ainda no diário passam a apontar para o novo nome junto com a troca em Alunos
+        # (a sobreposição do diário localiza cada aluno pelo nome atual)
+        renomear = None
         if aluno_data.Nome != nome_real:
-            if 'Nome' in df_registros.columns:
-                df_registros.loc[df_registros['Nome'] == nome_real, 'Nome'] = aluno_data.Nome
-
-        # Salva todas as alterações no arquivo Excel
-        with pd.ExcelWriter(NOME_ARQUIVO, engine='openpyxl') as writer:
-            df_alunos.to_excel(writer, sheet_name='Alunos', index=False)
-            df_turmas.to_excel(writer, sheet_name='Turmas', index=False)
-            df_categorias.to_excel(writer, sheet_name='Categorias', index=False)
-            df_registros.to_excel(writer, sheet_name='Registros', index=False)
-            df_justificativas.to_excel(writer, sheet_name='Justificativas', index=False)
-            df_exclusoes.to_excel(writer, sheet_name='Exclusões', index=False)
-
-        # Invalida o cache para forçar recarregamento
-        _cache["timestamp"] = 0
+            renomear = functools.partial(diario.renomear, nome_real, aluno_data.Nome)
+        _persistir(Alteracoes().gravar('Alunos', [idx]), {'Alunos': df_alunos}, junto=renomear)
         
         return {"status": "Aluno atualizado com sucesso!", "aluno": aluno_data.dict()}
 
@@ -870,37 +1402,33 @@ def atualizar_aluno(nome_original: str, aluno_data: AlunoPayload):
 
 # --- NOVO ENDPOINT PARA EXCLUIR ALUNO (MOVER PARA EXCLUSÕES) ---
 @app.delete("/api/aluno/{nome_original}")
+@_serializar_escrita
 def excluir_aluno(nome_original: str):
     """Remove o aluno da lista ativa e o move para a aba 'Exclusões'."""
     try:
         nome_real = unquote(nome_original)
-        df_alunos, df_turmas, df_registros, df_categorias, df_justificativas, df_exclusoes = get_dados_cached()
+        df_alunos, df_exclusoes = get_abas_cached('Alunos', 'Exclusões')
 
-        if nome_real not in df_alunos['Nome'].values:
+        if nome_real not in _indice_alunos(df_alunos):
             raise HTTPException(status_code=404, detail=f"Aluno '{nome_real}' não encontrado.")
 
         # Extrai a linha do aluno
-        aluno_row = df_alunos[df_alunos['Nome'] == nome_real].iloc[0].to_dict()
+        mask_aluno = df_alunos['Nome'] == nome_real
+        aluno_row = df_alunos[mask_aluno].iloc[0].to_dict()
         
         # Adiciona a data de exclusão
         aluno_row['Data Exclusão'] = datetime.now()
         
         # Adiciona à tabela de exclusões
-        df_exclusoes = pd.concat([df_exclusoes, pd.DataFrame([aluno_row])], ignore_index=True)
+        df_exclusoes, rotulo = _anexar_linha(df_exclusoes, aluno_row)
         
         # Remove da tabela de alunos
-        df_alunos = df_alunos[df_alunos['Nome'] != nome_real]
+        removidos = df_alunos.index[mask_aluno]
+        df_alunos = df_alunos[~mask_aluno]
 
         # Salva tudo
-        with pd.ExcelWriter(NOME_ARQUIVO, engine='openpyxl') as writer:
-            df_alunos.to_excel(writer, sheet_name='Alunos', index=False)
-            df_turmas.to_excel(writer, sheet_name='Turmas', index=False)
-            df_categorias.to_excel(writer, sheet_name='Categorias', index=False)
-            df_registros.to_excel(writer, sheet_name='Registros', index=False)
-            df_justificativas.to_excel(writer, sheet_name='Justificativas', index=False)
-            df_exclusoes.to_excel(writer, sheet_name='Exclusões', index=False)
-
-        _cache["timestamp"] = 0
+        alteracoes = Alteracoes().remover('Alunos', removidos).gravar('Exclusões', [rotulo])
+        _persistir(alteracoes, {'Alunos': df_alunos, 'Exclusões': df_exclusoes})
         return {"status": f"Aluno '{nome_real}' movido para Exclusões."}
 
     except HTTPException:
@@ -912,21 +1440,23 @@ def excluir_aluno(nome_original: str):
 @app.get("/api/exclusoes")
 def get_exclusoes():
     """Retorna a lista de alunos excluídos."""
-    _, _, _, _, _, df_exclusoes = get_dados_cached()
+    df_exclusoes, = get_abas_cached('Exclusões')
     # Formata datas se necessário, ou retorna como está
     return df_exclusoes.to_dict(orient='records')
 
 # --- NOVO ENDPOINT PARA RESTAURAR ALUNO ---
 @app.post("/api/restaurar")
+@_serializar_escrita
 def restaurar_aluno(aluno_data: AlunoPayload):
     """Restaura um aluno da lista de exclusões para a lista ativa."""
     try:
-        df_alunos, df_turmas, df_registros, df_categorias, df_justificativas, df_exclusoes = get_dados_cached()
+        df_alunos, df_exclusoes = get_abas_cached('Alunos', 'Exclusões')
         
         nome_aluno = aluno_data.Nome
+        alteracoes = Alteracoes()
         
         # Verifica se já existe na lista ativa (evitar duplicatas)
-        if nome_aluno in df_alunos['Nome'].values:
+        if nome_aluno in _indice_alunos(df_alunos):
              # Se já existe, apenas removemos da exclusão (assumindo que foi recriado manualmente ou restaurado antes)
              pass
         else:
@@ -935,24 +1465,22 @@ def restaurar_aluno(aluno_data: AlunoPayload):
             novo_aluno_dict['Data de Nascimento'] = novo_aluno_dict.pop('Aniversario')
             if 'Telefone' in novo_aluno_dict:
                 novo_aluno_dict['Whatsapp'] = novo_aluno_dict.pop('Telefone')
+            # Volta com o ID que tinha antes da exclusão, reencontrando seu histórico em Registros
+            excluido = _indice_alunos(df_exclusoes, 'Exclusões').id_do_nome.get(nome_aluno)
+            novo_aluno_dict[COLUNA_ID] = excluido if excluido is not None else proximo_id(df_alunos, df_exclusoes)
             
             # Adiciona de volta aos alunos
-            df_alunos = pd.concat([df_alunos, pd.DataFrame([novo_aluno_dict])], ignore_index=True)
+            df_alunos, rotulo = _anexar_linha(df_alunos, novo_aluno_dict)
+            alteracoes.gravar('Alunos', [rotulo])
 
         # Remove da lista de exclusões (remove todas as ocorrências desse nome)
         if 'Nome' in df_exclusoes.columns:
-            df_exclusoes = df_exclusoes[df_exclusoes['Nome'] != nome_aluno]
+            mask_exclusoes = df_exclusoes['Nome'] == nome_aluno
+            alteracoes.remover('Exclusões', df_exclusoes.index[mask_exclusoes])
+            df_exclusoes = df_exclusoes[~mask_exclusoes]
 
         # Salva tudo
-        with pd.ExcelWriter(NOME_ARQUIVO, engine='openpyxl') as writer:
-            df_alunos.to_excel(writer, sheet_name='Alunos', index=False)
-            df_turmas.to_excel(writer, sheet_name='Turmas', index=False)
-            df_categorias.to_excel(writer, sheet_name='Categorias', index=False)
-            df_registros.to_excel(writer, sheet_name='Registros', index=False)
-            df_justificativas.to_excel(writer, sheet_name='Justificativas', index=False)
-            df_exclusoes.to_excel(writer, sheet_name='Exclusões', index=False)
-
-        _cache["timestamp"] = 0
+        _persistir(alteracoes, {'Alunos': df_alunos, 'Exclusões': df_exclusoes})
         return {"status": f"Aluno '{nome_aluno}' restaurado com sucesso."}
 
     except Exception as e:
@@ -961,6 +1489,7 @@ def restaurar_aluno(aluno_data: AlunoPayload):
 
 # --- NOVO ENDPOINT PARA EXCLUIR TURMA ---
 @app.delete("/api/turma")
+@_serializar_escrita
 def excluir_turma(
     turma: str = Query(...),
     horario: str = Query(...),
@@ -968,37 +1497,19 @@ def excluir_turma(
 ):
     """Exclui uma turma da planilha 'Turmas'."""
     try:
-        df_alunos, df_turmas, df_registros, df_categorias, df_justificativas, df_exclusoes = get_dados_cached()
-        
-        # Cria uma cópia para manipulação e formata o horário para localizar a linha correta
-        df_turmas_temp = df_turmas.copy()
-        df_turmas_temp['Horario_Formatado'] = df_turmas_temp['Horário'].apply(formatar_horario)
+        df_turmas, df_alunos = get_abas_cached('Turmas', 'Alunos')
         
         # Localiza a turma pelos critérios (Turma, Horário Formatado, Professor)
-        mask = (
-            (df_turmas_temp['Turma'] == turma) & 
-            (df_turmas_temp['Horario_Formatado'] == horario) & 
-            (df_turmas_temp['Professor'] == professor)
-        )
+        indices_to_drop = _indice_turmas(df_turmas, df_alunos).turmas.get((turma, horario, professor))
         
-        if not mask.any():
+        if not indices_to_drop:
             raise HTTPException(status_code=404, detail="Turma não encontrada para exclusão.")
             
         # Remove as linhas encontradas do DataFrame original
-        indices_to_drop = df_turmas_temp[mask].index
         df_turmas = df_turmas.drop(indices_to_drop)
         
-        # Salva as alterações no Excel
-        with pd.ExcelWriter(NOME_ARQUIVO, engine='openpyxl') as writer:
-            df_alunos.to_excel(writer, sheet_name='Alunos', index=False)
-            df_turmas.to_excel(writer, sheet_name='Turmas', index=False)
-            df_categorias.to_excel(writer, sheet_name='Categorias', index=False)
-            df_registros.to_excel(writer, sheet_name='Registros', index=False)
-            df_justificativas.to_excel(writer, sheet_name='Justificativas', index=False)
-            df_exclusoes.to_excel(writer, sheet_name='Exclusões', index=False)
-            
-        # Invalida o cache
-        _cache["timestamp"] = 0
+        # Salva as alterações (e invalida o cache)
+        _persistir(Alteracoes().remover('Turmas', indices_to_drop), {'Turmas': df_turmas})
         
         return {"status": "Turma excluída com sucesso"}
         
@@ -1011,24 +1522,15 @@ def excluir_turma(
 
 # --- NOVO ENDPOINT PARA ATUALIZAR NÍVEL DA TURMA ---
 @app.put("/api/turma/nivel")
+@_serializar_escrita
 def atualizar_nivel_turma(payload: TurmaNivelPayload):
     """Atualiza o nível de uma turma existente."""
     try:
-        df_alunos, df_turmas, df_registros, df_categorias, df_justificativas, df_exclusoes = get_dados_cached()
-        
-        # Cria cópia para manipulação segura e busca
-        df_turmas_temp = df_turmas.copy()
-        df_turmas_temp['Horario_Formatado'] = df_turmas_temp['Horário'].apply(formatar_horario)
+        df_turmas, df_alunos = get_abas_cached('Turmas', 'Alunos')
         
         # Localiza a turma
-        mask = (
-            (df_turmas_temp['Turma'] == payload.turma) & 
-            (df_turmas_temp['Horario_Formatado'] == payload.horario) & 
-            (df_turmas_temp['Professor'] == payload.professor)
-        )
-        
-        indices = df_turmas_temp[mask].index
-        if indices.empty:
+        indices = _indice_turmas(df_turmas, df_alunos).turmas.get((payload.turma, payload.horario, payload.professor))
+        if not indices:
             raise HTTPException(status_code=404, detail="Turma não encontrada para atualização.")
             
         # Atualiza o nível no DataFrame original (usando os índices encontrados)
@@ -1036,15 +1538,7 @@ def atualizar_nivel_turma(payload: TurmaNivelPayload):
         df_turmas_to_save = df_turmas.copy()
         df_turmas_to_save.loc[indices, 'Nível'] = payload.novo_nivel
         
-        with pd.ExcelWriter(NOME_ARQUIVO, engine='openpyxl') as writer:
-            df_alunos.to_excel(writer, sheet_name='Alunos', index=False)
-            df_turmas_to_save.to_excel(writer, sheet_name='Turmas', index=False)
-            df_categorias.to_excel(writer, sheet_name='Categorias', index=False)
-            df_registros.to_excel(writer, sheet_name='Registros', index=False)
-            df_justificativas.to_excel(writer, sheet_name='Justificativas', index=False)
-            df_exclusoes.to_excel(writer, sheet_name='Exclusões', index=False)
-            
-        _cache["timestamp"] = 0 # Invalida cache
+        _persistir(Alteracoes().gravar('Turmas', indices), {'Turmas': df_turmas_to_save})
         return {"status": "Nível atualizado com sucesso"}
         
     except HTTPException:
@@ -1053,19 +1547,15 @@ def atualizar_nivel_turma(payload: TurmaNivelPayload):
         raise HTTPException(status_code=500, detail=f"Erro ao atualizar nível: {e}")
 
 @app.post("/api/turma")
+@_serializar_escrita
 def adicionar_turma(turma_data: TurmaPayload):
     """Adiciona uma nova turma à planilha 'Turmas'."""
     try:
-        df_alunos, df_turmas, df_registros, df_categorias, df_justificativas, df_exclusoes = get_dados_cached()
+        df_turmas, df_alunos = get_abas_cached('Turmas', 'Alunos')
 
         # Verifica duplicidade
-        df_check = df_turmas.copy()
-        df_check['Horario_Formatado'] = df_check['Horário'].apply(formatar_horario)
         horario_input = formatar_horario(turma_data.Horário)
-
-        exists = ((df_check['Turma'] == turma_data.Turma) & 
-                  (df_check['Horario_Formatado'] == horario_input) & 
-                  (df_check['Professor'] == turma_data.Professor)).any()
+        exists = (turma_data.Turma, horario_input, turma_data.Professor) in _indice_turmas(df_turmas, df_alunos).turmas
 
         if exists:
              raise HTTPException(status_code=409, detail="Esta turma já existe.")
@@ -1079,17 +1569,9 @@ def adicionar_turma(turma_data: TurmaPayload):
             "Data de Início": turma_data.Data_Inicio
         }
         
-        df_turmas = pd.concat([df_turmas, pd.DataFrame([nova_turma])], ignore_index=True)
+        df_turmas, rotulo = _anexar_linha(df_turmas, nova_turma)
 
-        with pd.ExcelWriter(NOME_ARQUIVO, engine='openpyxl') as writer:
-            df_alunos.to_excel(writer, sheet_name='Alunos', index=False)
-            df_turmas.to_excel(writer, sheet_name='Turmas', index=False)
-            df_categorias.to_excel(writer, sheet_name='Categorias', index=False)
-            df_registros.to_excel(writer, sheet_name='Registros', index=False)
-            df_justificativas.to_excel(writer, sheet_name='Justificativas', index=False)
-            df_exclusoes.to_excel(writer, sheet_name='Exclusões', index=False)
-
-        _cache["timestamp"] = 0
+        _persistir(Alteracoes().gravar('Turmas', [rotulo]), {'Turmas': df_turmas})
         return {"status": "Turma adicionada com sucesso!"}
     except HTTPException:
         raise
@@ -1097,25 +1579,20 @@ def adicionar_turma(turma_data: TurmaPayload):
         raise HTTPException(status_code=500, detail=f"Erro ao adicionar turma: {e}")
 
 @app.put("/api/turma")
+@_serializar_escrita
 def editar_turma(payload: TurmaEditPayload):
     """Edita uma turma existente."""
     try:
-        df_alunos, df_turmas_cache, df_registros, df_categorias, df_justificativas, df_exclusoes = get_dados_cached()
+        df_turmas_cache, df_alunos = get_abas_cached('Turmas', 'Alunos')
         df_turmas = df_turmas_cache.copy()
         
-        df_turmas_temp = df_turmas.copy()
-        df_turmas_temp['Horario_Formatado'] = df_turmas_temp['Horário'].apply(formatar_horario)
+        rotulos = _indice_turmas(df_turmas_cache, df_alunos).turmas.get(
+            (payload.old_turma, payload.old_horario, payload.old_professor))
         
-        mask = (
-            (df_turmas_temp['Turma'] == payload.old_turma) & 
-            (df_turmas_temp['Horario_Formatado'] == payload.old_horario) & 
-            (df_turmas_temp['Professor'] == payload.old_professor)
-        )
-        
-        if not mask.any():
+        if not rotulos:
             raise HTTPException(status_code=404, detail="Turma original não encontrada.")
             
-        idx = df_turmas_temp[mask].index[0]
+        idx = rotulos[0]
         
         df_turmas.at[idx, 'Turma'] = payload.new_data.Turma
         df_turmas.at[idx, 'Horário'] = payload.new_data.Horário
@@ -1124,20 +1601,85 @@ def editar_turma(payload: TurmaEditPayload):
         df_turmas.at[idx, 'Atalho'] = payload.new_data.Atalho
         df_turmas.at[idx, 'Data de Início'] = payload.new_data.Data_Inicio
 
-        with pd.ExcelWriter(NOME_ARQUIVO, engine='openpyxl') as writer:
-            df_alunos.to_excel(writer, sheet_name='Alunos', index=False)
-            df_turmas.to_excel(writer, sheet_name='Turmas', index=False)
-            df_categorias.to_excel(writer, sheet_name='Categorias', index=False)
-            df_registros.to_excel(writer, sheet_name='Registros', index=False)
-            df_justificativas.to_excel(writer, sheet_name='Justificativas', index=False)
-            df_exclusoes.to_excel(writer, sheet_name='Exclusões', index=False)
-            
-        _cache["timestamp"] = 0
+        _persistir(Alteracoes().gravar('Turmas', [idx]), {'Turmas': df_turmas})
         return {"status": "Turma atualizada com sucesso!"}
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao editar turma: {e}")
 
+# --- IMPORTAÇÃO/EXPORTAÇÃO DA PLANILHA ---
+@app.get("/api/exportar")
+def exportar_planilha():
+    """Exporta o estado atual (de qualquer motor de armazenamento) como uma planilha .xlsx."""
+    df_alunos, df_turmas, df_registros, df_categorias, df_justificativas, df_exclusoes = get_dados_cached()
+    dados = dict(zip(
+        ['Alunos', 'Turmas', 'Registros', 'Categorias', 'Justificativas', 'Exclusões'],
+        [df_alunos, df_turmas, df_registros, df_categorias, df_justificativas, df_exclusoes]
+    ))
+    output = io.BytesIO()
+    escrever_xlsx(dados, output)
+    output.seek(0)
+
+    return StreamingResponse(
+        output,
+        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        headers={"Content-Disposition": f"attachment; filename={NOME_ARQUIVO}"}
+    )
+
+@app.post("/api/importar")
+@_serializar_escrita
+def importar_planilha():
+    """Substitui o conteúdo do banco SQLite pelas abas da planilha do servidor."""
+    if not hasattr(motor, "importar_xlsx"):
+        raise HTTPException(status_code=400, detail=f"O motor '{motor.nome}' já usa a planilha diretamente.")
+    if not os.path.exists(NOME_ARQUIVO):
+        raise HTTPException(status_code=404, detail=f"Arquivo '{NOME_ARQUIVO}' não encontrado no servidor.")
+    try:
+        aguardar_persistencia(timeout=ESCRITA_TIMEOUT_IMPORTAR)
+        dados = motor.importar_xlsx(NOME_ARQUIVO)
+    except TimeoutError:
+        raise HTTPException(status_code=503, detail="Ainda há alterações sendo gravadas. Tente importar novamente em instantes.")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro ao importar a planilha: {e}")
+    _invalidar_cache()
+    return {"status": "Planilha importada com sucesso!", "abas": [aba for aba in ABAS if aba in dados]}
+
+# --- ESTATÍSTICAS DO CACHE ---
+@app.get("/api/cache/estatisticas")
+def estatisticas_cache():
+    """Contadores do cache: leituras, esperas por leituras de outras threads e estado de cada aba."""
+    agora = time.time()
+    return {
+        **_carga_unica.estatisticas(),
+        "recargas_segundo_plano": _revalidador.recargas,
+        "relatorios": cache_relatorios.estatisticas(),
+        "geracao": _cache["geracao"],
+        "abas": {
+            aba: {"versao": _cache["versoes"].get(aba), "idade_segundos": round(agora - carregada_em, 1)}
+            for aba, (_, carregada_em) in _cache["validade"].items()
+        },
+    }
+
+# --- DURABILIDADE DA FILA DE ESCRITA ---
+@app.post("/api/sincronizar")
+def sincronizar():
+    """Aguarda até que todas as alterações já aceitas pela API estejam gravadas em disco."""
+    try:
+        aguardar_persistencia(timeout=ESCRITA_TIMEOUT_SINCRONIZAR)
+    except FalhaPersistencia as e:
+        if isinstance(e.__cause__, PermissionError):
+            raise HTTPException(status_code=500, detail=f"Erro de permissão. O arquivo '{NOME_ARQUIVO}' pode estar aberto em outro programa.")
+        raise HTTPException(status_code=500, detail=f"Erro ao gravar os dados: {e}")
+    except TimeoutError as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    return {"status": "Dados gravados com sucesso!"}
+
+@app.get("/api/sincronizar")
+def estado_sincronizacao():
+    """Informa quantas alterações aguardam gravação e o último erro de gravação, se houver."""
+    erro = fila_escrita.ultimo_erro
+    return {"pendentes": fila_escrita.pendentes, "erro": str(erro) if erro else None, "geracao": _cache["geracao"]}
+
 # Para rodar este servidor, use o comando no terminal:
 # uvicorn backend:app --reload
\ No newline at end of file
@@ -0,0 +1,41 @@
+"""
+Calendário de aulas das turmas, compartilhado pelo backend e pela interface desktop.
+
+Os dias de aula de uma turma vêm do seu nome ("Terça e Quinta" -> terças e
+quintas). O nome de cada turma é interpretado uma única vez e a lista de
+datas de aula de cada (turma, ano, mês) fica memorizada (LRU): carregar uma
+grade de chamada ou um relatório não recalcula o calendário do mês.
+"""
+import calendar
+import functools
+from datetime import date
+from typing import Tuple
+
+# Dias da semana reconhecidos no nome da turma (0=Segunda, 6=Domingo)
+DIAS_DA_SEMANA = {
+    "segunda": 0, "terça": 1, "terca": 1,
+    "quarta": 2, "quinta": 3, "sexta": 4,
+    "sábado": 5, "sabado": 5, "domingo": 6
+}
+
+TODOS_OS_DIAS = tuple(range(7))
+
+
+@functools.lru_cache(maxsize=256)
+def dias_da_turma(turma: str) -> Tuple[int, ...]:
+    """Dias da semana (em ordem) citados no nome da turma; vazio se nenhum for reconhecido."""
+    nome = (turma or "").lower()
+    return tuple(sorted({indice for dia, indice in DIAS_DA_SEMANA.items() if dia in nome}))
+
+
+@functools.lru_cache(maxsize=1024)
+def datas_de_aula(turma: str, ano: int, mes: int) -> Tuple[str, ...]:
+    """
+    Datas (dd/mm/aaaa) do mês nos dias de aula da turma. Uma turma cujo nome
+    não cita nenhum dia da semana tem aula todos os dias.
+    Levanta ValueError para um mês inválido.
+    """
+    dias = dias_da_turma(turma) or TODOS_OS_DIAS
+    _, dias_no_mes = calendar.monthrange(ano, mes)
+    datas = (date(ano, mes, dia) for dia in range(1, dias_no_mes + 1))
+    return tuple(data.strftime('%d/%m/%Y') for data in datas if data.weekday() in dias)
@@ -8,10 +8,12 @@ import threading
 from datetime import datetime
 from urllib.parse import quote
 import webbrowser
-import calendar
+
+from calendario import datas_de_aula, dias_da_turma
 
 # --- CONFIGURAÇÕES GLOBAIS ---
 API_BASE_URL = "http://127.0.0.1:8000"
+RELATORIO_INTERVALO_CONSULTA_MS = 1000  # Intervalo entre consultas ao andamento de um relatório em geração
 
 # Mapeamento de status (similar ao do Streamlit)
 STATUS_MAP = {
@@ -374,6 +376,7 @@ class App(ctk.CTk):
         self.exclusoes_sort_state = [] # Estado da ordenação da aba Exclusões
         self.exclusoes_data = [] # Cache dos dados de exclusões
         self.chamada_widgets = {} # Guarda os widgets de botão para poder ler o estado
+        self.chamada_contagens = {} # Faltas ('f') e justificativas ('j') de cada aluno no mês da chamada
         self.all_students_data = None # Cache para todos os alunos
         self.categorias_data = None # Cache para as categorias
         self.turmas_data = None # Cache para os dados das turmas (usado para encontrar o nível)
@@ -392,6 +395,7 @@ class App(ctk.CTk):
         self.meses_opcoes = [] # Cache de meses disponíveis (do backend)
         self.relatorios_filter_state = {} # Estado dos filtros da aba Relatórios
         self.relatorios_sort_state = [] # Estado da ordenação da aba Relatórios
+        self.relatorios_btn_excel = None # Botão de gerar Excel (exibe o andamento da geração)
         
         # Mapeamento de views para seus frames de controle
         self.control_frames = {
@@ -614,6 +618,7 @@ class App(ctk.CTk):
             dias_calculados = self._calcular_dias_chamada(self.chamada_turma_combo.get())
             if dias_calculados:
                 self.chamada_data['datas'] = dias_calculados
+            self.chamada_contagens = self._buscar_contagens(params)
 
             if not self.chamada_data.get('alunos'):
                 self.after(0, lambda: self.chamada_info_label.configure(text="Nenhum aluno encontrado para os filtros selecionados."))
@@ -628,39 +633,41 @@ class App(ctk.CTk):
             self.after(0, lambda: self.chamada_info_label.configure(text=error_text))
             self.after(0, lambda: messagebox.showerror("Erro de API", f"Não foi possível buscar os dados dos alunos.\n\nErro: {e}"))
 
+    def _buscar_contagens(self, params):
+        """Faltas e justificativas de cada aluno no mês, dos totais mantidos pelo servidor (/api/relatorio/resumo)."""
+        contagens = {aluno['Nome']: {'f': 0, 'j': 0} for aluno in self.chamada_data.get('alunos', [])}
+        try:
+            response = requests.get(f"{API_BASE_URL}/api/relatorio/resumo",
+                                    params={**params, "ano": datetime.now().year})
+            response.raise_for_status()
+        except requests.exceptions.RequestException:
+            # Servidor sem o resumo: conta nas datas da chamada carregada
+            for aluno in self.chamada_data.get('alunos', []):
+                for data_str in self.chamada_data.get('datas', []):
+                    codigo = aluno.get(data_str, "")
+                    if codigo in contagens[aluno['Nome']]:
+                        contagens[aluno['Nome']][codigo] += 1
+            return contagens
+        for linha in response.json().get('alunos', []):
+            contagem = contagens.setdefault(linha['Nome'], {'f': 0, 'j': 0})
+            contagem['f'] += int(linha.get('Faltas (F)') or 0)
+            contagem['j'] += int(linha.get('Faltas Justificadas (J)') or 0)
+        return contagens
+
+    def _contar_mudanca(self, nome_aluno, status_anterior, status_novo):
+        """Atualiza as faltas e justificativas do aluno pela troca de um status (índices de STATUS_MAP)."""
+        contagem = self.chamada_contagens.setdefault(nome_aluno, {'f': 0, 'j': 0})
+        for status_id, passo in ((status_anterior, -1), (status_novo, 1)):
+            codigo = STATUS_MAP[status_id]["code"]
+            if codigo in contagem:
+                contagem[codigo] += passo
+
     def _calcular_dias_chamada(self, turma_str):
         """Gera lista de datas (dd/mm/yyyy) do mês atual para os dias da semana da turma."""
-        if not turma_str:
-            return []
-            
-        turma_lower = turma_str.lower()
-        # Mapeia dias da semana (0=Segunda, 6=Domingo)
-        dias_map = {
-            "segunda": 0, "terça": 1, "terca": 1, 
-            "quarta": 2, "quinta": 3, "sexta": 4, 
-            "sábado": 5, "sabado": 5, "domingo": 6
-        }
-        
-        dias_indices = set()
-        for nome, idx in dias_map.items():
-            if nome in turma_lower:
-                dias_indices.add(idx)
-                
-        if not dias_indices:
+        if not turma_str or not dias_da_turma(turma_str):
             return []
-            
         hoje = datetime.now()
-        ano = hoje.year
-        mes = hoje.month
-        
-        _, num_dias = calendar.monthrange(ano, mes)
-        datas = []
-        for dia in range(1, num_dias + 1):
-            dt = datetime(ano, mes, dia)
-            if dt.weekday() in dias_indices:
-                datas.append(dt.strftime('%d/%m/%Y'))
-                
-        return datas
+        return list(datas_de_aula(turma_str, hoje.year, hoje.month))
 
     def construir_grid(self):
         """Cria a tabela de chamada com base nos dados recebidos."""
@@ -739,18 +746,15 @@ class App(ctk.CTk):
 
             self.chamada_widgets[nome_aluno] = {}
             
-            # Contadores para lógica de ativação dos botões
-            count_f = 0
-            count_j = 0
+            # Contadores para lógica de ativação dos botões (totais do mês, ver _buscar_contagens)
+            contagem = self.chamada_contagens.get(nome_aluno, {'f': 0, 'j': 0})
+            count_f = contagem['f']
+            count_j = contagem['j']
 
             # Botões de status (Colunas 1 em diante)
             for col_idx, data_str in enumerate(self.chamada_data['datas'], start=1):
                 valor_registrado = aluno.get(data_str, "")
                 
-                # Contabiliza faltas e justificativas
-                if valor_registrado == 'f': count_f += 1
-                if valor_registrado == 'j': count_j += 1
-                
                 estado_inicial = 0
                 for k, v in STATUS_MAP.items():
                     if v["code"] == valor_registrado:
@@ -840,6 +844,7 @@ class App(ctk.CTk):
 
         for item in changes:
             w_info = self.chamada_widgets[item['aluno']][item['data']]
+            self._contar_mudanca(item['aluno'], item['prev_val'], 0)
             w_info["var"].set(0)
             self._aplicar_status_visual(0, w_info["btn"])
         
@@ -872,6 +877,7 @@ class App(ctk.CTk):
         self._registrar_undo({'type': 'single', 'aluno': nome_aluno, 'data': data_str, 'prev_val': old_status_id})
         
         status_var.set(novo_status_id)
+        self._contar_mudanca(nome_aluno, old_status_id, novo_status_id)
         self._aplicar_status_visual(novo_status_id, btn_widget)
         self._atualizar_estado_botoes_acao(nome_aluno)
 
@@ -879,24 +885,19 @@ class App(ctk.CTk):
         """Reverte um item específico para o valor anterior."""
         if nome in self.chamada_widgets and data in self.chamada_widgets[nome]:
             w_info = self.chamada_widgets[nome][data]
+            self._contar_mudanca(nome, w_info["var"].get(), prev_val)
             w_info["var"].set(prev_val)
             self._aplicar_status_visual(prev_val, w_info["btn"])
             self._atualizar_estado_botoes_acao(nome)
 
     def _atualizar_estado_botoes_acao(self, nome_aluno):
-        """Recalcula faltas e justificativas para ativar/desativar botões de ação em tempo real (incluindo desfazer)."""
+        """Ativa/desativa os botões de ação pelas faltas e justificativas do aluno (mantidas por _contar_mudanca)."""
         if nome_aluno not in self.chamada_widgets: return
         
         widgets = self.chamada_widgets[nome_aluno]
-        count_f = 0
-        count_j = 0
-        
-        for key, val in widgets.items():
-            if key == "actions": continue
-            status_id = val["var"].get()
-            code = STATUS_MAP[status_id]["code"]
-            if code == 'f': count_f += 1
-            if code == 'j': count_j += 1
+        contagem = self.chamada_contagens.get(nome_aluno, {'f': 0, 'j': 0})
+        count_f = contagem['f']
+        count_j = contagem['j']
             
         actions = widgets.get("actions", {})
         btn_trash = actions.get("trash")
@@ -2228,6 +2229,7 @@ class App(ctk.CTk):
                                       fg_color="#27ae60", hover_color="#2ecc71",
                                       command=self.gerar_relatorio_excel)
             btn_excel.grid(row=len(turmas)+1, column=0, columnspan=5, pady=20)
+            self.relatorios_btn_excel = btn_excel
 
     def _open_relatorios_filter_menu(self, key, button_widget):
         """Abre o menu de filtro para a aba Relatórios."""
@@ -2419,21 +2421,56 @@ class App(ctk.CTk):
             })
 
         try:
-            # Faz uma única requisição POST para gerar o arquivo consolidado
-            response = requests.post(f"{API_BASE_URL}/api/relatorio/excel_consolidado", json=requests_payload, stream=True)
+            # Enfileira a geração do arquivo consolidado no backend, que responde na hora
+            response = requests.post(f"{API_BASE_URL}/api/relatorio/tarefas", json=requests_payload, timeout=30)
             response.raise_for_status()
-            
-            filename = f"Relatorio_Geral_{mes_num}_{ano}.xlsx"
-            filepath = f"{folder_selected}/{filename}"
-            
-            with open(filepath, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    f.write(chunk)
-            
-            messagebox.showinfo("Sucesso", f"Relatório consolidado gerado com sucesso em:\n{filepath}")
-            
+            tarefa = response.json()
         except Exception as e:
             messagebox.showerror("Erro", f"Falha ao gerar relatório: {e}")
+            return
+
+        filename = f"Relatorio_Geral_{mes_num}_{ano}.xlsx"
+        filepath = f"{folder_selected}/{filename}"
+        self._exibir_andamento_relatorio(tarefa)
+        self._acompanhar_relatorio(tarefa['id'], filepath)
+
+    def _acompanhar_relatorio(self, id_tarefa, filepath):
+        """Consulta o andamento da geração (sem travar a interface) e baixa o arquivo quando estiver pronto."""
+        def _task():
+            try:
+                response = requests.get(f"{API_BASE_URL}/api/relatorio/tarefas/{id_tarefa}", timeout=10)
+                response.raise_for_status()
+                situacao = response.json()
+                if situacao['estado'] == 'erro':
+                    raise RuntimeError(situacao.get('erro'))
+                if situacao['estado'] != 'concluido':
+                    self.after(0, lambda: self._exibir_andamento_relatorio(situacao))
+                    self.after(RELATORIO_INTERVALO_CONSULTA_MS, lambda: self._acompanhar_relatorio(id_tarefa, filepath))
+                    return
+
+                response = requests.get(f"{API_BASE_URL}/api/relatorio/tarefas/{id_tarefa}/arquivo", stream=True, timeout=60)
+                response.raise_for_status()
+                with open(filepath, 'wb') as f:
+                    for chunk in response.iter_content(chunk_size=8192):
+                        f.write(chunk)
+
+                self.after(0, lambda: (self._exibir_andamento_relatorio(None),
+                                       messagebox.showinfo("Sucesso", f"Relatório consolidado gerado com sucesso em:\n{filepath}")))
+            except Exception as e:
+                self.after(0, lambda err=e: (self._exibir_andamento_relatorio(None),
+                                             messagebox.showerror("Erro", f"Falha ao gerar relatório: {err}")))
+
+        self.run_in_thread(_task)
+
+    def _exibir_andamento_relatorio(self, situacao):
+        """Mostra no botão de gerar Excel quantas abas já foram geradas (None restaura o botão)."""
+        btn = self.relatorios_btn_excel
+        if btn is None or not btn.winfo_exists():
+            return
+        if situacao is None:
+            btn.configure(text="📥 Gerar Excel das Turmas Selecionadas", state="normal")
+        else:
+            btn.configure(text=f"⏳ Gerando relatório... {situacao['concluidas']}/{situacao['total']} turmas", state="disabled")
 
     # MODIFICADO: A lógica foi movida para a classe AddStudentToplevel
     def open_add_student_window(self):
@@ -0,0 +1,154 @@
+"""
+Diário de gravação antecipada (write-ahead) das chamadas.
+
+Cada alteração de presença vira uma linha JSON compacta ["Nome", "dd/mm/yyyy", "c"]
+anexada ao arquivo do diário e sincronizada em disco (fsync) antes de a API
+responder. Um compactador em segundo plano incorpora periodicamente as entradas
+pendentes à aba Registros e esvazia o diário.
+"""
+import json
+import logging
+import os
+import threading
+from typing import Callable, Iterable, List, Tuple
+
+from armazenamento import eh_data_valida
+
+logger = logging.getLogger(__name__)
+
+# (sequência, nome, data, status)
+Entrada = Tuple[int, str, str, str]
+
+
+def celula_valida(nome, data, status) -> bool:
+    """Indica se a célula pode ser aplicada à aba Registros: data dd/mm/yyyy válida e status texto (ou vazio)."""
+    return isinstance(nome, str) and eh_data_valida(data) and (status is None or isinstance(status, str))
+
+
+class DiarioChamada:
+    """Arquivo de diário somente-anexação com cópia das entradas pendentes em memória."""
+
+    def __init__(self, caminho: str):
+        self.caminho = caminho
+        self._trava = threading.Lock()
+        self._entradas: List[Entrada] = []
+        self.sequencia = 0  # sequência da última entrada registrada neste processo
+        self._carregar()
+
+    def _carregar(self) -> None:
+        """Recupera entradas não compactadas (ex.: após uma queda do servidor)."""
+        if not os.path.exists(self.caminho):
+            return
+        descartadas = 0
+        with open(self.caminho, encoding='utf-8') as arquivo:
+            for linha in arquivo:
+                try:
+                    nome, data, status = json.loads(linha)
+                except (ValueError, TypeError):
+                    # Linha truncada por uma queda no meio da escrita
+                    descartadas += 1
+                    continue
+                if not celula_valida(nome, data, status):
+                    # Entrada que não pode ser aplicada à planilha (ex.: gravada por uma versão sem validação)
+                    logger.warning("Diário '%s': entrada inválida descartada: %r.", self.caminho, linha.strip())
+                    descartadas += 1
+                    continue
+                self.sequencia += 1
+                self._entradas.append((self.sequencia, nome, data, status))
+        if descartadas:
+            logger.warning("Diário '%s': %d linha(s) inválida(s) descartada(s).", self.caminho, descartadas)
+            self._reescrever(self._entradas)
+
+    def __len__(self) -> int:
+        return len(self._entradas)
+
+    @staticmethod
+    def _serializar(nome: str, data: str, status: str) -> str:
+        return json.dumps([nome, data, status], ensure_ascii=False, separators=(',', ':')) + '\n'
+
+    def _reescrever(self, entradas: List[Entrada]) -> None:
+        """Substitui o arquivo do diário de forma atômica."""
+        temporario = self.caminho + '.tmp'
+        with open(temporario, 'w', encoding='utf-8') as arquivo:
+            arquivo.write(''.join(self._serializar(n, d, s) for _, n, d, s in entradas))
+            arquivo.flush()
+            os.fsync(arquivo.fileno())
+        os.replace(temporario, self.caminho)
+
+    def registrar(self, celulas: Iterable[Tuple[str, str, str]]) -> int:
+        """
+        Anexa as células (nome, data, status) ao diário e só retorna após o fsync.
+        Nada é gravado se alguma célula não puder ser aplicada à planilha (ValueError).
+        """
+        celulas = [(str(n), str(d), s) for n, d, s in celulas]
+        invalidas = [c for c in celulas if not celula_valida(*c)]
+        if invalidas:
+            raise ValueError(f"Células inválidas para o diário: {invalidas}")
+        celulas = [(n, d, s or "") for n, d, s in celulas]
+        if not celulas:
+            return self.sequencia
+        with self._trava:
+            with open(self.caminho, 'a', encoding='utf-8') as arquivo:
+                arquivo.write(''.join(self._serializar(*c) for c in celulas))
+                arquivo.flush()
+                os.fsync(arquivo.fileno())
+            for nome, data, status in celulas:
+                self.sequencia += 1
+                self._entradas.append((self.sequencia, nome, data, status))
+            return self.sequencia
+
+    def pendentes(self, desde: int = 0) -> List[Entrada]:
+        """Entradas ainda não compactadas com sequência maior que 'desde'."""
+        with self._trava:
+            return [e for e in self._entradas if e[0] > desde]
+
+    def descartar_ate(self, sequencia: int) -> None:
+        """Remove as entradas já incorporadas à planilha (sequência <= 'sequencia')."""
+        with self._trava:
+            restantes = [e for e in self._entradas if e[0] > sequencia]
+            self._reescrever(restantes)
+            self._entradas = restantes
+
+    def renomear(self, nome_antigo: str, nome_novo: str) -> None:
+        """Aplica a renomeação de um aluno às entradas pendentes."""
+        with self._trava:
+            if not any(e[1] == nome_antigo for e in self._entradas):
+                return
+            entradas = [(q, nome_novo if n == nome_antigo else n, d, s) for q, n, d, s in self._entradas]
+            self._reescrever(entradas)
+            self._entradas = entradas
+
+
+class CompactadorDiario(threading.Thread):
+    """Executa a compactação a cada 'intervalo' segundos ou quando o diário atinge 'limite' entradas."""
+
+    def __init__(self, diario: DiarioChamada, compactar: Callable[[], int], intervalo: float, limite: int):
+        super().__init__(name="compactador-diario", daemon=True)
+        self.diario = diario
+        self.compactar = compactar
+        self.intervalo = intervalo
+        self.limite = limite
+        self._evento = threading.Event()
+        self._parar = False
+
+    def avisar(self) -> None:
+        """Chamado após cada registro; antecipa a compactação se o limite foi atingido."""
+        if len(self.diario) >= self.limite:
+            self._evento.set()
+
+    def parar(self) -> None:
+        self._parar = True
+        self._evento.set()
+        self.join()
+
+    def run(self) -> None:
+        while not self._parar:
+            self._evento.wait(self.intervalo)
+            self._evento.clear()
+            if self._parar or not len(self.diario):
+                continue
+            try:
+                self.compactar()
+            except Exception:
+                # As entradas permanecem no diário e serão tentadas na próxima rodada
+                logger.exception("Falha ao compactar o diário de chamadas.")
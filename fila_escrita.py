@@ -0,0 +1,145 @@
+"""
+Fila de escrita com um único gravador.
+
+Os endpoints aplicam as alterações ao estado em memória e apenas enfileiram a
+descrição do que mudou (Alteracoes). Uma thread gravadora junta tudo o que
+estiver pendente e persiste em uma única gravação, no máximo
+'latencia_maxima' segundos após a primeira alteração pendente.
+"""
+import logging
+import threading
+import time
+from typing import Callable, Optional
+
+from armazenamento import Alteracoes
+
+logger = logging.getLogger(__name__)
+
+
+class FalhaPersistencia(Exception):
+    """A gravação que cobriria as alterações aguardadas falhou."""
+
+
+class FilaEscrita:
+    """Agrupa alterações pendentes e as entrega a 'gravar' em uma thread dedicada."""
+
+    intervalo_retentativa = 5.0  # Segundos até tentar de novo um lote cuja gravação falhou
+
+    def __init__(self, gravar: Callable[[Alteracoes], None], latencia_maxima: float):
+        self.gravar = gravar
+        self.latencia_maxima = latencia_maxima
+        self._condicao = threading.Condition()
+        self._pendentes: Optional[Alteracoes] = None
+        self._desde = 0.0          # instante da primeira alteração pendente
+        self._emitido = 0          # último tíquete entregue a um endpoint
+        self._persistido = 0       # último tíquete gravado com sucesso
+        self._gravando = False
+        self._falhas = 0
+        self.ultimo_erro: Optional[BaseException] = None
+        self._parar = False
+        self._thread: Optional[threading.Thread] = None
+
+    # --- Produtores ---
+    def enfileirar(self, alteracoes: Alteracoes) -> int:
+        """Acrescenta as alterações ao lote pendente e retorna o tíquete para aguardar()."""
+        with self._condicao:
+            if self._pendentes is None:
+                self._pendentes = Alteracoes()
+                self._desde = time.monotonic()
+            self._pendentes.mesclar(alteracoes)
+            self._emitido += 1
+            ticket = self._emitido
+            self._garantir_thread()
+            self._condicao.notify_all()
+            return ticket
+
+    def aguardar(self, ticket: Optional[int] = None, timeout: Optional[float] = None) -> None:
+        """
+        Bloqueia até que o tíquete (ou tudo o que já foi enfileirado) esteja gravado.
+        Lança FalhaPersistencia se a gravação falhar e TimeoutError se o prazo expirar.
+        """
+        limite = None if timeout is None else time.monotonic() + timeout
+        with self._condicao:
+            ticket = self._emitido if ticket is None else ticket
+            falhas_iniciais = self._falhas
+            if self._persistido < ticket:
+                # Quem pede durabilidade não espera a latência máxima (nem a retentativa)
+                self._desde = 0.0
+                self._condicao.notify_all()
+            while self._persistido < ticket:
+                if self._falhas > falhas_iniciais:
+                    raise FalhaPersistencia(str(self.ultimo_erro)) from self.ultimo_erro
+                restante = None if limite is None else limite - time.monotonic()
+                if restante is not None and restante <= 0:
+                    raise TimeoutError("Tempo esgotado aguardando a gravação dos dados.")
+                self._condicao.wait(restante)
+
+    def ocioso(self) -> bool:
+        """Verdadeiro quando não há alterações pendentes nem gravação em andamento."""
+        with self._condicao:
+            return self._pendentes is None and not self._gravando
+
+    @property
+    def emitidos(self) -> int:
+        """Total de tíquetes entregues; muda a cada alteração enfileirada."""
+        return self._emitido
+
+    @property
+    def pendentes(self) -> int:
+        """Quantidade de tíquetes ainda não gravados."""
+        return self._emitido - self._persistido
+
+    # --- Gravador ---
+    def _garantir_thread(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._parar = False
+            self._thread = threading.Thread(target=self._executar, name="fila-escrita", daemon=True)
+            self._thread.start()
+
+    def parar(self, timeout: Optional[float] = None) -> None:
+        """Grava o que estiver pendente e encerra a thread gravadora."""
+        with self._condicao:
+            self._parar = True
+            self._desde = 0.0
+            self._condicao.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _executar(self) -> None:
+        while True:
+            with self._condicao:
+                while self._pendentes is None and not self._parar:
+                    self._condicao.wait()
+                if self._pendentes is None:
+                    return
+                # Espera a latência máxima para agrupar as alterações que chegarem nesse meio-tempo
+                while not self._parar:
+                    restante = self._desde + self.latencia_maxima - time.monotonic()
+                    if restante <= 0:
+                        break
+                    self._condicao.wait(restante)
+                lote, self._pendentes = self._pendentes, None
+                ticket = self._emitido
+                self._gravando = True
+            try:
+                self.gravar(lote)
+            except BaseException as erro:
+                logger.exception("Falha ao gravar as alterações pendentes.")
+                with self._condicao:
+                    # Devolve o lote à fila para uma nova tentativa
+                    if self._pendentes is not None:
+                        lote.mesclar(self._pendentes)
+                    self._pendentes = lote
+                    self._desde = time.monotonic() + self.intervalo_retentativa
+                    self.ultimo_erro = erro
+                    self._falhas += 1
+                    self._gravando = False
+                    self._condicao.notify_all()
+                    if self._parar:
+                        return
+                continue
+            with self._condicao:
+                self._persistido = max(self._persistido, ticket)
+                self.ultimo_erro = None
+                self._gravando = False
+                self._condicao.notify_all()
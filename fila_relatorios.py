@@ -0,0 +1,223 @@
+"""
+Fila de relatórios consolidados gerados em segundo plano.
+
+Um pedido vira uma tarefa e é respondido na hora com o identificador dela.
+Uma thread despachante gera as tarefas em ordem de chegada: obtém os dados das
+turmas no processo do servidor (onde está o cache), entrega a geração do
+XML de cada aba a um pool de processos e monta o .xlsx com as abas na ordem
+pedida à medida que elas ficam prontas. O andamento é consultado pelo
+identificador e o arquivo pronto fica guardado para download até ser
+descartado: os relatórios concluídos mais antigos saem primeiro quando o total
+guardado passa do limite em bytes, e qualquer um sai após o tempo de retenção.
+"""
+import logging
+import multiprocessing
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Deque, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from planilha_xml import gerar_xlsx
+from relatorios import ModeloRelatorio, aba_consolidado, abas_consolidado
+
+logger = logging.getLogger(__name__)
+
+# Estados de uma tarefa
+PENDENTE = 'pendente'
+GERANDO = 'gerando'
+CONCLUIDO = 'concluido'
+ERRO = 'erro'
+
+# (cabeçalho, datas, alunos) de uma turma, como em relatorios.relatorio_consolidado
+DadosTurma = Tuple[dict, List[str], List[dict]]
+
+
+def _gerar_aba(modelo: ModeloRelatorio, cabecalho: dict, datas: List[str], alunos: List[dict]) -> str:
+    """XML completo da aba de uma turma (executado nos processos do pool)."""
+    return ''.join(aba_consolidado(modelo, cabecalho, datas, alunos))
+
+
+class TarefaRelatorio:
+    """Um relatório consolidado pedido e o andamento da sua geração."""
+
+    def __init__(self, modelo: Optional[ModeloRelatorio], turmas: list, nome_arquivo: str,
+                 ao_concluir: Optional[Callable[[bytes], None]] = None):
+        self.id = uuid.uuid4().hex
+        self.modelo = modelo
+        self.turmas = turmas              # lista entregue a 'coletar'; liberada ao fim da geração
+        self.ao_concluir = ao_concluir    # recebe o arquivo gerado (ex.: para guardá-lo em um cache)
+        self.nome_arquivo = nome_arquivo
+        self.total = len(turmas)
+        self.concluidas = 0               # abas já geradas
+        self.estado = PENDENTE
+        self.erro: Optional[str] = None
+        self.conteudo: Optional[bytes] = None
+        self.criada_em = time.time()
+        self.concluida_em: Optional[float] = None
+
+    @property
+    def finalizada(self) -> bool:
+        return self.estado in (CONCLUIDO, ERRO)
+
+    def situacao(self) -> dict:
+        """Andamento da tarefa como servido pela API."""
+        return {
+            "id": self.id,
+            "estado": self.estado,
+            "total": self.total,
+            "concluidas": self.concluidas,
+            "progresso": round(self.concluidas / self.total, 3) if self.total else 1.0,
+            "erro": self.erro,
+            "arquivo": self.nome_arquivo,
+            "tamanho": len(self.conteudo) if self.conteudo is not None else None,
+        }
+
+
+class FilaRelatorios:
+    """Gera as tarefas enfileiradas em uma thread dedicada, com as abas geradas por 'processos' processos."""
+
+    def __init__(self, coletar: Callable[[list], Iterable[DadosTurma]], processos: int, limite_bytes: int, retencao: float):
+        self.coletar = coletar
+        self.processos = processos
+        self.limite_bytes = limite_bytes
+        self.retencao = retencao
+        self._condicao = threading.Condition()
+        self._tarefas: Dict[str, TarefaRelatorio] = {}
+        self._pendentes: Deque[TarefaRelatorio] = deque()
+        self._parar = False
+        self._thread: Optional[threading.Thread] = None
+        self._pool: Optional[Executor] = None
+
+    # --- Produtores e consultas ---
+    def enfileirar(self, modelo: ModeloRelatorio, turmas: list, nome_arquivo: str,
+                   ao_concluir: Optional[Callable[[bytes], None]] = None) -> TarefaRelatorio:
+        """Cria a tarefa de gerar o relatório das 'turmas' a partir do template compilado 'modelo'."""
+        tarefa = TarefaRelatorio(modelo, list(turmas), nome_arquivo, ao_concluir)
+        with self._condicao:
+            self._descartar_antigas()
+            self._tarefas[tarefa.id] = tarefa
+            self._pendentes.append(tarefa)
+            self._garantir_thread()
+            self._condicao.notify_all()
+        return tarefa
+
+    def concluida(self, conteudo: bytes, total: int, nome_arquivo: str) -> TarefaRelatorio:
+        """Registra como tarefa concluída um relatório que já estava pronto (ex.: guardado em cache)."""
+        tarefa = TarefaRelatorio(None, [], nome_arquivo)
+        tarefa.total = tarefa.concluidas = total
+        tarefa.conteudo, tarefa.estado, tarefa.concluida_em = conteudo, CONCLUIDO, time.time()
+        with self._condicao:
+            self._descartar_antigas()
+            self._tarefas[tarefa.id] = tarefa
+        return tarefa
+
+    def obter(self, id_tarefa: str) -> Optional[TarefaRelatorio]:
+        """A tarefa com o identificador, ou None se não existir ou já tiver sido descartada."""
+        with self._condicao:
+            self._descartar_antigas()
+            return self._tarefas.get(id_tarefa)
+
+    def _descartar_antigas(self) -> None:
+        """Descarta as tarefas finalizadas vencidas e, por ordem de conclusão, as que passam do limite em bytes."""
+        agora = time.time()
+        finalizadas = sorted((t for t in self._tarefas.values() if t.finalizada), key=lambda t: t.concluida_em)
+        total = sum(len(t.conteudo) for t in finalizadas if t.conteudo is not None)
+        # O relatório concluído mais recente é mantido mesmo que sozinho passe do limite
+        for tarefa in finalizadas[:-1]:
+            tamanho = len(tarefa.conteudo) if tarefa.conteudo is not None else 0
+            if total > self.limite_bytes or tarefa.concluida_em + self.retencao < agora:
+                del self._tarefas[tarefa.id]
+                total -= tamanho
+        if finalizadas and finalizadas[-1].concluida_em + self.retencao < agora:
+            del self._tarefas[finalizadas[-1].id]
+
+    # --- Despachante ---
+    def _garantir_thread(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._parar = False
+            self._thread = threading.Thread(target=self._executar, name="fila-relatorios", daemon=True)
+            self._thread.start()
+
+    def parar(self, timeout: Optional[float] = None) -> None:
+        """Encerra a thread despachante (depois da tarefa em andamento) e o pool de processos."""
+        with self._condicao:
+            self._parar = True
+            self._condicao.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self._descartar_pool()
+
+    def _descartar_pool(self) -> None:
+        """Encerra o pool de processos sem esperar, cancelando as abas ainda não iniciadas."""
+        pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def _executar(self) -> None:
+        while True:
+            with self._condicao:
+                while not self._pendentes and not self._parar:
+                    self._condicao.wait()
+                if self._parar:
+                    return
+                tarefa = self._pendentes.popleft()
+                tarefa.estado = GERANDO
+            try:
+                conteudo = b''.join(gerar_xlsx(self._abas(tarefa), tarefa.modelo.styles_xml, tarefa.modelo.tema_xml))
+                if tarefa.ao_concluir is not None:
+                    tarefa.ao_concluir(conteudo)
+            except BaseException as erro:
+                logger.exception("Falha ao gerar o relatório %s.", tarefa.id)
+                if isinstance(erro, BrokenProcessPool):
+                    self._descartar_pool()  # Um processo do pool morreu: o próximo relatório cria outro pool
+                estado, conteudo, mensagem = ERRO, None, str(erro) or type(erro).__name__
+            else:
+                estado, mensagem = CONCLUIDO, None
+            with self._condicao:
+                tarefa.conteudo, tarefa.erro = conteudo, mensagem
+                tarefa.turmas = tarefa.modelo = tarefa.ao_concluir = None
+                tarefa.concluida_em = time.time()
+                tarefa.estado = estado
+                self._descartar_antigas()
+                self._condicao.notify_all()
+
+    def _executor(self) -> Optional[Executor]:
+        """Pool de processos das abas (criado no primeiro relatório); None gera as abas na própria thread."""
+        if self._pool is None and self.processos > 0:
+            try:
+                # 'spawn': o processo do servidor tem outras threads, que não podem ser copiadas por um fork
+                self._pool = ProcessPoolExecutor(self.processos, mp_context=multiprocessing.get_context('spawn'))
+            except (OSError, NotImplementedError):
+                logger.warning("Pool de processos indisponível; os relatórios serão gerados na thread da fila.")
+                self.processos = 0
+        return self._pool
+
+    def _abas(self, tarefa: TarefaRelatorio) -> Iterator[Tuple[str, Tuple[str]]]:
+        """
+        (título, XML) de cada aba na ordem pedida. Os dados das turmas vêm de
+        'coletar' em sequência e até duas abas por processo ficam em geração ao mesmo tempo.
+        """
+        dados = abas_consolidado(self.coletar(tarefa.turmas))
+        pool = self._executor()
+        if pool is None:
+            for titulo, cabecalho, datas, alunos in dados:
+                xml = _gerar_aba(tarefa.modelo, cabecalho, datas, alunos)
+                tarefa.concluidas += 1
+                yield titulo, (xml,)
+            return
+        em_geracao = deque()
+        for titulo, cabecalho, datas, alunos in dados:
+            em_geracao.append((titulo, pool.submit(_gerar_aba, tarefa.modelo, cabecalho, datas, alunos)))
+            if len(em_geracao) >= 2 * self.processos:
+                yield self._aba_pronta(tarefa, *em_geracao.popleft())
+        while em_geracao:
+            yield self._aba_pronta(tarefa, *em_geracao.popleft())
+
+    @staticmethod
+    def _aba_pronta(tarefa: TarefaRelatorio, titulo: str, futuro) -> Tuple[str, Tuple[str]]:
+        xml = futuro.result()
+        tarefa.concluidas += 1
+        return titulo, (xml,)
@@ -0,0 +1,488 @@
+"""
+Armazenamento das presenças em formato longo.
+
+Na planilha, a aba Registros tem uma coluna 'dd/mm/aaaa' por dia de aula, e
+fica mais larga a cada semana. Em memória as presenças ficam em uma tabela
+longa (linha, dia, código do status), ordenada por dia, que é o que as
+entradas do diário atualizam. Cada linha traz o ID do aluno, que não muda
+quando ele é renomeado. A aba larga continua existindo apenas como visão de
+exportação (para_largo), usada ao gravar a planilha.
+
+Para as consultas, cada tabela monta uma única vez uma matriz densa int8
+(linhas x datas) com índices de nome, de ID e de data para posição (MatrizFrequencia):
+grades do mês e contagens viram fatias vetorizadas da matriz. As datas ficam
+também em um vetor ordenado, e um período [início, fim] é localizado por
+busca binária.
+
+Os totais de cada status por linha e mês (resumo_mensal) são calculados uma
+vez; cada nova geração criada por com_entradas recebe o resumo da anterior
+acrescido apenas da diferença das células alteradas.
+
+Os objetos são imutáveis: cada alteração devolve uma nova TabelaFrequencia,
+que é instalada no cache como uma nova geração (com sua própria matriz).
+"""
+import functools
+import logging
+from datetime import date
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from armazenamento import COLUNA_ID, eh_coluna_data, eh_data_valida
+
+logger = logging.getLogger(__name__)
+
+# Códigos fixos dos status usuais; outros valores encontrados recebem os códigos seguintes.
+# O código 0 representa a célula vazia e nunca é armazenado.
+STATUS_PADRAO = ["", "c", "f", "j"]
+
+
+def dia_da_coluna(coluna: str) -> np.datetime64:
+    """'dd/mm/aaaa' -> datetime64[D]."""
+    dia, mes, ano = coluna.split('/')
+    return np.datetime64(f"{ano}-{mes}-{dia}", 'D')
+
+
+def _resumir(rotulos: np.ndarray, dias: np.ndarray, valores: np.ndarray, quantidades: np.ndarray,
+             status: List) -> pd.DataFrame:
+    """
+    Soma 'quantidades' por (rótulo, ano, mês) e valor de status: índice
+    (rotulo, ano, mes), uma coluna por status (status[1:]).
+    """
+    meses = dias.astype('datetime64[M]').astype(np.int64)  # meses desde 01/1970
+    celulas = pd.DataFrame({'rotulo': rotulos, 'ano': meses // 12 + 1970, 'mes': meses % 12 + 1,
+                            'status': valores, 'quantidade': quantidades})
+    indice = ['rotulo', 'ano', 'mes']
+    if celulas.empty:
+        return pd.DataFrame(columns=status[1:], index=pd.MultiIndex.from_arrays([[], [], []], names=indice),
+                            dtype=np.int64)
+    resumo = celulas.groupby(indice + ['status'])['quantidade'].sum().unstack('status', fill_value=0)
+    return resumo.reindex(columns=status[1:], fill_value=0).rename_axis(columns=None)
+
+
+def _vazio(valor) -> bool:
+    return valor is None or valor is pd.NA or valor == "" or (isinstance(valor, float) and np.isnan(valor))
+
+
+class MatrizFrequencia:
+    """
+    Códigos de status em uma matriz densa (uma linha por linha da aba, uma
+    coluna por data na ordem da aba; 0 = célula vazia), com índices
+    nome -> posições das linhas, ID do aluno -> posições das linhas e
+    data -> posição da coluna.
+    """
+
+    def __init__(self, codigos: np.ndarray, posicoes_do_nome: Dict[str, np.ndarray],
+                 posicoes_do_id: Dict[int, np.ndarray], coluna_da_data: Dict[str, int]):
+        self.codigos = codigos
+        self.posicoes_do_nome = posicoes_do_nome
+        self.posicoes_do_id = posicoes_do_id
+        self.coluna_da_data = coluna_da_data
+
+    @staticmethod
+    def _posicoes(indice: Dict, chaves: Iterable) -> np.ndarray:
+        encontradas = [indice[chave] for chave in set(chaves) if chave in indice]
+        if not encontradas:
+            return np.array([], dtype=np.int64)
+        return np.sort(np.concatenate(encontradas))
+
+    def posicoes(self, nomes: Iterable[str]) -> np.ndarray:
+        """Posições (em ordem crescente) das linhas dos alunos informados."""
+        return self._posicoes(self.posicoes_do_nome, nomes)
+
+    def posicoes_ids(self, ids: Iterable[int]) -> np.ndarray:
+        """Posições (em ordem crescente) das linhas dos IDs informados."""
+        return self._posicoes(self.posicoes_do_id, (int(i) for i in ids))
+
+    def colunas(self, datas: Sequence[str]) -> np.ndarray:
+        """Posição da coluna de cada data (-1 para datas sem coluna)."""
+        return np.array([self.coluna_da_data.get(data, -1) for data in datas], dtype=np.int64)
+
+    def grade(self, posicoes: np.ndarray, datas: Sequence[str]) -> np.ndarray:
+        """Códigos das linhas em 'posicoes' nas datas pedidas; datas sem coluna ficam vazias (0)."""
+        colunas = self.colunas(datas)
+        if not self.codigos.shape[1]:
+            return np.zeros((len(posicoes), len(colunas)), dtype=self.codigos.dtype)
+        grade = self.codigos[np.ix_(posicoes, np.maximum(colunas, 0))]
+        grade[:, colunas < 0] = 0
+        return grade
+
+
+class TabelaFrequencia:
+    """
+    Presenças da aba Registros.
+
+    - linhas: colunas de identificação (Nome, Turma...), com os rótulos da aba como índice;
+    - rotulos / dias / codigos: uma posição por célula preenchida, ordenadas por (dia, rótulo);
+    - colunas: ordem das colunas da aba larga (identificação e datas, inclusive datas sem nenhuma célula);
+    - status: valor original de cada código.
+    """
+
+    def __init__(self, linhas: pd.DataFrame, rotulos: np.ndarray, dias: np.ndarray, codigos: np.ndarray,
+                 colunas: List[str], status: List):
+        self.linhas = linhas
+        self.rotulos = rotulos
+        self.dias = dias
+        self.codigos = codigos
+        self.colunas = colunas
+        self.status = status
+        self._codigo_de = {valor: codigo for codigo, valor in enumerate(status)}
+
+    # --- Construção ---
+    @classmethod
+    def de_largo(cls, df: pd.DataFrame) -> "TabelaFrequencia":
+        """Converte a aba Registros no formato largo (uma coluna por data)."""
+        colunas = list(df.columns)
+        datas = [c for c in colunas if eh_coluna_data(c)]
+        linhas = df[[c for c in colunas if c not in datas]].copy()
+        status = list(STATUS_PADRAO)
+        if not datas or df.empty:
+            vazio = np.array([], dtype=np.int64)
+            return cls(linhas, vazio, vazio.astype('datetime64[D]'), vazio.astype(np.int8), colunas, status)
+
+        valores = df[datas].to_numpy(dtype=object)
+        preenchidas = ~pd.isna(valores) & (valores != "")
+        linha_pos, coluna_pos = np.nonzero(preenchidas)
+        codigo_de = {valor: codigo for codigo, valor in enumerate(status)}
+        codigos = []
+        for valor in valores[linha_pos, coluna_pos]:
+            if valor not in codigo_de:
+                codigo_de[valor] = len(status)
+                status.append(valor)
+            codigos.append(codigo_de[valor])
+        rotulos = np.asarray(df.index, dtype=np.int64)[linha_pos]
+        dias = np.array([dia_da_coluna(d) for d in datas], dtype='datetime64[D]')[coluna_pos]
+        return cls(linhas, *cls._ordenar(rotulos, dias, np.array(codigos, dtype=cls._tipo_codigo(status))),
+                   colunas, status)
+
+    @staticmethod
+    def _tipo_codigo(status: List) -> type:
+        return np.int8 if len(status) <= np.iinfo(np.int8).max else np.int16
+
+    @staticmethod
+    def _ordenar(rotulos: np.ndarray, dias: np.ndarray, codigos: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        ordem = np.lexsort((rotulos, dias))
+        return rotulos[ordem], dias[ordem], codigos[ordem]
+
+    def _substituir(self, **campos) -> "TabelaFrequencia":
+        atual = dict(linhas=self.linhas, rotulos=self.rotulos, dias=self.dias, codigos=self.codigos,
+                     colunas=self.colunas, status=self.status)
+        atual.update(campos)
+        return TabelaFrequencia(**atual)
+
+    # --- Consultas ---
+    @property
+    def vazia(self) -> bool:
+        """Mesma noção de vazio do DataFrame largo (sem linhas ou sem colunas)."""
+        return self.linhas.empty or not self.colunas
+
+    @property
+    def datas(self) -> List[str]:
+        """Colunas de data na ordem da aba."""
+        return [c for c in self.colunas if eh_coluna_data(c)]
+
+    def anos(self) -> set:
+        return {int(data[6:]) for data in self.datas}
+
+    @functools.cached_property
+    def _datas_ordenadas(self) -> Tuple[np.ndarray, List[str]]:
+        """Dias das colunas de data em ordem crescente e a coluna de cada um (montado uma vez por geração)."""
+        datas = self.datas
+        dias = np.array([dia_da_coluna(data) for data in datas], dtype='datetime64[D]')
+        ordem = np.argsort(dias, kind='stable')
+        return dias[ordem], [datas[posicao] for posicao in ordem]
+
+    def datas_no_intervalo(self, inicio: date, fim: date) -> List[str]:
+        """Colunas de data entre inicio e fim, inclusive, em ordem cronológica (busca binária)."""
+        dias, datas = self._datas_ordenadas
+        primeira = np.searchsorted(dias, np.datetime64(inicio, 'D'), side='left')
+        depois_da_ultima = np.searchsorted(dias, np.datetime64(fim, 'D'), side='right')
+        return datas[primeira:depois_da_ultima]
+
+    def rotulos_de(self, nomes: Iterable[str], ids: Iterable[int] = ()) -> pd.Index:
+        """Rótulos das linhas dos alunos informados (por nome ou por ID)."""
+        mascara = self.linhas['Nome'].isin(set(nomes))
+        if COLUNA_ID in self.linhas:
+            mascara |= self.linhas[COLUNA_ID].isin(set(ids))
+        return self.linhas.index[mascara]
+
+    @functools.cached_property
+    def matriz(self) -> MatrizFrequencia:
+        """Matriz densa da geração, montada na primeira consulta que precisar dela."""
+        datas = self.datas
+        coluna_da_data = {data: coluna for coluna, data in enumerate(datas)}
+        codigos = np.zeros((len(self.linhas), len(datas)), dtype=self._tipo_codigo(self.status))
+        if len(self.rotulos):
+            coluna_do_dia = {dia_da_coluna(data): coluna for data, coluna in coluna_da_data.items()}
+            dias, inversos = np.unique(self.dias, return_inverse=True)
+            colunas = np.array([coluna_do_dia[dia] for dia in dias], dtype=np.int64)[inversos]
+            codigos[self.linhas.index.get_indexer(self.rotulos), colunas] = self.codigos
+        return MatrizFrequencia(codigos, self._agrupar_posicoes(self.linhas.get('Nome', ())),
+                                self._agrupar_posicoes(self.linhas.get(COLUNA_ID, ())), coluna_da_data)
+
+    @functools.cached_property
+    def resumo_mensal(self) -> pd.DataFrame:
+        """
+        Quantidade de células de cada status por linha e mês: índice
+        (rotulo, ano, mes), uma coluna por status. Só meses com alguma célula aparecem.
+        """
+        valores = np.array(self.status, dtype=object)[self.codigos]
+        return _resumir(self.rotulos, self.dias, valores, np.ones(len(self.rotulos), dtype=np.int64), self.status)
+
+    def _localizar(self, rotulos: np.ndarray, dias: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Posição de cada célula (rótulo, dia) na ordem (dia, rótulo) das células
+        preenchidas e se ela já está preenchida, por busca binária.
+        """
+        inicios = np.searchsorted(self.dias, dias, side='left')
+        fins = np.searchsorted(self.dias, dias, side='right')
+        posicoes = np.empty(len(rotulos), dtype=np.int64)
+        for i, (rotulo, inicio, fim) in enumerate(zip(rotulos, inicios, fins)):
+            posicoes[i] = inicio + np.searchsorted(self.rotulos[inicio:fim], rotulo)
+        preenchidas = posicoes < fins
+        preenchidas[preenchidas] = self.rotulos[posicoes[preenchidas]] == rotulos[preenchidas]
+        return posicoes, preenchidas
+
+    def _codigos_em(self, rotulos: np.ndarray, dias: np.ndarray) -> np.ndarray:
+        """Código atual das células (rótulo, dia) pedidas (0 se vazia)."""
+        posicoes, preenchidas = self._localizar(rotulos, dias)
+        codigos = np.zeros(len(rotulos), dtype=np.int64)
+        codigos[preenchidas] = self.codigos[posicoes[preenchidas]]
+        return codigos
+
+    def _resumo_com(self, rotulos: np.ndarray, dias: np.ndarray, anteriores: np.ndarray, codigos: np.ndarray,
+                    status: List) -> pd.DataFrame:
+        """resumo_mensal depois de trocar 'anteriores' por 'codigos' nas células (rótulo, dia), sem recontar as demais."""
+        alteradas = anteriores != codigos
+        rotulos, dias = rotulos[alteradas], dias[alteradas]
+        # Cada célula alterada soma 1 ao status novo e subtrai 1 do anterior (código 0 = vazio, ignorado)
+        codigos = np.concatenate([codigos[alteradas], anteriores[alteradas]])
+        quantidades = np.repeat(np.array([1, -1], dtype=np.int64), len(rotulos))
+        validos = codigos != 0
+        diferenca = _resumir(np.tile(rotulos, 2)[validos], np.tile(dias, 2)[validos],
+                             np.array(status, dtype=object)[codigos[validos]], quantidades[validos], status)
+        resumo = self.resumo_mensal
+        if list(resumo.columns) != status[1:]:
+            resumo = resumo.reindex(columns=status[1:], fill_value=0)
+        if diferenca.empty:
+            return resumo
+
+        # Só os meses (rótulo, ano, mês) afetados mudam: os já contados recebem a diferença,
+        # os que ficam zerados saem e os novos entram na posição ordenada
+        posicoes = resumo.index.get_indexer(diferenca.index)
+        existentes = posicoes >= 0
+        valores = resumo.to_numpy(dtype=np.int64, copy=True)
+        valores[posicoes[existentes]] += diferenca.to_numpy(dtype=np.int64)[existentes]
+        zeradas = posicoes[existentes][~valores[posicoes[existentes]].any(axis=1)]
+        indice = resumo.index
+        if len(zeradas):
+            valores, indice = np.delete(valores, zeradas, axis=0), indice.delete(zeradas)
+        # O mesmo índice é reaproveitado enquanto nenhum mês entra ou sai (get_indexer não o remonta)
+        resumo = pd.DataFrame(valores, index=indice, columns=resumo.columns)
+        novas = diferenca[~existentes]
+        novas = novas[novas.to_numpy().any(axis=1)]
+        if len(novas):
+            # (um resumo vazio tem níveis sem tipo: as linhas novas já vêm com os tipos certos)
+            resumo = pd.concat([resumo, novas.astype(np.int64)]) if len(resumo) else novas.astype(np.int64)
+            resumo = resumo.sort_index()
+        return resumo
+
+    def _matriz_com(self, nova: "TabelaFrequencia", rotulos: np.ndarray, dias: np.ndarray, codigos: np.ndarray,
+                    data_do_dia: Dict[np.datetime64, str]) -> MatrizFrequencia:
+        """
+        matriz da geração 'nova' a partir da desta: linhas e datas novas entram
+        no fim e só as células (rótulo, dia) gravadas são alteradas.
+        """
+        anterior = self.matriz
+        total_linhas, total_colunas = anterior.codigos.shape
+        datas = nova.datas
+        matriz = np.zeros((len(nova.linhas), len(datas)), dtype=self._tipo_codigo(nova.status))
+        matriz[:total_linhas, :total_colunas] = anterior.codigos
+
+        coluna_da_data = anterior.coluna_da_data
+        if len(datas) > total_colunas:
+            coluna_da_data = dict(coluna_da_data)
+            coluna_da_data.update((data, coluna) for coluna, data in enumerate(datas) if coluna >= total_colunas)
+        posicoes_do_nome, posicoes_do_id = anterior.posicoes_do_nome, anterior.posicoes_do_id
+        if len(nova.linhas) > total_linhas:
+            acrescentadas = nova.linhas.iloc[total_linhas:]
+            posicoes_do_nome = self._acrescentar_posicoes(posicoes_do_nome, acrescentadas.get('Nome', ()), total_linhas)
+            posicoes_do_id = self._acrescentar_posicoes(posicoes_do_id, acrescentadas.get(COLUNA_ID, ()), total_linhas)
+
+        if len(rotulos):
+            colunas = np.array([coluna_da_data[data_do_dia[dia]] for dia in dias], dtype=np.int64)
+            matriz[nova.linhas.index.get_indexer(rotulos), colunas] = codigos
+        return MatrizFrequencia(matriz, posicoes_do_nome, posicoes_do_id, coluna_da_data)
+
+    @classmethod
+    def _acrescentar_posicoes(cls, posicoes: Dict, valores: Iterable, primeira: int) -> Dict:
+        """Cópia de 'posicoes' (de _agrupar_posicoes) com as linhas novas, a partir da posição 'primeira'."""
+        novas = cls._agrupar_posicoes(valores)
+        if not novas:
+            return posicoes
+        posicoes = dict(posicoes)
+        for valor, acrescentadas in novas.items():
+            posicoes[valor] = np.concatenate([posicoes.get(valor, np.array([], dtype=np.int64)), acrescentadas + primeira])
+        return posicoes
+
+    @functools.cached_property
+    def _rotulos_por_chave(self) -> Dict[Tuple[str, object], List[int]]:
+        """
+        ('Nome', nome) e ('ID', id) -> rótulos das linhas. Montado uma vez; as
+        gerações criadas por com_entradas recebem o da anterior estendido com as linhas novas.
+        """
+        rotulos_por_chave: Dict[Tuple[str, object], List[int]] = {}
+        for rotulo, nome in self.linhas['Nome'].items():
+            rotulos_por_chave.setdefault(('Nome', nome), []).append(rotulo)
+        if COLUNA_ID in self.linhas:
+            for rotulo, id_aluno in self.linhas[COLUNA_ID].items():
+                if not _vazio(id_aluno):
+                    rotulos_por_chave.setdefault((COLUNA_ID, int(id_aluno)), []).append(rotulo)
+        return rotulos_por_chave
+
+    @staticmethod
+    def _agrupar_posicoes(valores: Iterable) -> Dict:
+        """valor -> posições das linhas com esse valor (valores vazios são ignorados)."""
+        posicoes: Dict = {}
+        for posicao, valor in enumerate(valores):
+            if not _vazio(valor):
+                posicoes.setdefault(valor, []).append(posicao)
+        return {valor: np.array(p, dtype=np.int64) for valor, p in posicoes.items()}
+
+    def para_largo(self, rotulos=None, datas: Optional[Sequence[str]] = None, nomes: Optional[Iterable[str]] = None,
+                   identificacao: Optional[Sequence[str]] = None, ids: Optional[Iterable[int]] = None) -> pd.DataFrame:
+        """
+        Visão larga (uma coluna por data), no mesmo formato da aba Registros.
+        Pode ser restrita a linhas (rotulos, nomes ou IDs), a datas (datas
+        ausentes surgem como colunas vazias) e a colunas de identificação.
+        """
+        matriz = self.matriz
+        if ids is not None:
+            posicoes = matriz.posicoes_ids(ids)
+        elif nomes is not None:
+            posicoes = matriz.posicoes(nomes)
+        elif rotulos is not None:
+            posicoes = self.linhas.index.get_indexer(list(rotulos))
+        else:
+            posicoes = np.arange(len(self.linhas))
+        linhas = self.linhas.iloc[posicoes]
+        if identificacao is not None:
+            linhas = linhas[list(identificacao)]
+        datas = self.datas if datas is None else list(datas)
+
+        # Código 0 (vazio) vira NaN, como as células vazias lidas da planilha
+        valores = np.array([np.nan] + self.status[1:], dtype=object)
+        grade = valores[matriz.grade(posicoes, datas)]
+        largo = pd.concat([linhas, pd.DataFrame(grade, index=linhas.index, columns=datas)], axis=1)
+        if identificacao is None and set(datas) == set(self.datas):
+            largo = largo[[c for c in self.colunas if c in largo.columns]]
+        return largo
+
+    def contar(self, datas: Sequence[str], posicoes: Optional[np.ndarray] = None) -> pd.DataFrame:
+        """
+        Quantidade de células de cada status por linha nas datas informadas (uma
+        coluna por status). Com 'posicoes', conta só essas linhas da tabela.
+        """
+        if posicoes is None:
+            posicoes = np.arange(len(self.linhas))
+        total = len(self.status)
+        grade = self.matriz.grade(posicoes, datas).astype(np.int64)
+        deslocamento = (np.arange(len(posicoes)) * total)[:, None]
+        contagem = np.bincount((grade + deslocamento).ravel(),
+                               minlength=len(posicoes) * total).reshape(len(posicoes), total)
+        return pd.DataFrame(contagem[:, 1:], index=self.linhas.index[posicoes], columns=self.status[1:])
+
+    # --- Alterações (cada uma devolve uma nova tabela) ---
+    def com_entradas(self, entradas_recebidas: Iterable[Tuple[int, str, str, str]],
+                     id_do_nome: Optional[Dict[str, int]] = None) -> "TabelaFrequencia":
+        """
+        Aplica entradas do diário (sequência, nome, data, status). Com
+        'id_do_nome' (nome atual -> ID do aluno), as linhas são localizadas
+        pelo ID, e não pelo nome gravado na aba. Alunos sem linha ganham uma
+        (novo rótulo = maior + 1) e datas novas viram colunas no fim da aba;
+        status vazio apaga a célula. Entradas com data que não é dd/mm/aaaa válida
+        ou com status que não é texto são ignoradas (e registradas no log).
+        """
+        entradas, ignoradas = [], []
+        for entrada in entradas_recebidas:
+            _, _, data, valor = entrada
+            aplicavel = eh_data_valida(data) and (_vazio(valor) or isinstance(valor, str))
+            (entradas if aplicavel else ignoradas).append(entrada)
+        if ignoradas:
+            logger.warning("Entradas do diário ignoradas (data ou status inválido): %s", ignoradas)
+        id_do_nome = id_do_nome or {}
+        linhas, colunas, status = self.linhas, list(self.colunas), list(self.status)
+        codigo_de = dict(self._codigo_de)
+        rotulos_por_chave = self._rotulos_por_chave
+
+        def chave(nome: str) -> Tuple[str, object]:
+            return (COLUNA_ID, id_do_nome[nome]) if nome in id_do_nome else ('Nome', nome)
+
+        novos = [n for n in dict.fromkeys(e[1] for e in entradas) if chave(n) not in rotulos_por_chave]
+        if novos:
+            inicio = int(linhas.index.max()) + 1 if len(linhas.index) else 0
+            rotulos_novos = range(inicio, inicio + len(novos))
+            novas_linhas = pd.DataFrame({'Nome': novos}, index=rotulos_novos)
+            if COLUNA_ID in linhas:
+                novas_linhas[COLUNA_ID] = pd.array([id_do_nome.get(n) for n in novos], dtype='Int64')
+            linhas = pd.concat([linhas, novas_linhas])
+            # Cópia rasa: as listas da geração anterior não são alteradas
+            rotulos_por_chave = dict(rotulos_por_chave)
+            for rotulo, nome in zip(rotulos_novos, novos):
+                for chave_linha in dict.fromkeys([('Nome', nome), chave(nome)]):
+                    rotulos_por_chave[chave_linha] = rotulos_por_chave.get(chave_linha, []) + [rotulo]
+            if 'Nome' not in colunas:
+                colunas.insert(0, 'Nome')
+
+        # (dia, rótulo) -> código gravado; para cada célula vale a última entrada
+        gravadas: Dict[Tuple[np.datetime64, int], int] = {}
+        data_do_dia: Dict[np.datetime64, str] = {}
+        for _, nome, data, valor in entradas:
+            if data not in colunas:
+                colunas.append(data)
+            if _vazio(valor):
+                codigo = 0
+            else:
+                if valor not in codigo_de:
+                    codigo_de[valor] = len(status)
+                    status.append(valor)
+                codigo = codigo_de[valor]
+            dia = dia_da_coluna(data)
+            data_do_dia[dia] = data
+            for rotulo in rotulos_por_chave[chave(nome)]:
+                gravadas[(dia, rotulo)] = codigo
+
+        # As células gravadas são localizadas por busca binária na ordem (dia, rótulo) e só elas mudam:
+        # as já preenchidas são substituídas (ou apagadas) e as novas inseridas na posição ordenada
+        celulas = sorted(gravadas.items())
+        dias_gravados = np.array([dia for (dia, _), _ in celulas], dtype='datetime64[D]')
+        rotulos_gravados = np.array([rotulo for (_, rotulo), _ in celulas], dtype=np.int64)
+        codigos_gravados = np.array([codigo for _, codigo in celulas], dtype=np.int64)
+        posicoes, preenchidas = self._localizar(rotulos_gravados, dias_gravados)
+        anteriores = np.zeros(len(celulas), dtype=np.int64)
+        anteriores[preenchidas] = self.codigos[posicoes[preenchidas]]
+
+        tipo = self._tipo_codigo(status)
+        codigos = self.codigos.astype(tipo)
+        substituidas = preenchidas & (codigos_gravados != 0)
+        codigos[posicoes[substituidas]] = codigos_gravados[substituidas]
+        apagadas = posicoes[preenchidas & (codigos_gravados == 0)]
+        inseridas = ~preenchidas & (codigos_gravados != 0)
+        # Posição de inserção depois de remover as apagadas que vêm antes dela
+        destino = posicoes[inseridas] - np.searchsorted(apagadas, posicoes[inseridas], side='left')
+        rotulos = np.insert(np.delete(self.rotulos, apagadas), destino, rotulos_gravados[inseridas])
+        dias = np.insert(np.delete(self.dias, apagadas), destino, dias_gravados[inseridas])
+        codigos = np.insert(np.delete(codigos, apagadas), destino, codigos_gravados[inseridas].astype(tipo))
+
+        nova = self._substituir(linhas=linhas, rotulos=rotulos, dias=dias, codigos=codigos,
+                                colunas=colunas, status=status)
+        nova.__dict__['_rotulos_por_chave'] = rotulos_por_chave
+        if 'matriz' in self.__dict__:
+            nova.__dict__['matriz'] = self._matriz_com(nova, rotulos_gravados, dias_gravados, codigos_gravados,
+                                                       data_do_dia)
+        if 'resumo_mensal' in self.__dict__:
+            # O resumo já calculado segue para a nova geração acrescido só das células alteradas
+            nova.__dict__['resumo_mensal'] = self._resumo_com(rotulos_gravados, dias_gravados, anteriores,
+                                                              codigos_gravados, status)
+        return nova
@@ -0,0 +1,124 @@
+"""
+Índices em memória sobre as abas do cache.
+
+Cada índice é montado uma única vez para um DataFrame do cache; como toda
+alteração instala novos DataFrames (uma nova geração), um índice nunca
+precisa ser atualizado, apenas reconstruído para a geração seguinte.
+"""
+import bisect
+import copy
+from typing import Dict, Hashable, List, Optional, Tuple
+
+import pandas as pd
+
+from armazenamento import COLUNA_ID
+
+
+def ids_da_aba(df: pd.DataFrame) -> pd.Series:
+    """Coluna de IDs como inteiros anuláveis (vazia se a aba ainda não tiver IDs)."""
+    if COLUNA_ID not in df.columns:
+        return pd.Series(pd.NA, index=df.index, dtype='Int64')
+    return pd.to_numeric(df[COLUNA_ID], errors='coerce').astype('Int64')
+
+
+def proximo_id(*abas: Optional[pd.DataFrame]) -> int:
+    """Primeiro ID livre considerando os IDs já usados nas abas informadas."""
+    usados = [ids_da_aba(df).max() for df in abas if df is not None and not df.empty]
+    usados = [int(i) for i in usados if not pd.isna(i)]
+    return max(usados, default=0) + 1
+
+
+class IndiceAlunos:
+    """Rótulo da linha de cada aluno da aba Alunos, por ID e por nome."""
+
+    def __init__(self, df_alunos: pd.DataFrame):
+        ids = ids_da_aba(df_alunos)
+        self.por_id: Dict[int, Hashable] = {}
+        self.por_nome: Dict[str, Hashable] = {}
+        self.id_do_nome: Dict[str, int] = {}
+        self.nome_do_id: Dict[int, str] = {}
+        for rotulo, nome, id_aluno in zip(df_alunos.index, df_alunos['Nome'], ids):
+            self.por_nome.setdefault(nome, rotulo)
+            if not pd.isna(id_aluno):
+                self.por_id.setdefault(int(id_aluno), rotulo)
+                self.id_do_nome.setdefault(nome, int(id_aluno))
+                self.nome_do_id.setdefault(int(id_aluno), nome)
+
+    def __contains__(self, nome: str) -> bool:
+        return nome in self.por_nome
+
+
+# (Turma, horário 'HHhMM', Professor)
+ChaveTurma = Tuple[str, str, str]
+
+
+class IndiceTurmas:
+    """
+    Rótulos das linhas de cada turma na aba Turmas e de seus alunos na aba
+    Alunos, pela chave (Turma, horário formatado, Professor).
+    """
+
+    def __init__(self, df_turmas: pd.DataFrame, df_alunos: pd.DataFrame):
+        self.horarios_turmas = df_turmas['Horario_Formatado']
+        self.chaves_turmas: List[ChaveTurma] = list(zip(df_turmas['Turma'], self.horarios_turmas, df_turmas['Professor']))
+        self.turmas = self._agrupar(df_turmas.index, self.chaves_turmas)
+        chaves_alunos = zip(df_alunos['Turma'], df_alunos['Horario_Formatado'], df_alunos['Professor'])
+        self.alunos = self._agrupar(df_alunos.index, chaves_alunos)
+
+    @staticmethod
+    def _agrupar(rotulos, chaves) -> Dict[ChaveTurma, list]:
+        grupos: Dict[ChaveTurma, list] = {}
+        for rotulo, chave in zip(rotulos, chaves):
+            grupos.setdefault(chave, []).append(rotulo)
+        return grupos
+
+    def quantidade_alunos(self, chave: ChaveTurma) -> int:
+        return len(self.alunos.get(chave, ()))
+
+
+# (ano, mês)
+ChaveMes = Tuple[int, int]
+
+
+class IndiceJustificativas:
+    """
+    Justificativas de cada aluno por (ano, mês), já formatadas como o texto
+    exibido na chamada: uma linha "DD - Motivo" por justificativa, em ordem de data.
+    """
+
+    def __init__(self, df_justificativas: pd.DataFrame):
+        # (data, ordem de chegada, texto) de cada justificativa, em ordem
+        self._entradas: Dict[ChaveMes, Dict[str, list]] = {}
+        self.textos: Dict[ChaveMes, Dict[str, str]] = {}
+        self._sequencia = 0
+        self._acrescentar(df_justificativas)
+
+    def com_linhas(self, df_novas: pd.DataFrame) -> "IndiceJustificativas":
+        """Novo índice com as justificativas de 'df_novas' acrescentadas; este não é alterado."""
+        novo = copy.copy(self)
+        novo._entradas = dict(self._entradas)
+        novo.textos = dict(self.textos)
+        novo._acrescentar(df_novas)
+        return novo
+
+    def _acrescentar(self, df: pd.DataFrame) -> None:
+        if df.empty:
+            return
+        datas = pd.to_datetime(df['Data'], dayfirst=True, errors='coerce')
+        # Os dicionários e listas herdados de outro índice são copiados antes da primeira alteração
+        copiados = set()
+        for nome, data, motivo in zip(df['Nome'], datas, df['Motivo'].astype(str)):
+            if pd.isna(data):
+                continue
+            chave = (data.year, data.month)
+            if chave not in copiados:
+                self._entradas[chave] = dict(self._entradas.get(chave, {}))
+                self.textos[chave] = dict(self.textos.get(chave, {}))
+                copiados.add(chave)
+            if (chave, nome) not in copiados:
+                self._entradas[chave][nome] = list(self._entradas[chave].get(nome, ()))
+                copiados.add((chave, nome))
+            entradas = self._entradas[chave][nome]
+            bisect.insort(entradas, (data, self._sequencia, f"{data.day:02d} - {motivo}"))
+            self._sequencia += 1
+            self.textos[chave][nome] = '\n'.join(texto for _, _, texto in entradas)
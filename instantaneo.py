@@ -0,0 +1,163 @@
+"""
+Instantâneo binário das abas já interpretadas da planilha.
+
+Interpretar o .xlsx com o openpyxl leva segundos e é o maior custo do
+serviço. Depois de cada leitura, os DataFrames são gravados em um
+arquivo auxiliar (pickle) junto com a identificação da planilha de origem:
+tamanho, data de modificação e hash SHA-256 do conteúdo. Enquanto a planilha
+não mudar, uma nova inicialização ou recarga lê o instantâneo em milissegundos.
+
+Cada aba é serializada separadamente dentro do instantâneo, de modo que ler
+uma aba pequena não exige desserializar a aba Registros inteira.
+
+Quando o próprio serviço grava a planilha, o instantâneo é atualizado com as
+abas que acabaram de ser gravadas (atualizar): a gravação não obriga a
+próxima inicialização a interpretar o .xlsx de novo.
+"""
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+from typing import Callable, Dict, Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Incrementar quando o conteúdo gravado no instantâneo mudar de formato
+VERSAO_FORMATO = 2
+
+
+def hash_arquivo(caminho: str) -> str:
+    """SHA-256 do conteúdo do arquivo."""
+    sha = hashlib.sha256()
+    with open(caminho, 'rb') as arquivo:
+        for bloco in iter(lambda: arquivo.read(1 << 20), b''):
+            sha.update(bloco)
+    return sha.hexdigest()
+
+
+def como_lida(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    O DataFrame como pd.read_excel o devolveria depois de gravado na planilha:
+    células vazias ("" ou nulas) viram NaN, os tipos das colunas são inferidos
+    de novo e o índice volta a ser 0..n-1.
+    """
+    colunas = {}
+    for nome, coluna in df.items():
+        coluna = coluna.astype(object)
+        vazia = coluna.isna() | (coluna == "")
+        colunas[nome] = pd.Series(np.where(vazia, np.nan, coluna), dtype=object).infer_objects()
+    return pd.DataFrame(colunas, columns=df.columns)
+
+
+class InstantaneoPlanilha:
+    """Guarda em 'caminho' as abas interpretadas da planilha 'origem'."""
+
+    def __init__(self, origem: str, caminho: str):
+        self.origem = origem
+        self.caminho = caminho
+
+    def _identificacao(self) -> Dict[str, object]:
+        estado = os.stat(self.origem)
+        return {"tamanho": estado.st_size, "mtime": estado.st_mtime_ns}
+
+    def _ler(self) -> Optional[dict]:
+        try:
+            with open(self.caminho, 'rb') as arquivo:
+                conteudo = pickle.load(arquivo)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            logger.warning("Instantâneo '%s' ilegível; a planilha será lida novamente.", self.caminho)
+            return None
+        # Instantâneos de outro formato ou de outra versão do pandas são ignorados
+        if not isinstance(conteudo, dict) or conteudo.get("formato") != (VERSAO_FORMATO, pd.__version__):
+            return None
+        return conteudo
+
+    def _gravar(self, identificacao: Dict[str, object], abas: Dict[str, bytes], ausentes: set) -> None:
+        """Grava o instantâneo de forma atômica (temporário + os.replace)."""
+        conteudo = {"formato": (VERSAO_FORMATO, pd.__version__), **identificacao, "abas": abas, "ausentes": ausentes}
+        diretorio = os.path.dirname(os.path.abspath(self.caminho))
+        descritor, temporario = tempfile.mkstemp(suffix='.pkl.tmp', dir=diretorio)
+        try:
+            with os.fdopen(descritor, 'wb') as arquivo:
+                pickle.dump(conteudo, arquivo, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temporario, self.caminho)
+        except BaseException:
+            if os.path.exists(temporario):
+                os.remove(temporario)
+            raise
+
+    def carregar(self, ler_origem: Callable[[List[str]], Dict[str, pd.DataFrame]], abas: Iterable[str]) -> Dict[str, pd.DataFrame]:
+        """
+        Retorna as abas pedidas. As que o instantâneo já tiver para a planilha
+        atual vêm dele; as demais são lidas com 'ler_origem(faltando)' e
+        acrescentadas ao instantâneo. Abas inexistentes na planilha são omitidas.
+        """
+        abas = list(abas)
+        identificacao = self._identificacao()
+        conteudo = self._ler()
+        valido = conteudo is not None and all(conteudo.get(k) == v for k, v in identificacao.items())
+        if conteudo is not None and not valido:
+            # Data ou tamanho diferentes (ex.: arquivo copiado ou restaurado): confere o conteúdo
+            identificacao["sha256"] = hash_arquivo(self.origem)
+            valido = conteudo.get("sha256") == identificacao["sha256"]
+        if valido:
+            identificacao["sha256"] = conteudo["sha256"]
+            serializadas, ausentes = dict(conteudo["abas"]), set(conteudo["ausentes"])
+        else:
+            identificacao.setdefault("sha256", hash_arquivo(self.origem))
+            serializadas, ausentes = {}, set()
+
+        faltando = [aba for aba in abas if aba not in serializadas and aba not in ausentes]
+        lidas = ler_origem(faltando) if faltando else {}
+        resultado = {
+            aba: lidas[aba] if aba in lidas else pickle.loads(serializadas[aba])
+            for aba in abas if aba in lidas or aba in serializadas
+        }
+
+        if faltando or conteudo is None or any(conteudo.get(k) != v for k, v in identificacao.items()):
+            for aba in faltando:
+                if aba in lidas:
+                    serializadas[aba] = pickle.dumps(lidas[aba], protocol=pickle.HIGHEST_PROTOCOL)
+                else:
+                    ausentes.add(aba)
+            # A planilha pode ter mudado durante a leitura: nesse caso não grava um instantâneo inconsistente
+            if self._identificacao() == {k: identificacao[k] for k in ("tamanho", "mtime")}:
+                try:
+                    self._gravar(identificacao, serializadas, ausentes)
+                except OSError:
+                    logger.warning("Não foi possível gravar o instantâneo '%s'.", self.caminho, exc_info=True)
+        return resultado
+
+    def identificacao(self) -> Dict[str, object]:
+        """Identificação atual da planilha, a ser passada a atualizar() depois de gravá-la."""
+        return self._identificacao()
+
+    def atualizar(self, anterior: Dict[str, object], gravadas: Dict[str, pd.DataFrame]) -> None:
+        """
+        Chamado depois que o serviço gravou as abas 'gravadas' na planilha, que
+        antes tinha a identificação 'anterior'. O instantâneo passa a descrever a
+        planilha gravada: as abas gravadas entram como seriam lidas de volta e as
+        demais são mantidas se o instantâneo valia para a planilha anterior.
+        """
+        conteudo = self._ler()
+        if conteudo is not None and anterior and all(conteudo.get(k) == v for k, v in anterior.items()):
+            serializadas, ausentes = dict(conteudo["abas"]), set(conteudo["ausentes"])
+        else:
+            serializadas, ausentes = {}, set()
+        for aba, df in gravadas.items():
+            serializadas[aba] = pickle.dumps(como_lida(df), protocol=pickle.HIGHEST_PROTOCOL)
+            ausentes.discard(aba)
+        try:
+            identificacao = self._identificacao()
+            identificacao["sha256"] = hash_arquivo(self.origem)
+            # Outro programa modificou a planilha logo depois da gravação: o instantâneo fica para a próxima leitura
+            if self._identificacao() == {k: identificacao[k] for k in ("tamanho", "mtime")}:
+                self._gravar(identificacao, serializadas, ausentes)
+        except OSError:
+            logger.warning("Não foi possível atualizar o instantâneo '%s'.", self.caminho, exc_info=True)
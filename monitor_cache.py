@@ -0,0 +1,237 @@
+"""
+Carga e revalidação do cache em memória.
+
+Uma aba ainda não carregada é lida uma única vez mesmo que várias requisições
+concorrentes precisem dela (CargaUnica): a primeira lê e as demais aguardam
+o resultado.
+
+Quando uma aba do cache expira (tempo de validade ou arquivo modificado por
+outro programa), a requisição que percebe isso continua recebendo o retrato
+atual e apenas pede a recarga ao Revalidador, que a executa em sua própria
+thread (uma recarga por vez, agrupando os pedidos que chegarem nesse meio-tempo).
+
+O MonitorArquivo é opcional: em vez de consultar a data de modificação do
+arquivo a cada requisição, avisa quando ele muda. Usa o pacote 'watchdog' se
+estiver instalado; caso contrário, consulta a data periodicamente.
+"""
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:  # watchdog é opcional
+    FileSystemEventHandler = object
+    Observer = None
+
+logger = logging.getLogger(__name__)
+
+
+class _Voo:
+    """Uma leitura em andamento, aguardada por quem precisa das mesmas abas."""
+
+    def __init__(self):
+        self.concluido = threading.Event()
+        self.erro: Optional[BaseException] = None
+
+
+class CargaUnica:
+    """
+    Garante uma única leitura em andamento por aba. Quem pede abas já em
+    leitura aguarda o resultado em vez de ler de novo; as demais são lidas
+    juntas por quem pediu.
+    """
+
+    def __init__(self):
+        self._trava = threading.Lock()
+        self._em_voo: Dict[str, _Voo] = {}
+        # Contadores expostos em /api/cache/estatisticas
+        self.cargas = 0              # leituras executadas
+        self.abas_carregadas = 0     # abas lidas somando todas as leituras
+        self.esperas = 0             # pedidos que aguardaram a leitura de outra thread
+        self.tempo_carga = 0.0       # segundos gastos em leituras
+        self.tempo_espera = 0.0      # segundos gastos aguardando leituras de outras threads
+
+    def executar(self, chaves: Iterable[str], carregar: Callable[[List[str]], None]) -> None:
+        """Chama 'carregar(chaves_livres)' para as chaves sem leitura em andamento e aguarda as demais."""
+        with self._trava:
+            aguardar = {self._em_voo[c] for c in chaves if c in self._em_voo}
+            minhas = [c for c in chaves if c not in self._em_voo]
+            voo = _Voo()
+            for chave in minhas:
+                self._em_voo[chave] = voo
+
+        carregou = False
+        try:
+            # Primeiro aguarda as leituras já em andamento (que podem ser pré-requisito das minhas,
+            # como Categorias para Alunos). Elas foram registradas antes e nunca aguardam as minhas.
+            if aguardar:
+                inicio = time.monotonic()
+                for outro in aguardar:
+                    outro.concluido.wait()
+                with self._trava:
+                    self.esperas += 1
+                    self.tempo_espera += time.monotonic() - inicio
+                for outro in aguardar:
+                    if outro.erro is not None:
+                        raise outro.erro
+            if minhas:
+                inicio = time.monotonic()
+                carregou = True
+                carregar(minhas)
+        except BaseException as erro:
+            voo.erro = erro
+            raise
+        finally:
+            if minhas:
+                with self._trava:
+                    for chave in minhas:
+                        del self._em_voo[chave]
+                    if carregou:
+                        self.cargas += 1
+                        self.abas_carregadas += len(minhas)
+                        self.tempo_carga += time.monotonic() - inicio
+                voo.concluido.set()
+
+    def estatisticas(self) -> Dict[str, float]:
+        with self._trava:
+            return {
+                "cargas": self.cargas,
+                "abas_carregadas": self.abas_carregadas,
+                "esperas": self.esperas,
+                "tempo_carga_total": round(self.tempo_carga, 4),
+                "tempo_espera_total": round(self.tempo_espera, 4),
+                "em_andamento": sorted(self._em_voo),
+            }
+
+
+class Revalidador:
+    """Executa 'recarregar(abas)' em uma thread dedicada para as abas pedidas em solicitar()."""
+
+    def __init__(self, recarregar: Callable[[List[str]], None]):
+        self.recarregar = recarregar
+        self._condicao = threading.Condition()
+        self._pedidas: List[str] = []
+        self._recarregando = False
+        self._parar = False
+        self._thread: Optional[threading.Thread] = None
+        self.recargas = 0  # recargas executadas em segundo plano
+
+    def solicitar(self, abas: Iterable[str]) -> None:
+        """Pede a recarga das abas; retorna imediatamente."""
+        with self._condicao:
+            novas = [aba for aba in abas if aba not in self._pedidas]
+            if not novas:
+                return
+            self._pedidas.extend(novas)
+            if self._thread is None or not self._thread.is_alive():
+                self._parar = False
+                self._thread = threading.Thread(target=self._executar, name="revalidador-cache", daemon=True)
+                self._thread.start()
+            self._condicao.notify_all()
+
+    def ocioso(self) -> bool:
+        """Verdadeiro quando não há recarga pedida nem em andamento."""
+        with self._condicao:
+            return not self._pedidas and not self._recarregando
+
+    def parar(self, timeout: Optional[float] = None) -> None:
+        with self._condicao:
+            self._parar = True
+            self._condicao.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _executar(self) -> None:
+        while True:
+            with self._condicao:
+                while not self._pedidas and not self._parar:
+                    self._condicao.wait()
+                if self._parar:
+                    return
+                abas, self._pedidas = self._pedidas, []
+                self._recarregando = True
+            try:
+                self.recarregar(abas)
+            except Exception:
+                # O retrato atual continua sendo servido; a próxima requisição pedirá de novo
+                logger.exception("Falha ao recarregar as abas %s em segundo plano.", abas)
+            finally:
+                with self._condicao:
+                    self._recarregando = False
+                    self.recargas += 1
+                    self._condicao.notify_all()
+
+
+class _Eventos(FileSystemEventHandler):
+    """Repassa ao monitor os eventos do watchdog que envolvem o arquivo observado."""
+
+    def __init__(self, monitor: "MonitorArquivo"):
+        super().__init__()
+        self.monitor = monitor
+
+    def on_any_event(self, event):
+        caminhos = {getattr(event, 'src_path', ''), getattr(event, 'dest_path', '')}
+        if self.monitor.caminho in {os.path.abspath(c) for c in caminhos if c}:
+            self.monitor.verificar()
+
+
+class MonitorArquivo:
+    """
+    Chama 'ao_mudar(versao)' quando a data de modificação do arquivo muda.
+    Com o watchdog disponível usa notificações do sistema de arquivos; senão
+    consulta a data a cada 'intervalo' segundos.
+    """
+
+    def __init__(self, caminho: str, ao_mudar: Callable[[float], None], intervalo: float = 1.0):
+        self.caminho = os.path.abspath(caminho)
+        self.ao_mudar = ao_mudar
+        self.intervalo = intervalo
+        self.versao = self._versao_atual()
+        self._trava = threading.Lock()
+        self._parar = threading.Event()
+        self._observador = None
+        self._thread: Optional[threading.Thread] = None
+
+    def _versao_atual(self) -> float:
+        return os.path.getmtime(self.caminho) if os.path.exists(self.caminho) else 0
+
+    def verificar(self) -> None:
+        """Compara a data atual com a última vista e avisa se mudou."""
+        with self._trava:
+            versao = self._versao_atual()
+            if versao == self.versao:
+                return
+            self.versao = versao
+        self.ao_mudar(versao)
+
+    def iniciar(self) -> None:
+        if Observer is not None:
+            self._observador = Observer()
+            self._observador.schedule(_Eventos(self), os.path.dirname(self.caminho), recursive=False)
+            self._observador.daemon = True
+            self._observador.start()
+            return
+        self._parar.clear()
+        self._thread = threading.Thread(target=self._consultar, name="monitor-arquivo", daemon=True)
+        self._thread.start()
+
+    def parar(self) -> None:
+        if self._observador is not None:
+            self._observador.stop()
+            self._observador.join()
+            self._observador = None
+        if self._thread is not None:
+            self._parar.set()
+            self._thread.join()
+            self._thread = None
+
+    def _consultar(self) -> None:
+        while not self._parar.wait(self.intervalo):
+            try:
+                self.verificar()
+            except OSError:
+                logger.exception("Falha ao consultar a data de '%s'.", self.caminho)
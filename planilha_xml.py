@@ -0,0 +1,334 @@
+"""
+Escrita de baixo nível de arquivos .xlsx.
+
+Permite regravar apenas as partes XML das abas alteradas dentro do zip da
+planilha, copiando as demais partes (outras abas, estilos, tema...) sem
+reinterpretá-las. Assim uma justificativa nova não reescreve Alunos e
+Registros, e a formatação das abas não alteradas é preservada.
+
+Também gera pastas de trabalho novas em trechos (gerar_xlsx), compactando
+cada aba à medida que suas linhas são produzidas, para enviar arquivos
+grandes sem montá-los em memória.
+"""
+import math
+import os
+import posixpath
+import re
+import tempfile
+import zipfile
+from datetime import date, datetime
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape, quoteattr
+
+import pandas as pd
+
+NS_MAIN = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+NS_REL = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+NS_PKG_REL = "http://schemas.openxmlformats.org/package/2006/relationships"
+NS_TIPOS = "http://schemas.openxmlformats.org/package/2006/content-types"
+TIPO_OOXML = "application/vnd.openxmlformats-officedocument"
+
+# Formatos numéricos nativos do Excel que representam datas/horas
+FORMATOS_DATA_NATIVOS = set(range(14, 23)) | set(range(27, 37)) | set(range(45, 48)) | set(range(50, 59))
+
+EPOCA_EXCEL = datetime(1899, 12, 30)
+
+# Caracteres de controle não permitidos em XML 1.0
+_CARACTERES_INVALIDOS = re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+class EscritaParcialIndisponivel(Exception):
+    """A pasta de trabalho não permite a regravação parcial; use a escrita completa."""
+
+
+def letra_coluna(indice: int) -> str:
+    """1 -> A, 27 -> AA."""
+    letras = ""
+    while indice:
+        indice, resto = divmod(indice - 1, 26)
+        letras = chr(65 + resto) + letras
+    return letras
+
+
+def serial_excel(valor) -> float:
+    """Converte data/hora para o número de série usado pelo Excel."""
+    if isinstance(valor, pd.Timestamp):
+        valor = valor.tz_localize(None) if valor.tzinfo else valor
+        valor = valor.to_pydatetime()
+    elif isinstance(valor, datetime):
+        valor = valor.replace(tzinfo=None)
+    elif isinstance(valor, date):
+        valor = datetime(valor.year, valor.month, valor.day)
+    delta = valor - EPOCA_EXCEL
+    return delta.days + delta.seconds / 86400 + delta.microseconds / 86400e6
+
+
+def xml_celula(referencia: str, valor, estilo_data: Optional[int], estilo: Optional[int] = None) -> str:
+    """Gera o XML de uma célula; retorna '' para células vazias (que só existem se tiverem estilo)."""
+    atributo_estilo = f' s="{estilo}"' if estilo is not None else ""
+    if valor is None or valor is pd.NaT or valor is pd.NA:
+        return f'<c r="{referencia}"{atributo_estilo}/>' if estilo is not None else ""
+    if isinstance(valor, bool):
+        return f'<c r="{referencia}"{atributo_estilo} t="b"><v>{int(valor)}</v></c>'
+    if hasattr(valor, 'item') and not isinstance(valor, pd.Timestamp):  # escalares numpy
+        valor = valor.item()
+        if isinstance(valor, bool):
+            return f'<c r="{referencia}"{atributo_estilo} t="b"><v>{int(valor)}</v></c>'
+    if isinstance(valor, (int, float)):
+        if isinstance(valor, float) and math.isnan(valor):
+            return f'<c r="{referencia}"{atributo_estilo}/>' if estilo is not None else ""
+        if isinstance(valor, float) and math.isinf(valor):
+            valor = 'inf' if valor > 0 else '-inf'
+        else:
+            return f'<c r="{referencia}"{atributo_estilo} t="n"><v>{valor!r}</v></c>'
+    if isinstance(valor, (datetime, date, pd.Timestamp)):
+        if pd.isna(valor):
+            return ""
+        if estilo_data is None:
+            raise EscritaParcialIndisponivel("nenhum estilo de data disponível na pasta de trabalho")
+        return f'<c r="{referencia}" s="{estilo_data}" t="n"><v>{serial_excel(valor)!r}</v></c>'
+    if not isinstance(valor, str):
+        raise EscritaParcialIndisponivel(f"tipo de célula não suportado: {type(valor).__name__}")
+    texto = escape(_CARACTERES_INVALIDOS.sub("", valor))
+    espaco = ' xml:space="preserve"' if texto != texto.strip() else ""
+    return f'<c r="{referencia}"{atributo_estilo} t="inlineStr"><is><t{espaco}>{texto}</t></is></c>'
+
+
+def xml_linhas(df: pd.DataFrame, estilo_data: Optional[int], estilo_cabecalho: Optional[int] = None, linha_inicial: int = 1,
+               estilos: Optional[Dict[str, int]] = None, atributos_linhas: Optional[Dict[int, str]] = None):
+    """
+    Gera, linha a linha, o conteúdo de <sheetData> para o cabeçalho e os valores do DataFrame.
+    'estilos' (referência -> estilo) e 'atributos_linhas' (número -> atributos de <row>)
+    reaplicam a formatação de uma versão anterior da aba.
+    """
+    letras = [letra_coluna(i) for i in range(1, len(df.columns) + 1)]
+    estilos = estilos or {}
+    atributos_linhas = atributos_linhas or {}
+    celulas = ''.join(xml_celula(f"{l}{linha_inicial}", str(c), estilo_data, estilos.get(f"{l}{linha_inicial}", estilo_cabecalho))
+                      for l, c in zip(letras, df.columns))
+    yield f'<row r="{linha_inicial}"{atributos_linhas.get(linha_inicial, "")}>{celulas}</row>'
+    for numero, linha in enumerate(df.itertuples(index=False, name=None), start=linha_inicial + 1):
+        if estilos:
+            celulas = ''.join(xml_celula(f"{l}{numero}", v, estilo_data, estilos.get(f"{l}{numero}"))
+                              for l, v in zip(letras, linha))
+        else:
+            celulas = ''.join(xml_celula(f"{l}{numero}", v, estilo_data) for l, v in zip(letras, linha))
+        atributos = atributos_linhas.get(numero, "")
+        yield f'<row r="{numero}"{atributos}>{celulas}</row>' if celulas else f'<row r="{numero}"{atributos}/>'
+
+
+def trecho_xml(xml: str, tag: str) -> str:
+    """Extrai um elemento de primeiro nível (sem prefixo de namespace) do XML de uma aba."""
+    achado = re.search(rf'<{tag}\b[^>]*/>|<{tag}\b.*?</{tag}>', xml, re.S)
+    return achado.group(0) if achado else ""
+
+
+def _formatacao_dos_dados(xml: str) -> Tuple[Dict[str, int], Dict[int, str]]:
+    """
+    Estilos das células (referência -> índice em cellXfs) e atributos das linhas
+    (altura, estilo da linha...; sem 'r' e 'spans') do <sheetData> de uma aba.
+    """
+    estilos = {ref: int(s) for ref, s in re.findall(r'<c r="([A-Z]+\d+)"[^>]*?\ss="(\d+)"', xml)}
+    atributos_linhas = {}
+    for atributos in re.findall(r'<row\b([^>]*?)/?>', xml):
+        numero = re.search(r'\sr="(\d+)"', atributos)
+        restantes = re.sub(r'\s(?:r|spans)="[^"]*"', '', atributos).rstrip()
+        if numero and restantes:
+            atributos_linhas[int(numero.group(1))] = restantes
+    return estilos, atributos_linhas
+
+
+def gerar_xml_aba(df: pd.DataFrame, xml_antigo: str, estilo_data: Optional[int]) -> bytes:
+    """
+    Gera o XML completo de uma aba a partir do DataFrame, preservando da versão
+    anterior a raiz <worksheet> (namespaces), propriedades, visualização,
+    larguras de coluna, os estilos das células e das linhas e tudo o que vem
+    depois dos dados (mesclagens, validação de dados, formatação condicional,
+    margens, referências a desenhos, tabelas e comentários...).
+    """
+    raiz = re.search(r'<worksheet\b[^>]*>', xml_antigo)
+    preservados = apos_dados = ""
+    estilo_cabecalho = None
+    estilos, atributos_linhas = {}, {}
+    if raiz:
+        raiz = raiz.group(0)
+        preservados = ''.join(trecho_xml(xml_antigo, tag) for tag in ('sheetPr', 'sheetViews', 'sheetFormatPr', 'cols'))
+        dados = re.search(r'<sheetData\s*/>|<sheetData\b.*?</sheetData>', xml_antigo, re.S)
+        if dados:
+            estilos, atributos_linhas = _formatacao_dos_dados(dados.group(0))
+            fim = xml_antigo.rfind('</worksheet>')
+            apos_dados = xml_antigo[dados.end():fim if fim >= 0 else len(xml_antigo)]
+        estilo_cabecalho = estilos.get('A1')
+    else:
+        raiz = f'<worksheet xmlns="{NS_MAIN}" xmlns:r="{NS_REL}">'
+
+    ultima = f"{letra_coluna(max(len(df.columns), 1))}{len(df) + 1}"
+    sheet_pr = trecho_xml(preservados, 'sheetPr')
+    resto = preservados.replace(sheet_pr, "", 1) if sheet_pr else preservados
+    partes = [
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n',
+        raiz, sheet_pr, f'<dimension ref="A1:{ultima}"/>', resto, '<sheetData>',
+        *xml_linhas(df, estilo_data, estilo_cabecalho, estilos=estilos, atributos_linhas=atributos_linhas),
+        '</sheetData>', apos_dados, '</worksheet>',
+    ]
+    return ''.join(partes).encode('utf-8')
+
+
+def _estilo_data(styles_xml: bytes) -> Optional[int]:
+    """Índice (em cellXfs) do primeiro estilo com formato de data, se houver."""
+    raiz = ElementTree.fromstring(styles_xml)
+    personalizados = {
+        int(fmt.get('numFmtId')): fmt.get('formatCode', '')
+        for fmt in raiz.iter(f'{{{NS_MAIN}}}numFmt')
+    }
+    cell_xfs = raiz.find(f'{{{NS_MAIN}}}cellXfs')
+    if cell_xfs is None:
+        return None
+    for indice, xf in enumerate(cell_xfs.findall(f'{{{NS_MAIN}}}xf')):
+        num_fmt = int(xf.get('numFmtId', 0))
+        codigo = personalizados.get(num_fmt, '').lower()
+        if num_fmt in FORMATOS_DATA_NATIVOS or ('y' in codigo and 'd' in codigo):
+            return indice
+    return None
+
+
+def partes_das_abas(arquivo: zipfile.ZipFile) -> Dict[str, str]:
+    """Mapeia o nome de cada aba para o caminho da sua parte XML dentro do zip."""
+    workbook = ElementTree.fromstring(arquivo.read('xl/workbook.xml'))
+    relacoes = ElementTree.fromstring(arquivo.read('xl/_rels/workbook.xml.rels'))
+    alvos = {rel.get('Id'): rel.get('Target') for rel in relacoes.iter(f'{{{NS_PKG_REL}}}Relationship')}
+    partes = {}
+    for aba in workbook.iter(f'{{{NS_MAIN}}}sheet'):
+        alvo = alvos.get(aba.get(f'{{{NS_REL}}}id'), '')
+        caminho = alvo.lstrip('/') if alvo.startswith('/') else posixpath.normpath(posixpath.join('xl', alvo))
+        partes[aba.get('name')] = caminho
+    return partes
+
+
+def reescrever_abas(caminho: str, abas: Dict[str, pd.DataFrame]) -> None:
+    """
+    Regrava somente as partes XML das abas informadas e copia as demais partes
+    do zip sem alterá-las. O resultado é montado em um arquivo temporário e
+    substitui o original com os.replace().
+
+    Lança EscritaParcialIndisponivel quando a pasta de trabalho não comporta
+    a regravação parcial (aba nova, cadeia de cálculo, tipo não suportado...).
+    """
+    diretorio = os.path.dirname(os.path.abspath(caminho))
+    with zipfile.ZipFile(caminho) as origem:
+        nomes = set(origem.namelist())
+        if 'xl/calcChain.xml' in nomes:
+            raise EscritaParcialIndisponivel("a pasta de trabalho possui fórmulas (calcChain)")
+        partes = partes_das_abas(origem)
+        faltando = [aba for aba in abas if partes.get(aba) not in nomes]
+        if faltando:
+            raise EscritaParcialIndisponivel(f"abas inexistentes na pasta de trabalho: {faltando}")
+        estilo_data = _estilo_data(origem.read('xl/styles.xml')) if 'xl/styles.xml' in nomes else None
+
+        novas = {
+            partes[aba]: gerar_xml_aba(df, origem.read(partes[aba]).decode('utf-8'), estilo_data)
+            for aba, df in abas.items()
+        }
+
+        descritor, temporario = tempfile.mkstemp(suffix='.xlsx.tmp', dir=diretorio)
+        try:
+            with os.fdopen(descritor, 'wb') as saida:
+                with zipfile.ZipFile(saida, 'w', zipfile.ZIP_DEFLATED) as destino:
+                    for info in origem.infolist():
+                        conteudo = novas.get(info.filename)
+                        if conteudo is None:
+                            conteudo = origem.read(info)
+                        destino.writestr(info, conteudo, compress_type=info.compress_type)
+                # Garante o conteúdo em disco antes de trocar os arquivos
+                saida.flush()
+                os.fsync(saida.fileno())
+            os.replace(temporario, caminho)
+        except BaseException:
+            if os.path.exists(temporario):
+                os.remove(temporario)
+            raise
+
+
+class SaidaEmTrechos:
+    """Destino (não posicionável) do zip: guarda os bytes escritos até serem retirados."""
+
+    def __init__(self):
+        self._trechos = []
+        self.tamanho = 0
+
+    def write(self, dados) -> int:
+        self._trechos.append(bytes(dados))
+        self.tamanho += len(dados)
+        return len(dados)
+
+    def flush(self) -> None:
+        pass
+
+    def retirar(self) -> bytes:
+        dados = b''.join(self._trechos)
+        self._trechos, self.tamanho = [], 0
+        return dados
+
+
+def _xml_pacote(titulos: Iterable[str], com_tema: bool) -> Dict[str, str]:
+    """Partes fixas da pasta de trabalho (tipos, relações e workbook.xml) para as abas informadas."""
+    titulos = list(titulos)
+    cabecalho = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    abas = ''.join(f'<sheet name={quoteattr(titulo)} sheetId="{n}" r:id="rId{n}"/>'
+                   for n, titulo in enumerate(titulos, start=1))
+    relacoes = [(f'worksheets/sheet{n}.xml', 'worksheet') for n in range(1, len(titulos) + 1)]
+    relacoes.append(('styles.xml', 'styles'))
+    tipos = [f'<Override PartName="/xl/worksheets/sheet{n}.xml" ContentType="{TIPO_OOXML}.spreadsheetml.worksheet+xml"/>'
+             for n in range(1, len(titulos) + 1)]
+    tipos.append(f'<Override PartName="/xl/styles.xml" ContentType="{TIPO_OOXML}.spreadsheetml.styles+xml"/>')
+    if com_tema:
+        relacoes.append(('theme/theme1.xml', 'theme'))
+        tipos.append(f'<Override PartName="/xl/theme/theme1.xml" ContentType="{TIPO_OOXML}.theme+xml"/>')
+    return {
+        '[Content_Types].xml': (
+            f'{cabecalho}<Types xmlns="{NS_TIPOS}">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            f'<Override PartName="/xl/workbook.xml" ContentType="{TIPO_OOXML}.spreadsheetml.sheet.main+xml"/>'
+            f'{"".join(tipos)}</Types>'),
+        '_rels/.rels': (
+            f'{cabecalho}<Relationships xmlns="{NS_PKG_REL}">'
+            f'<Relationship Id="rId1" Type="{NS_REL}/officeDocument" Target="xl/workbook.xml"/></Relationships>'),
+        'xl/workbook.xml': (
+            f'{cabecalho}<workbook xmlns="{NS_MAIN}" xmlns:r="{NS_REL}">'
+            f'<bookViews><workbookView/></bookViews><sheets>{abas}</sheets></workbook>'),
+        'xl/_rels/workbook.xml.rels': (
+            f'{cabecalho}<Relationships xmlns="{NS_PKG_REL}">'
+            + ''.join(f'<Relationship Id="rId{n}" Type="{NS_REL}/{tipo}" Target="{alvo}"/>'
+                      for n, (alvo, tipo) in enumerate(relacoes, start=1))
+            + '</Relationships>'),
+    }
+
+
+def gerar_xlsx(abas: Iterable[Tuple[str, Iterable[str]]], styles_xml: bytes, tema_xml: Optional[bytes] = None,
+               tamanho_trecho: int = 1 << 16) -> Iterator[bytes]:
+    """
+    Gera uma pasta de trabalho .xlsx em trechos de bytes. Cada aba é um par
+    (título, pedaços do XML da aba) e é compactada à medida que seus pedaços
+    são produzidos; um trecho é entregue sempre que acumular 'tamanho_trecho'
+    bytes e ao fim de cada aba. A memória usada não depende do número de abas.
+    As partes que listam as abas (workbook.xml, tipos, relações) vão no fim do zip.
+    """
+    saida = SaidaEmTrechos()
+    titulos = []
+    with zipfile.ZipFile(saida, 'w', zipfile.ZIP_DEFLATED) as pacote:
+        for titulo, pedacos in abas:
+            titulos.append(titulo)
+            with pacote.open(f'xl/worksheets/sheet{len(titulos)}.xml', 'w') as parte:
+                for pedaco in pedacos:
+                    parte.write(pedaco.encode('utf-8'))
+                    if saida.tamanho >= tamanho_trecho:
+                        yield saida.retirar()
+            yield saida.retirar()
+        pacote.writestr('xl/styles.xml', styles_xml)
+        if tema_xml:
+            pacote.writestr('xl/theme/theme1.xml', tema_xml)
+        for nome, xml in _xml_pacote(titulos, bool(tema_xml)).items():
+            pacote.writestr(nome, xml.encode('utf-8'))
+    yield saida.retirar()
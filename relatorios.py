@@ -0,0 +1,322 @@
+"""
+Relatórios de chamada em Excel a partir do template 'relatorioChamada.xlsx'.
+
+O template é compilado uma única vez (e de novo quando a data de modificação
+do arquivo muda) em um ModeloRelatorio: as células fixas com o índice de
+estilo de cada uma, o styles.xml e o tema da pasta, larguras das colunas,
+mesclagens e configuração de página, além dos estilos derivados usados nas
+células preenchidas (datas centralizadas, cabeçalho 'Nível').
+
+Cada aba de relatório é gerada diretamente em XML a partir desse plano e o
+arquivo é enviado em trechos (planilha_xml.gerar_xlsx) à medida que as abas
+são geradas: a memória usada não cresce com o número de turmas pedidas.
+Os arquivos gerados podem ser guardados em um CacheRelatorios, que os serve
+de novo enquanto a chave (pedido e versão dos dados) não mudar.
+"""
+import io
+import os
+import threading
+import zipfile
+from collections import OrderedDict
+from copy import copy
+from datetime import datetime
+from typing import Dict, Hashable, Iterable, Iterator, List, Optional, Tuple
+
+import pandas as pd
+
+from planilha_xml import NS_MAIN, NS_REL, gerar_xlsx, letra_coluna, partes_das_abas, trecho_xml, xml_celula
+
+try:
+    from openpyxl import load_workbook
+    from openpyxl.styles import Alignment
+except ImportError:  # openpyxl só é necessário para compilar o template dos relatórios
+    load_workbook = None
+
+OPENPYXL_DISPONIVEL = load_workbook is not None
+
+# Posições fixas do template
+LINHA_DATAS = 6             # Cabeçalho das colunas de presença (dia do mês)
+COLUNA_PRIMEIRA_DATA = 5    # Coluna E
+LINHA_PRIMEIRO_ALUNO = 7
+COLUNA_NIVEL_TURMA = 13     # Coluna M no relatório de uma turma
+COLUNAS_DATAS_CONSOLIDADO = range(5, 35)  # Cabeçalhos limpos antes de preencher as datas no consolidado
+
+_ATRIBUTOS_ESTILO = ('font', 'fill', 'border', 'alignment', 'number_format', 'protection')
+
+# Variações de estilo aplicadas sobre o estilo da célula do template
+CENTRALIZADO = 'centralizado'
+CENTRALIZADO_VERTICAL = 'centralizado_vertical'
+
+# Configuração de página da aba do template, na ordem exigida pelo XML da aba
+_TAGS_APOS_DADOS = ('printOptions', 'pageMargins', 'pageSetup', 'headerFooter')
+
+
+class ModeloRelatorio:
+    """Plano de geração das abas de relatório, compilado uma única vez a partir do template."""
+
+    def __init__(self, caminho: str):
+        pasta = load_workbook(caminho)
+        aba = pasta.active
+        self.titulo = aba.title
+
+        # Estilo de cada célula do template e suas variações centralizadas. Os estilos derivados
+        # são registrados na própria pasta do template (em uma aba de rascunho) e o styles.xml
+        # gravado por ela já contém todos os índices usados pelos relatórios.
+        rascunho = pasta.create_sheet()
+        self._variacoes: Dict[Tuple[int, str], int] = {}
+        alinhamentos = {CENTRALIZADO: Alignment(horizontal='center'),
+                        CENTRALIZADO_VERTICAL: Alignment(horizontal='center', vertical='center')}
+        bases = {0: None}
+        # linha -> {coluna: (valor, estilo)}
+        self.celulas: Dict[int, Dict[int, Tuple[object, int]]] = {}
+        for linha in aba.iter_rows():
+            for celula in linha:
+                if celula.value is None and not celula.has_style:
+                    continue
+                self.celulas.setdefault(celula.row, {})[celula.column] = (celula.value, celula.style_id)
+                bases.setdefault(celula.style_id, celula)
+        for estilo, base in bases.items():
+            for nome, alinhamento in alinhamentos.items():
+                variacao = rascunho.cell(row=len(self._variacoes) + 1, column=1)
+                if base is not None:
+                    for atributo in _ATRIBUTOS_ESTILO:
+                        setattr(variacao, atributo, copy(getattr(base, atributo)))
+                variacao.alignment = alinhamento
+                self._variacoes[(estilo, nome)] = variacao.style_id
+        data = rascunho.cell(row=len(self._variacoes) + 1, column=1)
+        data.number_format = 'DD/MM/YYYY'
+        self.estilo_data = data.style_id
+
+        self.larguras: Dict[int, float] = {}
+        for dimensao in aba.column_dimensions.values():
+            if dimensao.width and dimensao.min:
+                for coluna in range(dimensao.min, dimensao.max + 1):
+                    self.larguras[coluna] = dimensao.width
+        # Alturas definidas no template (as linhas dos alunos além do template usam a altura padrão)
+        self.alturas: Dict[int, float] = {linha: dimensao.ht for linha, dimensao in aba.row_dimensions.items()
+                                          if dimensao.ht is not None}
+        self.mesclas = [(intervalo.coord, intervalo.max_col) for intervalo in aba.merged_cells.ranges]
+
+        # styles.xml, tema e configuração da aba como o openpyxl os grava
+        gravada = io.BytesIO()
+        pasta.save(gravada)
+        with zipfile.ZipFile(gravada) as pacote:
+            self.styles_xml = pacote.read('xl/styles.xml')
+            nomes = set(pacote.namelist())
+            self.tema_xml = pacote.read('xl/theme/theme1.xml') if 'xl/theme/theme1.xml' in nomes else None
+            xml_aba = pacote.read(partes_das_abas(pacote)[self.titulo]).decode('utf-8')
+        self.xml_antes_dos_dados = trecho_xml(xml_aba, 'sheetPr')
+        self.formato_aba = trecho_xml(xml_aba, 'sheetFormatPr')
+        self.xml_apos_dados = ''.join(trecho_xml(xml_aba, tag) for tag in _TAGS_APOS_DADOS)
+
+    def estilo(self, linha: int, coluna: int, variacao: Optional[str] = None) -> int:
+        """Índice do estilo da célula do template (0 se não houver), opcionalmente centralizado."""
+        _, estilo = self.celulas.get(linha, {}).get(coluna, (None, 0))
+        return self._variacoes[(estilo, variacao)] if variacao else estilo
+
+    def xml_aba(self, valores: Dict[int, Dict[int, Tuple[object, int]]], larguras: Dict[int, float],
+                ultima_coluna: Optional[int] = None) -> Iterator[str]:
+        """
+        XML da aba em pedaços: as células do template (cortadas após 'ultima_coluna')
+        sobrepostas por 'valores' (linha -> {coluna: (valor, estilo)}).
+        """
+        yield f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n<worksheet xmlns="{NS_MAIN}" xmlns:r="{NS_REL}">'
+        yield self.xml_antes_dos_dados + '<sheetViews><sheetView workbookViewId="0"/></sheetViews>' + self.formato_aba
+        if larguras:
+            yield '<cols>' + ''.join(f'<col min="{c}" max="{c}" width="{largura}" customWidth="1"/>'
+                                     for c, largura in sorted(larguras.items())) + '</cols>'
+        yield '<sheetData>'
+        for linha in sorted(set(self.celulas) | set(valores) | set(self.alturas)):
+            celulas = {coluna: celula for coluna, celula in self.celulas.get(linha, {}).items()
+                       if ultima_coluna is None or coluna <= ultima_coluna}
+            celulas.update(valores.get(linha, {}))
+            xml = ''.join(xml_celula(f"{letra_coluna(coluna)}{linha}", valor, self.estilo_data, estilo)
+                          for coluna, (valor, estilo) in sorted(celulas.items()))
+            atributos = f' ht="{self.alturas[linha]}" customHeight="1"' if linha in self.alturas else ''
+            yield f'<row r="{linha}"{atributos}>{xml}</row>' if xml else f'<row r="{linha}"{atributos}/>'
+        yield '</sheetData>'
+        mesclas = [coord for coord, coluna in self.mesclas if ultima_coluna is None or coluna <= ultima_coluna]
+        if mesclas:
+            yield f'<mergeCells count="{len(mesclas)}">' + ''.join(f'<mergeCell ref="{m}"/>' for m in mesclas) + '</mergeCells>'
+        yield self.xml_apos_dados + '</worksheet>'
+
+
+_trava_modelos = threading.Lock()
+_modelos: Dict[str, Tuple[float, ModeloRelatorio]] = {}
+
+
+def modelo_relatorio(caminho: str) -> ModeloRelatorio:
+    """Modelo compilado do template, recompilado quando o arquivo é modificado (OSError se não existir)."""
+    versao = os.path.getmtime(caminho)
+    with _trava_modelos:
+        atual = _modelos.get(caminho)
+        if atual is None or atual[0] != versao:
+            atual = (versao, ModeloRelatorio(caminho))
+            _modelos[caminho] = atual
+        return atual[1]
+
+
+def formatar_aniversario(aniversario) -> object:
+    """Data de nascimento como 'dd/mm/aaaa' (texto em outro formato é mantido)."""
+    if isinstance(aniversario, (datetime, pd.Timestamp)):
+        return aniversario.strftime('%d/%m/%Y')
+    if aniversario and isinstance(aniversario, str):
+        aniversario = aniversario.split('T')[0].split(' ')[0]
+        try:
+            return datetime.strptime(aniversario, '%Y-%m-%d').strftime('%d/%m/%Y')
+        except ValueError:
+            pass
+    return aniversario
+
+
+def _valores_aba(modelo: ModeloRelatorio, cabecalho: dict, datas: List[str], alunos: List[dict],
+                 coluna_nivel: int, consolidado: bool) -> Dict[int, Dict[int, Tuple[object, int]]]:
+    """Valores (e estilos) preenchidos sobre o template: cabeçalho, datas e uma linha por aluno."""
+    valores: Dict[int, Dict[int, Tuple[object, int]]] = {}
+
+    def preencher(linha: int, coluna: int, valor, variacao: Optional[str] = None) -> None:
+        # Texto vazio fica como célula vazia (só com o estilo), como o openpyxl gravava
+        valores.setdefault(linha, {})[coluna] = (None if valor == "" else valor, modelo.estilo(linha, coluna, variacao))
+
+    # B3: Professor, B4: Turma, B5: Horário, E5: Mês selecionado (Ex: 10/2025)
+    preencher(3, 2, cabecalho['professor'])
+    preencher(4, 2, cabecalho['turma'])
+    preencher(5, 2, cabecalho['horario'])
+    preencher(5, 5, f"{cabecalho['mes']:02d}/{cabecalho['ano']}")
+
+    if consolidado:
+        # Limpa os cabeçalhos do template na linha 6 antes de preencher as datas
+        for coluna in COLUNAS_DATAS_CONSOLIDADO:
+            if coluna <= coluna_nivel:
+                preencher(LINHA_DATAS, coluna, None)
+    # Cabeçalho das colunas de presença: só o dia ("dd") de cada data "dd/mm/aaaa"
+    for coluna, data in enumerate(datas, start=COLUNA_PRIMEIRA_DATA):
+        preencher(LINHA_DATAS, coluna, data.split('/')[0], CENTRALIZADO)
+    if consolidado:
+        preencher(LINHA_DATAS, coluna_nivel, "Nível", CENTRALIZADO_VERTICAL)
+
+    for linha, aluno in enumerate(alunos, start=LINHA_PRIMEIRO_ALUNO):
+        preencher(linha, 1, aluno.get('Nome', ''))
+        preencher(linha, 2, aluno.get('Whatsapp', ''))
+        preencher(linha, 3, aluno.get('ParQ', ''))
+        preencher(linha, 4, formatar_aniversario(aluno.get('Aniversario', '')))
+        # Registros de presença (c/f/j) nas colunas das datas
+        for coluna, data in enumerate(datas, start=COLUNA_PRIMEIRA_DATA):
+            preencher(linha, coluna, aluno.get(data, ""), CENTRALIZADO)
+        # No relatório de uma turma a coluna M pode coincidir com a última data: o estilo já aplicado é mantido
+        _, estilo = valores[linha].get(coluna_nivel, (None, modelo.estilo(linha, coluna_nivel)))
+        valores[linha][coluna_nivel] = (aluno.get('Nível') or None, estilo)
+    return valores
+
+
+def relatorio_turma(modelo: ModeloRelatorio, cabecalho: dict, datas: List[str], alunos: List[dict]) -> Iterator[bytes]:
+    """Relatório de uma turma (.xlsx em trechos): o template inteiro, com o nível dos alunos na coluna M."""
+    valores = _valores_aba(modelo, cabecalho, datas, alunos, COLUNA_NIVEL_TURMA, consolidado=False)
+    return gerar_xlsx([(modelo.titulo, modelo.xml_aba(valores, modelo.larguras))], modelo.styles_xml, modelo.tema_xml)
+
+
+def titulo_aba(turma: str, horario: str, existentes: Iterable[str]) -> str:
+    """Título válido e único para a aba da turma (sufixo _1, _2... se já existir)."""
+    # Limpa caracteres inválidos para nome de aba Excel
+    turma_segura = "".join([c for c in turma if c.isalnum() or c in (' ', '-', '_')])[:20]
+    original = f"{turma_segura} {horario.replace(':', 'h')}"[:30]
+    existentes = set(existentes)
+    titulo, contador = original, 1
+    while titulo in existentes:
+        titulo = f"{original}_{contador}"
+        contador += 1
+    return titulo
+
+
+def abas_consolidado(turmas: Iterable[Tuple[dict, List[str], List[dict]]]) -> Iterator[Tuple[str, dict, List[str], List[dict]]]:
+    """Título único de cada aba do relatório consolidado, na ordem das turmas, junto com os dados da turma."""
+    # "Template" continua reservado, como quando as abas eram copiadas da aba do template
+    existentes = {"Template"}
+    for cabecalho, datas, alunos in turmas:
+        titulo = titulo_aba(cabecalho['turma'], cabecalho['horario'], existentes)
+        existentes.add(titulo)
+        yield titulo, cabecalho, datas, alunos
+
+
+def aba_consolidado(modelo: ModeloRelatorio, cabecalho: dict, datas: List[str], alunos: List[dict]) -> Iterator[str]:
+    """
+    XML da aba de uma turma no relatório consolidado. A coluna Nível vem logo
+    após a última data; as colunas do template depois dela são omitidas.
+    """
+    coluna_nivel = COLUNA_PRIMEIRA_DATA + len(datas)
+    valores = _valores_aba(modelo, cabecalho, datas, alunos, coluna_nivel, consolidado=True)
+    # Largura da coluna Nível ajustada ao maior valor (+ margem visual)
+    maior_nivel = max([len(str(a.get('Nível'))) for a in alunos if a.get('Nível')] + [len("Nível")])
+    larguras = {**modelo.larguras, coluna_nivel: maior_nivel + 3}
+    return modelo.xml_aba(valores, larguras, ultima_coluna=coluna_nivel)
+
+
+def relatorio_consolidado(modelo: ModeloRelatorio,
+                          turmas: Iterable[Tuple[dict, List[str], List[dict]]]) -> Iterator[bytes]:
+    """
+    Relatório com uma aba por turma (.xlsx em trechos). Cada item de 'turmas'
+    traz o cabecalho (professor, turma, horario, mes, ano), as datas e os
+    alunos, e só é consumido quando sua aba vai ser gerada.
+    """
+    abas = ((titulo, aba_consolidado(modelo, cabecalho, datas, alunos))
+            for titulo, cabecalho, datas, alunos in abas_consolidado(turmas))
+    return gerar_xlsx(abas, modelo.styles_xml, modelo.tema_xml)
+
+
+class CacheRelatorios:
+    """
+    Arquivos de relatório já gerados, por chave. Os usados há mais tempo saem
+    primeiro quando o total guardado passa de 'limite_bytes'.
+    """
+
+    def __init__(self, limite_bytes: int):
+        self.limite_bytes = limite_bytes
+        self._trava = threading.Lock()
+        self._arquivos: "OrderedDict[Hashable, bytes]" = OrderedDict()
+        self.bytes = 0
+        self.acertos = 0
+        self.falhas = 0
+
+    def obter(self, chave: Hashable) -> Optional[bytes]:
+        """O arquivo guardado para a chave, ou None."""
+        with self._trava:
+            conteudo = self._arquivos.get(chave)
+            if conteudo is None:
+                self.falhas += 1
+                return None
+            self._arquivos.move_to_end(chave)
+            self.acertos += 1
+            return conteudo
+
+    def guardar(self, chave: Hashable, conteudo: bytes) -> None:
+        """Guarda o arquivo (um arquivo maior que o limite não é guardado)."""
+        if len(conteudo) > self.limite_bytes:
+            return
+        with self._trava:
+            anterior = self._arquivos.pop(chave, None)
+            if anterior is not None:
+                self.bytes -= len(anterior)
+            self._arquivos[chave] = conteudo
+            self.bytes += len(conteudo)
+            while self.bytes > self.limite_bytes:
+                _, descartado = self._arquivos.popitem(last=False)
+                self.bytes -= len(descartado)
+
+    def guardando(self, chave: Hashable, trechos: Iterable[bytes]) -> Iterator[bytes]:
+        """Repassa os trechos de um relatório em geração e guarda o arquivo se ele for gerado até o fim."""
+        gerados, tamanho = [], 0
+        for trecho in trechos:
+            # Passado o limite, o arquivo não seria guardado: os trechos deixam de ser acumulados
+            if gerados is not None:
+                tamanho += len(trecho)
+                if tamanho <= self.limite_bytes:
+                    gerados.append(trecho)
+                else:
+                    gerados = None
+            yield trecho
+        if gerados is not None:
+            self.guardar(chave, b''.join(gerados))
+
+    def estatisticas(self) -> Dict[str, int]:
+        with self._trava:
+            return {"arquivos": len(self._arquivos), "bytes": self.bytes, "acertos": self.acertos, "falhas": self.falhas}
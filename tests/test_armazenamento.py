@@ -0,0 +1,73 @@
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+# Ensure project root is on sys.path when run from tests/
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+import armazenamento
+from armazenamento import Alteracoes, MotorExcel, MotorSQLite, criar_motor, escrever_xlsx
+
+
+def _planilha(caminho):
+    """Planilha mínima com duas chamadas, uma delas sem nenhuma presença marcada."""
+    dados = {
+        'Alunos': pd.DataFrame({'Nome': ['Ana', 'Bruno'], 'Turma': ['Terça', 'Terça'], 'ID': [1, 2]}),
+        'Registros': pd.DataFrame({'Nome': ['Ana', 'Bruno'], 'ID': [1, 2],
+                                   '07/10/2025': ['c', 'f'], '09/10/2025': [None, None]}),
+    }
+    escrever_xlsx(dados, caminho)
+    return dados
+
+
+def test_sqlite_importa_a_planilha_na_primeira_execucao(tmp_path):
+    _planilha(tmp_path / 'p.xlsx')
+    motor = MotorSQLite(str(tmp_path / 'p.db'), planilha_inicial=str(tmp_path / 'p.xlsx'))
+    dados = motor.carregar()
+    assert list(dados['Alunos']['Nome']) == ['Ana', 'Bruno']
+    registros = dados['Registros']
+    # A data sem nenhuma presença continua sendo uma coluna da aba
+    assert [c for c in registros.columns if '/' in c] == ['07/10/2025', '09/10/2025']
+    assert list(registros['07/10/2025']) == ['c', 'f']
+    assert registros['09/10/2025'].isna().all()
+
+
+def test_sqlite_grava_so_as_linhas_alteradas(tmp_path):
+    _planilha(tmp_path / 'p.xlsx')
+    motor = MotorSQLite(str(tmp_path / 'p.db'), planilha_inicial=str(tmp_path / 'p.xlsx'))
+    registros = motor.carregar(['Registros'])['Registros']
+    registros.loc[0, '09/10/2025'] = 'j'
+    registros.loc[1, '07/10/2025'] = 'c'  # alterada em memória, mas não listada em Alteracoes
+    motor.salvar({'Registros': registros}, Alteracoes().gravar('Registros', [0]))
+
+    recarregada = MotorSQLite(str(tmp_path / 'p.db')).carregar(['Registros'])['Registros']
+    assert recarregada.loc[0, '09/10/2025'] == 'j'
+    assert recarregada.loc[1, '07/10/2025'] == 'f'
+
+
+def test_sqlite_remove_linhas(tmp_path):
+    _planilha(tmp_path / 'p.xlsx')
+    motor = MotorSQLite(str(tmp_path / 'p.db'), planilha_inicial=str(tmp_path / 'p.xlsx'))
+    alunos = motor.carregar(['Alunos'])['Alunos'].drop(index=[0])
+    motor.salvar({'Alunos': alunos}, Alteracoes().remover('Alunos', [0]))
+    assert list(motor.carregar(['Alunos'])['Alunos']['Nome']) == ['Bruno']
+
+
+def test_excel_atualiza_o_instantaneo_ao_gravar(tmp_path, monkeypatch):
+    _planilha(tmp_path / 'p.xlsx')
+    motor = MotorExcel(str(tmp_path / 'p.xlsx'), str(tmp_path / 'p.pkl'))
+    registros = motor.carregar()['Registros']
+    registros.loc[1, '07/10/2025'] = 'j'
+    motor.salvar({'Registros': registros}, Alteracoes().gravar('Registros', [1]))
+
+    # Uma nova inicialização obtém todas as abas do instantâneo, sem interpretar a planilha gravada
+    monkeypatch.setattr(armazenamento, 'ler_xlsx', lambda *args: pytest.fail("a planilha foi relida"))
+    dados = MotorExcel(str(tmp_path / 'p.xlsx'), str(tmp_path / 'p.pkl')).carregar()
+    for aba, lida in pd.read_excel(tmp_path / 'p.xlsx', sheet_name=None).items():
+        pd.testing.assert_frame_equal(dados[aba], lida)
+
+
+def test_motor_desconhecido():
+    with pytest.raises(ValueError):
+        criar_motor('csv', 'p.xlsx', 'p.db')
@@ -0,0 +1,381 @@
+import importlib
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+import warnings
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# Ensure project root is on sys.path when run from tests/
+RAIZ = os.path.dirname(os.path.dirname(__file__))
+sys.path.insert(0, RAIZ)
+from fastapi.testclient import TestClient
+
+ALUNA = 'Alice Lohane Silva'
+GRADE = dict(turma='Quarta e Sexta', horario='13h00', professor='Daniela', mes=1, ano=2026)
+
+
+@pytest.fixture
+def iniciar(tmp_path, monkeypatch):
+    """Importa um backend novo sobre uma cópia da planilha, opcionalmente com um diário de uma execução anterior."""
+    for arquivo in ('chamadaBelaVista.xlsx', 'relatorioChamada.xlsx'):
+        shutil.copy(os.path.join(RAIZ, arquivo), tmp_path)
+    monkeypatch.chdir(tmp_path)
+    # Os testes conferem a planilha gravada: ela precisa ser o banco de dados
+    monkeypatch.setenv('CHAMADA_MOTOR', 'excel')
+
+    def _iniciar(diario=()):
+        with open('chamadaBelaVista.diario.jsonl', 'w', encoding='utf-8') as arquivo:
+            arquivo.writelines(linha + '\n' for linha in diario)
+        sys.modules.pop('backend', None)
+        return importlib.import_module('backend')
+    return _iniciar
+
+
+def _situacao(cliente, nome, data):
+    alunos = cliente.get('/api/alunos', params=GRADE).json()['alunos']
+    return next(a[data] for a in alunos if a['Nome'] == nome)
+
+
+def test_diario_e_recuperado_apos_uma_queda(iniciar):
+    backend = iniciar([json.dumps([ALUNA, '07/01/2026', 'c']), '["Alice Lohane Si'])
+    with TestClient(backend.app) as cliente:
+        assert _situacao(cliente, ALUNA, '07/01/2026') == 'c'
+    # Ao encerrar, o diário foi incorporado à planilha
+    registros = pd.read_excel('chamadaBelaVista.xlsx', sheet_name='Registros')
+    assert registros.loc[registros['Nome'] == ALUNA, '07/01/2026'].tolist() == ['c']
+    assert os.path.getsize('chamadaBelaVista.diario.jsonl') == 0
+
+
+def test_chamada_registrada_e_lida_em_seguida(iniciar):
+    backend = iniciar()
+    with TestClient(backend.app) as cliente:
+        resposta = cliente.post('/api/chamada', json={'registros': {ALUNA: {'09/01/2026': 'f'}}})
+        assert resposta.status_code == 200
+        assert _situacao(cliente, ALUNA, '09/01/2026') == 'f'
+
+
+def test_chamada_com_data_ou_status_invalido_e_recusada(iniciar):
+    backend = iniciar()
+    with TestClient(backend.app) as cliente:
+        resposta = cliente.post('/api/chamada', json={'registros': {ALUNA: {
+            '2026-01-07': 'c', '31/02/2026': 'c', '09/01/2026': {'x': 1}, '14/01/2026': 'c'}}})
+        assert resposta.status_code == 400
+        for chave in ('2026-01-07', '31/02/2026', '09/01/2026'):
+            assert chave in resposta.json()['detail']
+        assert '14/01/2026' not in resposta.json()['detail']
+        # Nada do pedido recusado chegou ao diário
+        assert len(backend.diario) == 0
+        assert _situacao(cliente, ALUNA, '14/01/2026') == ''
+
+
+def test_entrada_invalida_no_diario_nao_impede_as_demais(iniciar):
+    backend = iniciar([json.dumps([ALUNA, '2026-01-07', 'c']), json.dumps([ALUNA, '09/01/2026', 'j'])])
+    with TestClient(backend.app) as cliente:
+        assert _situacao(cliente, ALUNA, '09/01/2026') == 'j'
+        assert backend.compactar_diario() == 1
+
+
+def test_presencas_acompanham_o_aluno_renomeado(iniciar):
+    backend = iniciar()
+    with TestClient(backend.app) as cliente:
+        cliente.post('/api/chamada', json={'registros': {ALUNA: {'07/01/2026': 'c'}}})
+        backend.compactar_diario()
+        # Uma chamada ainda no diário e outra já incorporada à aba Registros
+        cliente.post('/api/chamada', json={'registros': {ALUNA: {'09/01/2026': 'f'}}})
+        resposta = cliente.put(f'/api/aluno/{ALUNA}', json={
+            'Nome': 'Alice Silva', 'Aniversario': '2016-08-24', 'Turma': 'Quarta e Sexta',
+            'Horário': '13h00', 'Professor': 'Daniela', 'Nível': 'Iniciação A'})
+        assert resposta.status_code == 200
+        assert _situacao(cliente, 'Alice Silva', '07/01/2026') == 'c'
+        assert _situacao(cliente, 'Alice Silva', '09/01/2026') == 'f'
+        cliente.post('/api/sincronizar')
+    # Na planilha gravada as presenças continuam na linha do mesmo ID
+    alunos = pd.read_excel('chamadaBelaVista.xlsx', sheet_name='Alunos')
+    registros = pd.read_excel('chamadaBelaVista.xlsx', sheet_name='Registros')
+    id_aluna = alunos.loc[alunos['Nome'] == 'Alice Silva', 'ID'].item()
+    assert registros.loc[registros['ID'] == id_aluna, ['07/01/2026', '09/01/2026']].values.tolist() == [['c', 'f']]
+
+
+def test_leitura_nao_espera_um_escritor(iniciar):
+    backend = iniciar()
+    with TestClient(backend.app) as cliente:
+        cliente.get('/api/alunos', params=GRADE)
+        cliente.post('/api/chamada', json={'registros': {ALUNA: {'09/01/2026': 'j'}}})
+        # Um escritor segura a trava de escrita (ex.: gravando uma aba grande)
+        escrevendo, liberar = threading.Event(), threading.Event()
+
+        def escritor():
+            with backend._trava_escrita:
+                escrevendo.set()
+                liberar.wait(30)
+        thread = threading.Thread(target=escritor)
+        thread.start()
+        escrevendo.wait(10)
+        try:
+            situacoes = []
+            leitor = threading.Thread(target=lambda: situacoes.append(_situacao(cliente, ALUNA, '09/01/2026')))
+            leitor.start()
+            leitor.join(10)
+            # A leitura termina durante a escrita e já inclui a chamada registrada antes dela
+            assert not leitor.is_alive() and situacoes == ['j']
+        finally:
+            liberar.set()
+            thread.join()
+
+
+def test_horario_vazio_ou_nat_fica_em_branco(iniciar):
+    backend = iniciar()
+    horarios = pd.Series([pd.NaT, None, datetime(2026, 1, 7, 8, 45), 845, '0930', 'Manhã'], dtype=object)
+    assert backend.formatar_horarios(horarios).tolist() == ['', '', '08h45', '08h45', '09h30', 'Manhã']
+    assert backend.formatar_horario(pd.NaT) == ''
+    # Coluna lida como datetime64, com uma célula vazia (NaT)
+    assert backend.formatar_horarios(pd.Series([pd.Timestamp('2026-01-07 16:00'), pd.NaT])).tolist() == ['16h00', '']
+
+
+def _linha_do_resumo(cliente, chave, valor):
+    filtros = dict(ano=2026, mes=1, turma=GRADE['turma'], horario=GRADE['horario'], professor=GRADE['professor'])
+    resumo = cliente.get('/api/relatorio/resumo', params=filtros).json()
+    linhas = [linha for linha in resumo[chave] if valor in (linha.get('Nome'), linha['Turma'])]
+    return linhas[0] if linhas else {'Presenças (C)': 0, 'Faltas (F)': 0, 'Faltas Justificadas (J)': 0}
+
+
+def test_resumo_de_frequencia_acompanha_as_chamadas(iniciar):
+    backend = iniciar()
+    with TestClient(backend.app) as cliente:
+        cliente.post('/api/chamada', json={'registros': {ALUNA: {'07/01/2026': '', '09/01/2026': ''}}})
+        aluna, turma = _linha_do_resumo(cliente, 'alunos', ALUNA), _linha_do_resumo(cliente, 'turmas', GRADE['turma'])
+
+        cliente.post('/api/chamada', json={'registros': {ALUNA: {'07/01/2026': 'f', '09/01/2026': 'j'}}})
+        depois = _linha_do_resumo(cliente, 'alunos', ALUNA)
+        assert (depois['Faltas (F)'], depois['Faltas Justificadas (J)']) == (aluna['Faltas (F)'] + 1,
+                                                                             aluna['Faltas Justificadas (J)'] + 1)
+        cliente.post('/api/chamada', json={'registros': {ALUNA: {'07/01/2026': 'c'}}})
+        depois = _linha_do_resumo(cliente, 'alunos', ALUNA)
+        assert (depois['Presenças (C)'], depois['Faltas (F)']) == (aluna['Presenças (C)'] + 1, aluna['Faltas (F)'])
+        presencas, faltas = depois['Presenças (C)'], depois['Faltas (F)']
+        assert depois['Frequência (%)'] == round(presencas / ((presencas + faltas) or 1) * 100, 2)
+        assert _linha_do_resumo(cliente, 'turmas', GRADE['turma'])['Presenças (C)'] == turma['Presenças (C)'] + 1
+
+        # Os totais foram levados de geração em geração, e são os mesmos de uma contagem completa
+        tabela = backend.get_abas_cached('Registros')[0]
+        assert 'resumo_mensal' in tabela.__dict__
+        assert tabela.resumo_mensal.equals(type(tabela).resumo_mensal.func(tabela))
+
+
+def test_cache_de_relatorios_por_turma_e_mes(iniciar):
+    backend = iniciar()
+    with TestClient(backend.app) as cliente:
+        outra = next(a['Nome'] for a in cliente.get('/api/all-alunos').json()
+                     if (a['Turma'], a['Horario_Formatado'], a['Professor']) != (GRADE['turma'], GRADE['horario'], GRADE['professor']))
+
+        def gerar():
+            """Conteúdo do relatório da GRADE e se ele veio do cache."""
+            acertos = backend.cache_relatorios.acertos
+            resposta = cliente.get('/api/relatorio/excel', params=GRADE)
+            assert resposta.status_code == 200
+            return resposta.content, backend.cache_relatorios.acertos > acertos
+
+        conteudo, do_cache = gerar()
+        assert not do_cache
+        assert gerar() == (conteudo, True)
+        # Chamadas e justificativas de outra turma (ou de outro mês da mesma turma) não invalidam o relatório
+        cliente.post('/api/chamada', json={'registros': {outra: {'07/01/2026': 'f'}, ALUNA: {'04/02/2026': 'f'}}})
+        cliente.post('/api/justificativa', json={'Nome': outra, 'Data': '07/01/2026', 'Motivo': 'Consulta'})
+        assert gerar() == (conteudo, True)
+        # Uma chamada da própria turma no mês do relatório gera um arquivo novo
+        cliente.post('/api/chamada', json={'registros': {ALUNA: {'09/01/2026': 'j'}}})
+        alterado, do_cache = gerar()
+        assert not do_cache and alterado != conteudo
+        assert gerar() == (alterado, True)
+
+
+def test_importacao_nao_espera_indefinidamente_a_gravacao(iniciar, monkeypatch):
+    monkeypatch.setenv('CHAMADA_MOTOR', 'sqlite')
+    backend = iniciar()
+    with TestClient(backend.app) as cliente:
+        # A gravação pendente fica presa (ex.: banco travado por outro programa)
+        gravando, liberar = threading.Event(), threading.Event()
+        gravar = backend.fila_escrita.gravar
+
+        def gravar_preso(lote):
+            gravando.set()
+            liberar.wait(30)
+            gravar(lote)
+        monkeypatch.setattr(backend.fila_escrita, 'gravar', gravar_preso)
+        monkeypatch.setattr(backend, 'ESCRITA_TIMEOUT_IMPORTAR', 0.2)
+        try:
+            resposta = cliente.post('/api/justificativa', json={'Nome': ALUNA, 'Data': '07/01/2026', 'Motivo': 'Consulta'})
+            assert resposta.status_code == 200
+            assert gravando.wait(10)
+            resposta = cliente.post('/api/importar')
+            assert resposta.status_code == 503
+        finally:
+            liberar.set()
+        # Terminada a gravação, a importação volta a ser aceita
+        assert cliente.post('/api/sincronizar').status_code == 200
+        assert cliente.post('/api/importar').status_code == 200
+
+
+def test_linha_anexada_mantem_os_tipos_sem_avisos(iniciar):
+    backend = iniciar()
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', FutureWarning)
+        # Aba vazia (como lida do SQLite) e linha com uma coluna nova e valores nulos
+        vazia = pd.DataFrame(columns=['Nome', 'Data', 'Motivo'], index=pd.Index([], dtype=object))
+        vazia, rotulo = backend._anexar_linha(vazia,
+                                              {'Nome': ALUNA, 'Data': None, 'Motivo': 'Consulta', 'Extra': 1})
+        assert rotulo == 0 and list(vazia.columns) == ['Nome', 'Data', 'Motivo', 'Extra']
+        assert vazia.loc[0, ['Nome', 'Motivo', 'Extra']].tolist() == [ALUNA, 'Consulta', 1]
+        assert pd.isna(vazia.loc[0, 'Data'])
+
+        aba = pd.DataFrame({'Nome': ['Ana'], 'ID': [7], 'Aniversario': pd.to_datetime(['2016-08-24']),
+                            'Obs': [float('nan')]}, index=[4])
+        anexada, rotulo = backend._anexar_linha(aba, {'Nome': 'Bia', 'ID': 8, 'Aniversario': pd.Timestamp('2017-01-02'),
+                                                      'Obs': None})
+    assert rotulo == 5 and anexada.index.tolist() == [4, 5]
+    assert anexada.dtypes.to_dict() == {**aba.dtypes.to_dict(), 'Obs': object}
+    assert anexada.loc[5, 'ID'] == 8 and anexada.loc[5, 'Aniversario'] == pd.Timestamp('2017-01-02')
+    # A aba anterior (ainda lida por outras requisições) não é alterada
+    assert aba.index.tolist() == [4]
+
+
+def _frequencia(cliente, **filtros):
+    resposta = cliente.get('/api/relatorio/frequencia', params=filtros)
+    assert resposta.status_code == 200
+    return resposta.json()
+
+
+def test_relatorio_de_frequencia_por_periodo(iniciar):
+    backend = iniciar()
+    with TestClient(backend.app) as cliente:
+        cliente.post('/api/chamada', json={'registros': {ALUNA: {
+            '01/01/2026': 'f', '06/01/2026': 'c', '08/01/2026': 'f', '13/01/2026': 'j', '15/01/2026': 'f'}}})
+
+        # Os dois extremos do período entram na contagem
+        linhas = _frequencia(cliente, inicio='2026-01-06', fim='2026-01-13', turma=GRADE['turma'])
+        aluna = next(linha for linha in linhas if linha['Nome'] == ALUNA)
+        assert aluna == {'Nome': ALUNA, 'Total de Aulas no Período': 3, 'Presenças (C)': 1, 'Faltas (F)': 1,
+                         'Faltas Justificadas (J)': 1, 'Frequência (%)': 50.0}
+        # Só os alunos da turma
+        turma = {a['Nome'] for a in cliente.get('/api/all-alunos').json() if a['Turma'] == GRADE['turma']}
+        assert {linha['Nome'] for linha in linhas} <= turma
+        # Um único dia
+        aluna = next(linha for linha in _frequencia(cliente, inicio='2026-01-13', fim='2026-01-13') if linha['Nome'] == ALUNA)
+        assert (aluna['Total de Aulas no Período'], aluna['Faltas Justificadas (J)'], aluna['Frequência (%)']) == (1, 1, 0.0)
+
+        # Período sem chamadas, turma sem alunos e datas invertidas
+        assert 'error' in _frequencia(cliente, inicio='2030-01-01', fim='2030-01-31')
+        assert 'error' in _frequencia(cliente, inicio='2026-01-06', fim='2026-01-13', turma='Turma inexistente')
+        resposta = cliente.get('/api/relatorio/frequencia', params=dict(inicio='2026-01-13', fim='2026-01-06'))
+        assert resposta.status_code == 400
+        # Turma cujos alunos ainda não têm nenhuma linha em Registros
+        cliente.post('/api/aluno', json={'Nome': 'Aluno Novo', 'Aniversario': '2016-01-01', 'Turma': 'Turma Nova',
+                                         'Horário': '08h00', 'Professor': 'Daniela'})
+        assert _frequencia(cliente, inicio='2026-01-06', fim='2026-01-13', turma='Turma Nova') == []
+
+
+def test_aba_expirada_serve_o_retrato_atual_ate_a_recarga(iniciar, monkeypatch):
+    backend = iniciar()
+    with TestClient(backend.app):
+        atual, = backend.get_abas_cached('Justificativas')
+        # A próxima leitura do arquivo demora e traz uma justificativa gravada por outro programa
+        lendo, liberar = threading.Event(), threading.Event()
+        ler_abas = backend._ler_abas
+
+        def ler_devagar(abas):
+            lendo.set()
+            liberar.wait(30)
+            lidas = ler_abas(abas)
+            nova = pd.DataFrame([{'Nome': ALUNA, 'Data': '07/01/2026', 'Motivo': 'Externa'}])
+            return {**lidas, 'Justificativas': pd.concat([lidas['Justificativas'], nova], ignore_index=True)}
+        monkeypatch.setattr(backend, '_ler_abas', ler_devagar)
+        monkeypatch.setattr(backend, 'CACHE_EXPIRATION_SECONDS', 0)
+        recargas = backend._revalidador.recargas
+        try:
+            # A aba expirou: a requisição recebe na hora o retrato atual e só pede a recarga
+            assert backend.get_abas_cached('Justificativas')[0] is atual
+            assert lendo.wait(10)
+            assert backend.get_abas_cached('Justificativas')[0] is atual
+        finally:
+            liberar.set()
+        monkeypatch.setattr(backend, 'CACHE_EXPIRATION_SECONDS', 60)
+        limite = time.monotonic() + 10
+        while backend._revalidador.recargas == recargas and time.monotonic() < limite:
+            time.sleep(0.01)
+        # Terminada a recarga em segundo plano, o retrato novo substitui o anterior
+        recarregada, = backend.get_abas_cached('Justificativas')
+        assert recarregada is not atual and len(recarregada) == len(atual) + 1
+        assert recarregada['Motivo'].tolist()[-1] == 'Externa'
+
+
+def _idade_antiga(nascimento, hoje):
+    """Idade calculada linha a linha, como antes da versão vetorizada."""
+    if pd.isna(nascimento) or not isinstance(nascimento, (datetime, pd.Timestamp)):
+        return None
+    return hoje.year - nascimento.year - ((hoje.month, hoje.day) < (nascimento.month, nascimento.day))
+
+
+def _categoria_antiga(idade, df_categorias):
+    """Primeira regra que serve para a idade, percorrendo a tabela linha a linha."""
+    if pd.isna(idade) or idade is None:
+        return "Não definida"
+    for _, linha in df_categorias.iterrows():
+        if linha.get('Idade Mínima', 0) <= idade <= linha.get('Idade Máxima', float('inf')):
+            return linha.get('Categoria', 'Não definida')
+    return "Não definida"
+
+
+def test_idades_e_categorias_vetorizadas_iguais_ao_calculo_por_linha(iniciar):
+    backend = iniciar()
+    gerador = np.random.default_rng(3)
+    nascimentos = pd.Series(pd.to_datetime('1940-01-01') + pd.to_timedelta(gerador.integers(0, 31000, 400), unit='D'))
+    nascimentos[::37] = pd.NaT
+    # 29/02, véspera e dia do aniversário
+    hoje = date(2026, 2, 28)
+    nascimentos[1:4] = pd.to_datetime(['2016-02-29', '2016-02-28', '2016-03-01'])
+    idades = backend.calcular_idades(nascimentos, hoje)
+    esperadas = [_idade_antiga(n, hoje) for n in nascimentos]
+    assert [None if pd.isna(i) else int(i) for i in idades] == esperadas
+
+    tabelas = [
+        # Regras sobrepostas (vale a primeira), buracos entre as faixas e limites fracionários
+        pd.DataFrame({'Categoria': ['Infantil', 'Juvenil', 'Sobreposta', 'Adulto', 'Fração'],
+                      'Idade Mínima': [0, 7, 10, 18, 59.5], 'Idade Máxima': [6, 12, 20, 59, 60.5]}),
+        # Limites vazios (a regra nunca serve) e sem a coluna de idade máxima
+        pd.DataFrame({'Categoria': ['Sem mínimo', 'Maiores'], 'Idade Mínima': [np.nan, 30]}),
+        pd.DataFrame({'Categoria': ['Intervalo'], 'Idade Mínima': ['10'], 'Idade Máxima': [np.nan]}),
+        pd.DataFrame({'Idade Mínima': [0], 'Idade Máxima': [100]}),
+        pd.DataFrame(columns=['Categoria', 'Idade Mínima', 'Idade Máxima']),
+    ]
+    for df_categorias in tabelas:
+        regras = df_categorias.copy()
+        for coluna in ('Idade Mínima', 'Idade Máxima'):
+            if coluna in regras:
+                regras[coluna] = pd.to_numeric(regras[coluna], errors='coerce')
+        categorias = backend.definir_categorias_por_idade(idades, df_categorias)
+        assert categorias.tolist() == [_categoria_antiga(i, regras) for i in esperadas]
+
+
+def test_vazios_como_texto_igual_ao_fillna_anterior(iniciar):
+    backend = iniciar()
+    aba = pd.DataFrame({
+        'Nome': ['Ana', None, 'Caio'], 'Vazia': [np.nan] * 3, 'Nota': [7.5, np.nan, 9.0], 'Inteiro': [1, 2, 3],
+        'Numeros_texto': pd.Series([1, 2, 3], dtype=object), 'Misturada': pd.Series([1, 'dois', None], dtype=object),
+        'Logica': pd.Series([True, False, True], dtype=object),
+        'Nascimento': pd.to_datetime(['2016-08-24', None, '2017-01-02']),
+    })
+    for df in (aba, aba.iloc[:0], aba.dropna(subset=['Nome'])):
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', FutureWarning)
+            anterior = df.fillna("")
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', FutureWarning)
+            novo = backend._vazios_como_texto(df)
+        pd.testing.assert_frame_equal(novo, anterior)
@@ -0,0 +1,48 @@
+import calendar
+import os
+import sys
+from datetime import datetime
+
+import pytest
+
+# Ensure project root is on sys.path when run from tests/
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+from calendario import datas_de_aula, dias_da_turma
+
+TURMAS = ['Terça e Quinta', 'Quarta e Sexta', 'SEGUNDA, QUARTA E SEXTA', 'terca', 'Sábado', 'sabado e domingo',
+          'Hidroginástica', '']
+
+
+def _dias_antigos(turma):
+    """Dias da semana do nome da turma como a interface desktop calculava."""
+    dias_map = {
+        "segunda": 0, "terça": 1, "terca": 1,
+        "quarta": 2, "quinta": 3, "sexta": 4,
+        "sábado": 5, "sabado": 5, "domingo": 6
+    }
+    return {idx for nome, idx in dias_map.items() if nome in turma.lower()}
+
+
+def _datas_antigas(turma, ano, mes):
+    """Datas de aula do mês como a interface desktop calculava (sem dias reconhecidos: nenhuma)."""
+    dias_indices = _dias_antigos(turma)
+    _, num_dias = calendar.monthrange(ano, mes)
+    return [datetime(ano, mes, dia).strftime('%d/%m/%Y') for dia in range(1, num_dias + 1)
+            if datetime(ano, mes, dia).weekday() in dias_indices]
+
+
+@pytest.mark.parametrize('turma', TURMAS)
+def test_calendario_igual_ao_calculo_da_interface(turma):
+    assert set(dias_da_turma(turma)) == _dias_antigos(turma)
+    assert list(dias_da_turma(turma)) == sorted(dias_da_turma(turma))
+    for ano, mes in [(2026, 1), (2026, 2), (2024, 2), (2025, 12)]:
+        if dias_da_turma(turma):
+            assert list(datas_de_aula(turma, ano, mes)) == _datas_antigas(turma, ano, mes)
+        else:
+            # O backend mostra todos os dias do mês para uma turma sem dias no nome
+            assert len(datas_de_aula(turma, ano, mes)) == calendar.monthrange(ano, mes)[1]
+
+
+def test_mes_invalido():
+    with pytest.raises(ValueError):
+        datas_de_aula('Terça e Quinta', 2026, 13)
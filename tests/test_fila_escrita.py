@@ -0,0 +1,61 @@
+import os
+import sys
+import threading
+
+import pytest
+
+# Ensure project root is on sys.path when run from tests/
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+from armazenamento import Alteracoes
+from fila_escrita import FalhaPersistencia, FilaEscrita
+
+
+class Gravador:
+    """Registra os lotes recebidos; falha nas primeiras 'falhas' gravações."""
+
+    def __init__(self, falhas=0):
+        self.lotes = []
+        self.falhas = falhas
+
+    def __call__(self, alteracoes):
+        if self.falhas:
+            self.falhas -= 1
+            raise PermissionError("planilha aberta")
+        self.lotes.append((dict(alteracoes.gravadas), dict(alteracoes.removidas)))
+
+
+def test_alteracoes_agrupadas_sao_todas_gravadas():
+    gravador = Gravador()
+    fila = FilaEscrita(gravador, latencia_maxima=10)
+    tickets = [fila.enfileirar(Alteracoes().gravar('Alunos', [rotulo])) for rotulo in range(5)]
+    tickets.append(fila.enfileirar(Alteracoes().remover('Turmas', [7])))
+    fila.aguardar(tickets[-1], timeout=5)
+    fila.parar()
+    # Uma única gravação cobriu todas as alterações enfileiradas durante a latência
+    assert gravador.lotes == [({'Alunos': {0, 1, 2, 3, 4}}, {'Turmas': {7}})]
+    assert fila.pendentes == 0 and fila.ocioso()
+
+
+def test_gravacao_falha_e_e_repetida_com_o_lote_inteiro():
+    gravador = Gravador(falhas=1)
+    # Só aguardar() antecipa a gravação (e a retentativa): a falha acontece durante a espera
+    fila = FilaEscrita(gravador, latencia_maxima=10)
+    fila.intervalo_retentativa = 10
+    ticket = fila.enfileirar(Alteracoes().gravar('Alunos', [1]))
+    with pytest.raises(FalhaPersistencia):
+        fila.aguardar(ticket, timeout=5)
+    fila.enfileirar(Alteracoes().gravar('Alunos', [2]))
+    fila.aguardar(timeout=5)
+    fila.parar()
+    assert gravador.lotes == [({'Alunos': {1, 2}}, {})]
+
+
+def test_aguardar_respeita_o_prazo():
+    liberar = threading.Event()
+    fila = FilaEscrita(lambda alteracoes: liberar.wait(), latencia_maxima=0)
+    ticket = fila.enfileirar(Alteracoes().gravar('Alunos', [1]))
+    with pytest.raises(TimeoutError):
+        fila.aguardar(ticket, timeout=0.05)
+    liberar.set()
+    fila.aguardar(ticket, timeout=5)
+    fila.parar()
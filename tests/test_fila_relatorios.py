@@ -0,0 +1,88 @@
+import io
+import os
+import sys
+import threading
+import time
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from openpyxl import load_workbook
+
+# Ensure project root is on sys.path when run from tests/
+RAIZ = os.path.dirname(os.path.dirname(__file__))
+sys.path.insert(0, RAIZ)
+from fila_relatorios import CONCLUIDO, ERRO, GERANDO, PENDENTE, FilaRelatorios
+from relatorios import ModeloRelatorio
+
+MODELO = ModeloRelatorio(os.path.join(RAIZ, 'relatorioChamada.xlsx'))
+DATAS = ['07/01/2026', '09/01/2026']
+
+
+def _turma(horario):
+    cabecalho = dict(professor='Daniela', turma='Quarta e Sexta', horario=horario, mes=1, ano=2026)
+    return cabecalho, DATAS, [{'Nome': 'Ana', 'Nível': 'Iniciação A', '07/01/2026': 'c', '09/01/2026': 'f'}]
+
+
+def _aguardar(tarefa, timeout=60):
+    limite = time.monotonic() + timeout
+    while not tarefa.finalizada:
+        assert time.monotonic() < limite, "a tarefa não terminou"
+        time.sleep(0.02)
+
+
+def test_tarefa_passa_de_pendente_a_concluida():
+    liberar = threading.Event()
+
+    def coletar(turmas):
+        liberar.wait(10)
+        return (_turma(horario) for horario in turmas)
+
+    fila = FilaRelatorios(coletar, processos=0, limite_bytes=1 << 20, retencao=60)
+    primeira = fila.enfileirar(MODELO, ['13h00', '16h00'], 'a.xlsx')
+    segunda = fila.enfileirar(MODELO, ['08h00'], 'b.xlsx')
+    limite = time.monotonic() + 10
+    while primeira.estado == PENDENTE and time.monotonic() < limite:
+        time.sleep(0.01)
+    # A primeira aguarda os dados na thread da fila; a segunda espera a sua vez
+    assert (primeira.estado, segunda.estado) == (GERANDO, PENDENTE)
+    liberar.set()
+    _aguardar(segunda)
+    fila.parar()
+
+    assert primeira.situacao()['estado'] == CONCLUIDO and primeira.situacao()['progresso'] == 1.0
+    pasta = load_workbook(io.BytesIO(fila.obter(primeira.id).conteudo))
+    assert pasta.sheetnames == ['Quarta e Sexta 13h00', 'Quarta e Sexta 16h00']
+    assert pasta['Quarta e Sexta 16h00']['A7'].value == 'Ana'
+
+
+class PoolQuebrado(Executor):
+    """Pool cujos processos morreram: toda aba submetida falha com BrokenProcessPool."""
+
+    def __init__(self):
+        self.encerrado = False
+
+    def submit(self, *args, **kwargs):
+        futuro = Future()
+        futuro.set_exception(BrokenProcessPool("um processo do pool terminou abruptamente"))
+        return futuro
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        self.encerrado = (wait, cancel_futures) == (False, True)
+
+
+def test_pool_quebrado_e_recriado_no_relatorio_seguinte():
+    fila = FilaRelatorios(lambda turmas: (_turma(h) for h in turmas), processos=1, limite_bytes=1 << 20, retencao=60)
+    quebrado = fila._pool = PoolQuebrado()
+    falha = fila.enfileirar(MODELO, ['13h00'], 'a.xlsx')
+    _aguardar(falha)
+    # O pool quebrado é encerrado (sem esperar) antes de ser descartado
+    assert falha.estado == ERRO and fila._pool is None and quebrado.encerrado
+
+    tarefa = fila.enfileirar(MODELO, ['13h00', '16h00'], 'b.xlsx')
+    _aguardar(tarefa)
+    try:
+        assert tarefa.estado == CONCLUIDO, tarefa.erro
+        assert isinstance(fila._pool, ProcessPoolExecutor)
+        assert load_workbook(io.BytesIO(tarefa.conteudo)).sheetnames == ['Quarta e Sexta 13h00', 'Quarta e Sexta 16h00']
+    finally:
+        fila.parar()
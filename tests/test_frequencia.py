@@ -0,0 +1,100 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+# Ensure project root is on sys.path when run from tests/
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+from frequencia import TabelaFrequencia
+
+
+def _tabela():
+    return TabelaFrequencia.de_largo(pd.DataFrame({
+        'Nome': ['Ana', 'Bruno'], 'ID': [1, 2],
+        '07/10/2025': ['c', np.nan], '09/10/2025': ['f', 'j'],
+    }))
+
+
+def test_formato_longo_volta_ao_largo():
+    largo = _tabela().para_largo()
+    assert list(largo.columns) == ['Nome', 'ID', '07/10/2025', '09/10/2025']
+    assert largo['07/10/2025'].tolist()[0] == 'c' and pd.isna(largo['07/10/2025'].tolist()[1])
+    assert largo['09/10/2025'].tolist() == ['f', 'j']
+    contagem = _tabela().contar(['07/10/2025', '09/10/2025'])
+    assert contagem.loc[0].to_dict() == {'c': 1, 'f': 1, 'j': 0}
+
+
+def test_entradas_localizam_a_linha_pelo_id_apos_renomear():
+    # 'Ana' foi renomeada para 'Ana Maria'; a linha da aba ainda tem o nome antigo
+    tabela = _tabela().com_entradas([(1, 'Ana Maria', '14/10/2025', 'c')], {'Ana Maria': 1, 'Bruno': 2})
+    largo = tabela.para_largo()
+    assert len(largo) == 2
+    assert largo.loc[largo['ID'] == 1, '14/10/2025'].tolist() == ['c']
+
+
+def test_entrada_com_data_invalida_e_ignorada():
+    # Diário gravado antes da validação do POST /api/chamada: a entrada inválida não pode
+    # impedir que as demais sejam aplicadas (nem a compactação)
+    entradas = [(1, 'Ana', '2026-01-07', 'c'), (2, 'Bruno', '14/10/2025', 'c'),
+                (3, 'Ana', '31/02/2026', 'c'), (4, 'Ana', '16/10/2025', {'x': 1}), (5, 'Carla', '2026-01-09', 'f')]
+    tabela = _tabela().com_entradas(entradas)
+    largo = tabela.para_largo()
+    assert tabela.datas == ['07/10/2025', '09/10/2025', '14/10/2025']
+    assert largo['Nome'].tolist() == ['Ana', 'Bruno']
+    assert largo['14/10/2025'].tolist()[1] == 'c'
+
+
+def _celulas(tabela):
+    """Células preenchidas como {(rótulo, dia): status}."""
+    valores = np.array(tabela.status, dtype=object)[tabela.codigos]
+    return dict(zip(zip(tabela.rotulos.tolist(), tabela.dias.astype(str).tolist()), valores))
+
+
+def test_entrada_em_tabela_grande_so_altera_as_celulas_gravadas():
+    datas = [f'{dia:02d}/{mes:02d}/2025' for mes in range(1, 13) for dia in range(1, 29, 2)]
+    gerador = np.random.default_rng(0)
+    largo = pd.DataFrame(gerador.choice(np.array([np.nan, 'c', 'f', 'j'], dtype=object), size=(500, len(datas))),
+                         columns=datas)
+    largo.insert(0, 'ID', np.arange(1, 501))
+    largo.insert(0, 'Nome', [f'Aluno {i}' for i in range(500)])
+    largo.loc[3, '01/01/2025'] = 'c'
+    tabela = TabelaFrequencia.de_largo(largo)
+    antes = _celulas(tabela)
+
+    nova = tabela.com_entradas([(1, 'Aluno 3', '05/03/2025', 'f'), (2, 'Aluno 3', '01/01/2025', ''),
+                                (3, 'Aluno 499', '03/12/2025', 'x'), (4, 'Aluno 3', '05/03/2025', 'j')])
+    depois = _celulas(nova)
+    alteradas = {chave for chave in antes.keys() | depois.keys() if antes.get(chave) != depois.get(chave)}
+    assert alteradas <= {(3, '2025-03-05'), (3, '2025-01-01'), (499, '2025-12-03')}
+    assert (depois[(3, '2025-03-05')], depois[(499, '2025-12-03')]) == ('j', 'x')
+    assert (3, '2025-01-01') not in depois
+    # A geração anterior (ainda lida por outras requisições) continua igual
+    assert _celulas(tabela) == antes
+    # Mesmo resultado de montar a tabela do zero a partir da aba alterada
+    largo.loc[3, ['05/03/2025', '01/01/2025']] = ['j', np.nan]
+    largo.loc[499, '03/12/2025'] = 'x'
+    esperada = TabelaFrequencia.de_largo(largo)
+    assert depois == _celulas(esperada)
+    assert (nova.rotulos == esperada.rotulos).all() and (nova.dias == esperada.dias).all()
+
+
+def test_matriz_da_nova_geracao_segue_as_entradas():
+    tabela = _tabela()
+    matriz = tabela.matriz
+    entradas = [[(1, 'Ana', '09/10/2025', 'j')], [(2, 'Bruno', '07/10/2025', 'c'), (3, 'Ana', '07/10/2025', '')],
+                [(4, 'Carla', '14/10/2025', 'f')], [(5, 'Bruno', '16/10/2025', 'x'), (6, 'Carla', '09/10/2025', 'c')]]
+    for lote in entradas:
+        tabela = tabela.com_entradas(lote, {'Ana': 1, 'Bruno': 2, 'Carla': 3})
+    # A matriz foi levada de geração em geração, sem ser remontada
+    assert 'matriz' in tabela.__dict__ and matriz.codigos.shape == (2, 2)
+    remontada = TabelaFrequencia.de_largo(tabela.para_largo())
+    assert (tabela.matriz.codigos == remontada.matriz.codigos).all()
+    assert tabela.matriz.coluna_da_data == remontada.matriz.coluna_da_data
+    assert tabela.matriz.posicoes(['Carla']).tolist() == [2] and tabela.matriz.posicoes_ids([3]).tolist() == [2]
+
+    largo = tabela.para_largo()
+    assert list(largo.columns) == ['Nome', 'ID', '07/10/2025', '09/10/2025', '14/10/2025', '16/10/2025']
+    assert largo['Nome'].tolist() == ['Ana', 'Bruno', 'Carla']
+    assert largo.fillna('').values[:, 2:].tolist() == [['', 'j', '', ''], ['c', 'j', '', 'x'], ['', 'c', 'f', '']]
+    assert tabela.contar(tabela.datas).loc[1].to_dict() == {'c': 1, 'f': 0, 'j': 1, 'x': 1}
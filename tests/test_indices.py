@@ -0,0 +1,63 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+# Ensure project root is on sys.path when run from tests/
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+from indices import IndiceJustificativas, IndiceTurmas
+
+GRADES = [('Quarta e Sexta', '13h00', 'Daniela'), ('Quarta e Sexta', '16h00', 'Daniela'),
+          ('Terça e Quinta', '13h00', 'Daniela'), ('Terça e Quinta', '13h00', 'Marcos')]
+
+
+def _aba(quantidade, semente, **extras):
+    gerador = np.random.default_rng(semente)
+    escolhidas = [GRADES[i] for i in gerador.integers(len(GRADES), size=quantidade)]
+    turma, horario, professor = zip(*escolhidas)
+    # Rótulos fora de ordem e com buracos, como os de uma aba com linhas excluídas
+    rotulos = gerador.permutation(quantidade * 2)[:quantidade]
+    return pd.DataFrame({'Turma': turma, 'Horario_Formatado': horario, 'Professor': professor, **extras},
+                        index=rotulos)
+
+
+def _filtrar(df, chave):
+    """Rótulos da turma pela máscara sobre a aba inteira (como era feito a cada requisição)."""
+    turma, horario, professor = chave
+    mascara = (df['Turma'] == turma) & (df['Horario_Formatado'] == horario) & (df['Professor'] == professor)
+    return df.index[mascara].tolist()
+
+
+def test_indice_de_turmas_equivale_ao_filtro_das_abas():
+    df_turmas = _aba(8, 0, Nível=['Iniciação A'] * 8)
+    df_alunos = _aba(300, 1, Nome=[f'Aluno {i}' for i in range(300)])
+    indice = IndiceTurmas(df_turmas, df_alunos)
+
+    for chave in GRADES + [('Quarta e Sexta', '08h00', 'Daniela')]:
+        assert indice.turmas.get(chave, []) == _filtrar(df_turmas, chave)
+        assert indice.alunos.get(chave, []) == _filtrar(df_alunos, chave)
+        assert indice.quantidade_alunos(chave) == len(_filtrar(df_alunos, chave))
+    colunas = df_turmas[['Turma', 'Horario_Formatado', 'Professor']]
+    assert indice.chaves_turmas == list(colunas.itertuples(index=False, name=None))
+    assert sum(map(len, indice.alunos.values())) == len(df_alunos)
+
+
+def test_justificativas_acrescentadas_equivalem_a_montar_o_indice_de_novo():
+    gerador = np.random.default_rng(2)
+    datas = [f'{dia:02d}/{mes:02d}/2026' for dia, mes in zip(gerador.integers(1, 29, 60), gerador.integers(1, 4, 60))]
+    aba = pd.DataFrame({'Nome': gerador.choice(['Ana', 'Bia', 'Caio'], 60), 'Data': datas,
+                        'Motivo': [f'Motivo {i}' for i in range(60)]})
+    aba.loc[7, 'Data'] = 'sem data'
+
+    indice = IndiceJustificativas(aba.iloc[:20])
+    textos = {chave: dict(por_nome) for chave, por_nome in indice.textos.items()}
+    # Uma justificativa por vez (como no POST /api/justificativa) e depois um lote
+    acrescentado = indice
+    for rotulo in aba.index[20:40]:
+        acrescentado = acrescentado.com_linhas(aba.loc[[rotulo]])
+    acrescentado = acrescentado.com_linhas(aba.iloc[40:])
+
+    assert acrescentado.textos == IndiceJustificativas(aba).textos
+    # O índice da geração anterior não foi alterado
+    assert indice.textos == textos
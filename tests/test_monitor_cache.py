@@ -0,0 +1,91 @@
+import os
+import sys
+import threading
+
+# Ensure project root is on sys.path when run from tests/
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+import monitor_cache
+from monitor_cache import CargaUnica
+
+
+class _EventoContado(threading.Event):
+    """Event que avisa, por um semáforo, cada thread que passa a aguardá-lo."""
+    aguardando = None
+
+    def wait(self, timeout=None):
+        _EventoContado.aguardando.release()
+        return super().wait(timeout)
+
+
+class _VooContado(monitor_cache._Voo):
+    def __init__(self):
+        super().__init__()
+        self.concluido = _EventoContado()
+
+
+def test_leituras_concorrentes_da_mesma_aba_sao_feitas_uma_vez(monkeypatch):
+    monkeypatch.setattr(monitor_cache, '_Voo', _VooContado)
+    monkeypatch.setattr(_EventoContado, 'aguardando', threading.Semaphore(0))
+    carga = CargaUnica()
+    lendo, liberar = threading.Event(), threading.Event()
+    leituras = []
+
+    def carregar(abas):
+        leituras.append(list(abas))
+        if 'Registros' in abas:
+            lendo.set()
+            liberar.wait(10)
+
+    primeira = threading.Thread(target=carga.executar, args=(['Alunos', 'Registros'], carregar))
+    primeira.start()
+    assert lendo.wait(10)
+    assert carga.estatisticas()['em_andamento'] == ['Alunos', 'Registros']
+    # Quem pede abas já em leitura aguarda; só a aba que ninguém está lendo é lida de novo
+    outras = [threading.Thread(target=carga.executar, args=(abas, carregar))
+              for abas in (['Registros'], ['Registros'], ['Alunos', 'Turmas'])]
+    for thread in outras:
+        thread.start()
+    for _ in outras:
+        assert _EventoContado.aguardando.acquire(timeout=10)
+    liberar.set()
+    for thread in [primeira, *outras]:
+        thread.join(10)
+
+    assert sorted(leituras) == [['Alunos', 'Registros'], ['Turmas']]
+    estatisticas = carga.estatisticas()
+    assert (estatisticas['cargas'], estatisticas['abas_carregadas'], estatisticas['esperas']) == (2, 3, 3)
+    assert estatisticas['em_andamento'] == []
+
+
+def test_erro_da_leitura_chega_a_quem_a_aguardava(monkeypatch):
+    monkeypatch.setattr(monitor_cache, '_Voo', _VooContado)
+    monkeypatch.setattr(_EventoContado, 'aguardando', threading.Semaphore(0))
+    carga = CargaUnica()
+    lendo, liberar = threading.Event(), threading.Event()
+    erros = []
+
+    def carregar(abas):
+        lendo.set()
+        liberar.wait(10)
+        raise OSError("arquivo aberto em outro programa")
+
+    def aguardar():
+        try:
+            carga.executar(['Alunos'], carregar)
+        except OSError as erro:
+            erros.append(erro)
+
+    primeira = threading.Thread(target=aguardar)
+    primeira.start()
+    assert lendo.wait(10)
+    segunda = threading.Thread(target=aguardar)
+    segunda.start()
+    assert _EventoContado.aguardando.acquire(timeout=10)
+    liberar.set()
+    primeira.join(10)
+    segunda.join(10)
+    assert len(erros) == 2 and erros[0] is erros[1]
+    # A aba não fica presa como "em leitura": o pedido seguinte a lê de novo
+    lidas = []
+    carga.executar(['Alunos'], lidas.append)
+    assert lidas == [['Alunos']] and carga.estatisticas()['cargas'] == 2
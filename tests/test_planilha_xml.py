@@ -0,0 +1,84 @@
+import os
+import shutil
+import sys
+import zipfile
+from datetime import datetime
+
+import openpyxl
+import pandas as pd
+import pytest
+from openpyxl.styles import Font, PatternFill
+from openpyxl.worksheet.datavalidation import DataValidation
+
+# Ensure project root is on sys.path when run from tests/
+RAIZ = os.path.dirname(os.path.dirname(__file__))
+sys.path.insert(0, RAIZ)
+from planilha_xml import EscritaParcialIndisponivel, partes_das_abas, reescrever_abas
+
+
+@pytest.fixture
+def planilha(tmp_path):
+    caminho = str(tmp_path / 'chamadaBelaVista.xlsx')
+    shutil.copy(os.path.join(RAIZ, 'chamadaBelaVista.xlsx'), caminho)
+    return caminho
+
+
+def _partes(caminho):
+    with zipfile.ZipFile(caminho) as arquivo:
+        return {nome: arquivo.read(nome) for nome in arquivo.namelist()}, partes_das_abas(arquivo)
+
+
+def test_abas_regravadas_sao_lidas_de_volta(planilha):
+    abas = pd.read_excel(planilha, sheet_name=['Registros', 'Justificativas'])
+    registros = abas['Registros']
+    registros.loc[0, '01/01/2026'] = 'c'
+    registros['03/02/2026'] = ['j'] + [float('nan')] * (len(registros) - 1)
+    justificativas = pd.DataFrame({'Nome': ['Ana & <Bia>'], 'Data': [datetime(2026, 2, 3)],
+                                   'Motivo': ['Atestado "médico"']})
+    antes, partes = _partes(planilha)
+
+    reescrever_abas(planilha, {'Registros': registros, 'Justificativas': justificativas})
+
+    # A pasta de trabalho continua válida para o openpyxl
+    assert openpyxl.load_workbook(planilha).sheetnames == list(partes)
+    lidas = pd.read_excel(planilha, sheet_name=['Registros', 'Justificativas'])
+    pd.testing.assert_frame_equal(lidas['Registros'], registros, check_dtype=False)
+    pd.testing.assert_frame_equal(lidas['Justificativas'], justificativas, check_dtype=False)
+
+    # As demais partes do pacote são copiadas sem alteração
+    depois, _ = _partes(planilha)
+    regravadas = {partes['Registros'], partes['Justificativas']}
+    assert {n: c for n, c in antes.items() if n not in regravadas} == \
+           {n: c for n, c in depois.items() if n not in regravadas}
+
+
+def test_aba_inexistente_nao_permite_regravacao_parcial(planilha):
+    antes, _ = _partes(planilha)
+    with pytest.raises(EscritaParcialIndisponivel):
+        reescrever_abas(planilha, {'Nova': pd.DataFrame({'A': [1]})})
+    assert _partes(planilha)[0] == antes
+
+
+def test_formatacao_da_aba_regravada_e_mantida(planilha):
+    pasta = openpyxl.load_workbook(planilha)
+    aba = pasta['Justificativas']
+    aba.merge_cells('E1:F1')
+    validacao = DataValidation(type='list', formula1='"Atestado,Consulta"', sqref='C2:C50')
+    aba.add_data_validation(validacao)
+    aba['C2'].fill = PatternFill('solid', fgColor='FFFF00')
+    aba['C2'].font = Font(bold=True)
+    aba.row_dimensions[2].height = 30
+    pasta.save(planilha)
+
+    justificativas = pd.DataFrame({'Nome': ['Ana', 'Bia'], 'Data': [datetime(2026, 2, 3), datetime(2026, 2, 4)],
+                                   'Motivo': ['Atestado', float('nan')]})
+    reescrever_abas(planilha, {'Justificativas': justificativas})
+
+    aba = openpyxl.load_workbook(planilha)['Justificativas']
+    assert [str(intervalo) for intervalo in aba.merged_cells.ranges] == ['E1:F1']
+    assert [(v.formula1, str(v.sqref)) for v in aba.data_validations.dataValidation] == [('"Atestado,Consulta"', 'C2:C50')]
+    assert aba['C2'].fill.fgColor.rgb == '00FFFF00' and aba['C2'].font.bold
+    assert aba.row_dimensions[2].height == 30
+    # A célula formatada continua existindo mesmo vazia, e os dados são lidos de volta
+    assert aba['C3'].value is None and not aba['C3'].font.bold
+    pd.testing.assert_frame_equal(pd.read_excel(planilha, sheet_name='Justificativas'), justificativas, check_dtype=False)
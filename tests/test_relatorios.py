@@ -0,0 +1,52 @@
+import io
+import os
+import sys
+
+from openpyxl import load_workbook
+
+# Ensure project root is on sys.path when run from tests/
+RAIZ = os.path.dirname(os.path.dirname(__file__))
+sys.path.insert(0, RAIZ)
+from planilha_xml import gerar_xlsx
+from relatorios import CacheRelatorios, ModeloRelatorio
+
+
+def test_alturas_das_linhas_do_template_sao_mantidas(tmp_path):
+    pasta = load_workbook(os.path.join(RAIZ, 'relatorioChamada.xlsx'))
+    pasta.active.row_dimensions[1].height = 30
+    pasta.active.row_dimensions[4].height = 12.75
+    template = str(tmp_path / 'template.xlsx')
+    pasta.save(template)
+
+    modelo = ModeloRelatorio(template)
+    conteudo = b''.join(gerar_xlsx([(modelo.titulo, modelo.xml_aba({40: {1: ('Aluno', 0)}}, modelo.larguras))],
+                                   modelo.styles_xml, modelo.tema_xml))
+    aba = load_workbook(io.BytesIO(conteudo)).active
+    assert aba.row_dimensions[1].height == 30
+    assert aba.row_dimensions[4].height == 12.75
+    assert aba.row_dimensions[2].height is None
+    assert aba.row_dimensions[40].height is None
+    assert aba['A40'].value == 'Aluno'
+
+
+def test_cache_de_relatorios_respeita_o_limite_de_bytes():
+    cache = CacheRelatorios(limite_bytes=10)
+    cache.guardar('a', b'aaaa')
+    cache.guardar('b', b'bbbb')
+    assert cache.obter('a') == b'aaaa'  # 'b' passa a ser o usado há mais tempo
+    cache.guardar('c', b'cccc')
+    assert cache.obter('b') is None
+    assert (cache.obter('a'), cache.obter('c')) == (b'aaaa', b'cccc')
+    assert cache.estatisticas() == {"arquivos": 2, "bytes": 8, "acertos": 3, "falhas": 1}
+
+    # Regravar uma chave substitui o arquivo (sem contar os bytes duas vezes)
+    cache.guardar('a', b'AAAAAA')
+    assert cache.bytes == 10 and cache.obter('a') == b'AAAAAA'
+    # Um arquivo maior que o limite não é guardado nem descarta os demais
+    cache.guardar('d', b'd' * 11)
+    assert cache.obter('d') is None and cache.bytes == 10
+    # Nem um arquivo repassado em trechos que, somados, passam do limite
+    assert b''.join(cache.guardando('e', [b'eeeeee', b'eeeeee'])) == b'e' * 12
+    assert cache.obter('e') is None and cache.obter('c') == b'cccc'
+    assert b''.join(cache.guardando('f', [b'ff', b'ff'])) == b'ffff'
+    assert cache.obter('f') == b'ffff' and cache.obter('a') is None and cache.bytes == 8